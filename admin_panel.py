@@ -1,48 +1,38 @@
 import asyncio
+import json
 import os
 import sys
 import logging
 import psycopg2
 import re
-import uuid
+import threading
+from itertools import count
+from bisect import bisect_left
+from functools import partial
 from PySide6.QtWidgets import (
-    QApplication, QMainWindow, QTabWidget, QTableWidget, QTableWidgetItem,
+    QApplication, QMainWindow, QTabWidget, QTableView,
     QVBoxLayout, QPushButton, QDialog, QFormLayout, QLineEdit, QComboBox,
     QTextEdit, QMessageBox, QLabel, QHBoxLayout, QWidget, QInputDialog, QCheckBox
 )
-from PySide6.QtCore import Qt, QThread, QTimer
-from PySide6.QtGui import QIcon, QColor
+from PySide6.QtCore import (
+    Qt, QThread, QTimer, QDateTime, QObject, QSocketNotifier, Signal, QThreadPool, QRunnable,
+    QAbstractTableModel, QModelIndex
+)
+from PySide6.QtGui import QIcon, QColor, QPainter
+from PySide6.QtCharts import QChart, QChartView, QLineSeries, QDateTimeAxis, QValueAxis
 from dotenv import load_dotenv
 from aiogram import Bot
 import hashlib
+from database import Database, DB_CONFIG, POOL_MAX, notify_user_changed, pool_stats
+from outbox import Outbox
+from broadcast import Broadcaster
+from migrations import MIGRATE_ON_STARTUP, MigrationError, migrate
+from stats import StatsDatabase, ANALYTICS_PERIODS, format_stats
 
 load_dotenv('BOT_TOKEN.env')
 
 logging.basicConfig(level=logging.INFO)
 
-# Класс для работы с базой данных
-class Database:
-    def __init__(self):
-        self.conn = psycopg2.connect(
-            dbname="cursova",
-            user="postgres",
-            password="2791",  # Замени на свой пароль
-            host="localhost",
-            port="5432"
-        )
-
-    def __enter__(self):
-        self.cursor = self.conn.cursor()
-        return self.cursor
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.cursor.close()
-        if exc_type is None:
-            self.conn.commit()
-        else:
-            self.conn.rollback()
-        self.conn.close()
-
 # Общие стили
 STYLES = """
     QMainWindow, QDialog {
@@ -67,13 +57,13 @@ STYLES = """
     QTabBar::tab:hover {
         background-color: #357ABD;
     }
-    QTableWidget {
+    QTableView {
         background-color: #2D2D30;
         color: #D4D4D4;
         border: 1px solid #555555;
         alternate-background-color: #3C3C3C;
     }
-    QTableWidget::item:hover {
+    QTableView::item:hover {
         background-color: #357ABD;
     }
     QHeaderView::section {
@@ -103,24 +93,359 @@ STYLES = """
     }
 """
 
-class FeedbackSender(QThread):
-    def __init__(self, user_id, message, bot_token):
+# Вкладки с таблицами: запрос, ключ строки (первый столбец выборки), основная таблица
+# и таблицы из JOIN, изменение которых требует полной перезагрузки вкладки
+TABLE_TABS = {
+    "👥 Пользователи": {
+        'query': "SELECT telegram_id, full_name, phone, registered FROM users",
+        'key': "telegram_id",
+        'table': "users",
+        'joins': (),
+    },
+    "📋 Отчеты": {
+        'query': "SELECT r.id, u.full_name, r.report_text, r.created_at FROM reports r JOIN users u ON r.user_id = u.telegram_id",
+        'key': "r.id",
+        'table': "reports",
+        'joins': ("users",),
+    },
+    "🔧 Заявки": {
+        'query': "SELECT r.id, c.full_name, m.full_name, r.address, r.status, r.created_at FROM requests r LEFT JOIN users c ON r.client_id = c.telegram_id LEFT JOIN users m ON r.master_id = m.telegram_id",
+        'key': "r.id",
+        'table': "requests",
+        'joins': ("users",),
+    },
+    "📨 Фидбек": {
+        'query': "SELECT r.id, u.full_name, r.report_text, r.admin_feedback FROM reports r JOIN users u ON r.user_id = u.telegram_id",
+        'key': "r.id",
+        'table': "reports",
+        'joins': ("users",),
+    },
+    "👨‍🔧 Мастера": {
+        'query': "SELECT u.telegram_id, u.full_name, m.busyness FROM users u JOIN masters m ON u.telegram_id = m.user_id",
+        'key': "m.user_id",
+        'table': "masters",
+        'joins': ("users",),
+    },
+    "✅ Запросы мастеров": {
+        'query': "SELECT mr.user_id, u.full_name FROM master_requests mr JOIN users u ON mr.user_id = u.telegram_id",
+        'key': "mr.user_id",
+        'table': "master_requests",
+        'joins': ("users",),
+    },
+}
+
+# Таблицы, от которых зависит вкладка статистики
+STATS_TABLES = {"users", "requests", "masters"}
+# Таблицы, от которых зависят графики аналитики
+ANALYTICS_TABLES = {"requests", "reports"}
+# Графики аналитики: (заголовок, [(ряд, атрибут stats.Analytics)])
+ANALYTICS_CHARTS = [
+    ("Заявки и отчёты", [("Создано", 'created'), ("Завершено", 'completed'), ("Отчёты", 'reports')]),
+    ("Среднее время выполнения, ч", [("Время выполнения", 'avg_completion')]),
+    ("Загрузка мастеров: заявок в работе одновременно", [("В работе", 'utilization')]),
+]
+
+TABLE_CHANGES_CHANNEL = "table_changes"
+# Сколько ждать после первого уведомления, чтобы применить пачку изменений разом, мс
+CHANGES_DEBOUNCE_MS = 200
+# Период полной перезагрузки, если уведомления недоступны, мс
+FALLBACK_RELOAD_MS = 5000
+
+# Получает уведомления триггеров notify_table_change() (см. migrations/0001_initial.sql) без опроса БД:
+# сокет отдельного соединения отслеживается QSocketNotifier в главном цикле Qt
+class TableChangeListener(QObject):
+    changes = Signal(list)  # [(таблица, операция, ключ)]
+    disconnected = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.conn = None
+        self.notifier = None
+
+    @property
+    def active(self):
+        return self.conn is not None
+
+    def start(self):
+        try:
+            conn = psycopg2.connect(**DB_CONFIG)
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_proc WHERE proname = 'notify_table_change'")
+                if cursor.fetchone() is None:
+                    logging.warning("notify_table_change() is not installed, using periodic reload")
+                    conn.close()
+                    return False
+                cursor.execute(f"LISTEN {TABLE_CHANGES_CHANNEL}")
+        except psycopg2.Error as e:
+            logging.error(f"Database error: {e}")
+            return False
+        self.conn = conn
+        self.notifier = QSocketNotifier(conn.fileno(), QSocketNotifier.Read, self)
+        self.notifier.activated.connect(self.read_notifications)
+        return True
+
+    def stop(self):
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
+            self.notifier.deleteLater()
+            self.notifier = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def read_notifications(self):
+        try:
+            self.conn.poll()
+        except psycopg2.Error as e:
+            logging.error(f"Change listener connection lost: {e}")
+            self.stop()
+            self.disconnected.emit()
+            return
+        changes = []
+        while self.conn.notifies:
+            notify = self.conn.notifies.pop(0)
+            try:
+                payload = json.loads(notify.payload)
+                changes.append((payload['table'], payload['op'], payload['key']))
+            except (ValueError, KeyError):
+                logging.error(f"Malformed change notification: {notify.payload}")
+        if changes:
+            self.changes.emit(changes)
+
+# Потоков фоновой загрузки: каждый держит соединение из пула только на время запроса
+LOADER_THREADS = min(4, POOL_MAX)
+# Строк в одной странице ленивой загрузки таблиц
+PAGE_SIZE = 200
+
+def fetch_rows(query, params=None):
+    with Database() as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+# Keyset-пагинация: строки после ключа after_key в порядке ключа (по нему есть индекс)
+def fetch_page(tab, after_key, limit):
+    if after_key is None:
+        return fetch_rows(f"{tab['query']} ORDER BY {tab['key']} LIMIT %s", (limit,))
+    return fetch_rows(f"{tab['query']} WHERE {tab['key']} > %s ORDER BY {tab['key']} LIMIT %s", (after_key, limit))
+
+# Модель таблицы с ленивой догрузкой: строки запрашиваются страницами по мере прокрутки
+# (canFetchMore/fetchMore), поэтому в памяти только просмотренная часть таблицы.
+# Строки упорядочены по ключу (первый столбец), что позволяет находить их бинарным поиском.
+class LazyTableModel(QAbstractTableModel):
+    def __init__(self, headers, page_loader, parent=None):
+        super().__init__(parent)
+        self.headers = headers
+        # Функция(after_key), запускающая фоновую загрузку следующей страницы
+        self.page_loader = page_loader
+        self.rows = []
+        self.keys = []
+        self.has_more = False
+        self.fetching = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        value = self.rows[index.row()][index.column()]
+        return str(value) if value is not None else "Не назначен"
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.has_more and not self.fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self.fetching = True
+        self.page_loader(self.keys[-1] if self.keys else None)
+
+    def key_at(self, row):
+        return self.keys[row]
+
+    def row_at(self, row):
+        return self.rows[row]
+
+    def set_rows(self, rows, has_more):
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.keys = [row[0] for row in self.rows]
+        self.has_more = has_more
+        self.fetching = False
+        self.endResetModel()
+
+    def append_rows(self, rows, has_more):
+        self.fetching = False
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.keys.extend(row[0] for row in rows)
+            self.endInsertRows()
+        self.has_more = has_more
+
+    # rows — актуальные строки для ключей keys; ключи без строки удалены (или больше не подходят под запрос)
+    def apply_patch(self, keys, rows):
+        found = {row[0]: row for row in rows}
+        for key in keys:
+            pos = bisect_left(self.keys, key)
+            exists = pos < len(self.keys) and self.keys[pos] == key
+            row = found.get(key)
+            if row is None:
+                if exists:
+                    self.beginRemoveRows(QModelIndex(), pos, pos)
+                    del self.rows[pos]
+                    del self.keys[pos]
+                    self.endRemoveRows()
+            elif exists:
+                self.rows[pos] = row
+                self.dataChanged.emit(self.index(pos, 0), self.index(pos, len(self.headers) - 1))
+            elif pos < len(self.keys) or not self.has_more:
+                # Строки после последнего загруженного ключа придут с очередной страницей
+                self.beginInsertRows(QModelIndex(), pos, pos)
+                self.rows.insert(pos, row)
+                self.keys.insert(pos, key)
+                self.endInsertRows()
+
+# QRunnable не может испускать сигналы сам, поэтому они вынесены в QObject из главного потока
+class LoaderSignals(QObject):
+    finished = Signal(str, str, object, object)  # (задача, режим, контекст, результат)
+    failed = Signal(str, str)
+
+# Выполняет запрос в потоке QThreadPool и передаёт результат в GUI-поток сигналом
+class QueryTask(QRunnable):
+    def __init__(self, job, mode, fetch, context, signals):
+        super().__init__()
+        self.job = job
+        self.mode = mode
+        self.fetch = fetch
+        self.context = context
+        self.signals = signals
+
+    # Любая ошибка должна закончиться сигналом failed: иначе задача навсегда останется в panel.loading
+    # и вкладка больше не обновится (QThreadPool исключения молча проглатывает)
+    def run(self):
+        try:
+            result = self.fetch()
+        except psycopg2.Error as e:
+            logging.error(f"Database error: {e}")
+            self.signals.failed.emit(self.job, self.mode)
+            return
+        except Exception:
+            logging.exception(f"Loader task {self.job} failed")
+            self.signals.failed.emit(self.job, self.mode)
+            return
+        self.signals.finished.emit(self.job, self.mode, self.context, result)
+
+# Долгоживущий поток отправки уведомлений: один цикл событий и одна HTTP-сессия Bot на всё
+# время работы панели. send() ставит сообщение в Outbox (лимиты Telegram, повторы после 429)
+# и сразу возвращает номер задачи, результат приходит сигналами sent/failed в GUI-поток.
+# Здесь же выполняются рассылки: прогресс приходит сигналами broadcast_progress/broadcast_finished.
+class NotificationSender(QThread):
+    sent = Signal(int)
+    failed = Signal(int, str)
+    # номер рассылки, обработано, всего, ошибок, сообщений в секунду
+    broadcast_progress = Signal(int, int, int, int, float)
+    broadcast_finished = Signal(int, int, int, int, float)
+    broadcast_failed = Signal(str)
+
+    def __init__(self, bot_token):
         super().__init__()
-        self.user_id = user_id
-        self.message = message
         self.bot_token = bot_token
-    
+        self.loop = None
+        self.outbox = None
+        self.broadcaster = None
+        self.stopping = None
+        self.ready = threading.Event()
+        # Почему поток не принимает сообщения (не запустился или уже остановлен); None — работает
+        self.error = None
+        self.job_ids = count(1)
+
     def run(self):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        bot = Bot(token=self.bot_token)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
         try:
-            loop.run_until_complete(bot.send_message(self.user_id, self.message))
+            self.loop.run_until_complete(self.serve())
+            self.error = "отправка уведомлений остановлена"
         except Exception as e:
-            logging.error(f"Feedback sending error: {e}")
+            logging.exception("Notification sender error")
+            self.error = str(e) or type(e).__name__
+        finally:
+            # Иначе send()/broadcast() ждали бы навсегда, если Bot/Outbox не создались
+            self.ready.set()
+            self.loop.close()
+
+    async def serve(self):
+        self.stopping = asyncio.Event()
+        bot = Bot(token=self.bot_token)
+        self.outbox = Outbox(bot)
+        self.broadcaster = Broadcaster(self.outbox, on_progress=self.report_broadcast, on_done=self.report_broadcast_done)
+        outbox_task = asyncio.create_task(self.outbox.run())
+        self.ready.set()
+        try:
+            await self.stopping.wait()
+            # Рассылки сохраняют контрольную точку, их продолжит бот; обычные сообщения доотправляем
+            await self.broadcaster.stop()
+            await self.outbox.join()
         finally:
-            loop.run_until_complete(bot.session.close())
-            loop.close()
+            outbox_task.cancel()
+            await asyncio.gather(outbox_task, return_exceptions=True)
+            await bot.session.close()
+            self.broadcaster.adb.shutdown()
+
+    def enqueue(self, job_id, chat_id, text):
+        self.outbox.send(chat_id, text).add_done_callback(partial(self.report, job_id))
+
+    def report(self, job_id, future):
+        if future.cancelled():
+            self.failed.emit(job_id, "cancelled")
+        elif future.exception() is not None:
+            self.failed.emit(job_id, str(future.exception()))
+        else:
+            self.sent.emit(job_id)
+
+    def send(self, chat_id, text):
+        self.ready.wait()
+        job_id = next(self.job_ids)
+        if self.error is not None:
+            self.failed.emit(job_id, self.error)
+        else:
+            self.loop.call_soon_threadsafe(self.enqueue, job_id, chat_id, text)
+        return job_id
+
+    async def launch_broadcast(self, text):
+        try:
+            state = await self.broadcaster.start(text)
+            await self.report_broadcast(state)
+        except psycopg2.Error as e:
+            logging.error(f"Database error: {e}")
+            self.broadcast_failed.emit(str(e))
+
+    async def report_broadcast(self, state):
+        self.broadcast_progress.emit(state.id, state.processed, state.total, state.failed, state.rate)
+
+    async def report_broadcast_done(self, state):
+        self.broadcast_finished.emit(state.id, state.sent, state.total, state.failed, state.rate)
+
+    def broadcast(self, text):
+        self.ready.wait()
+        if self.error is not None:
+            self.broadcast_failed.emit(self.error)
+            return
+        asyncio.run_coroutine_threadsafe(self.launch_broadcast(text), self.loop)
+
+    def stop(self):
+        if self.ready.is_set() and self.isRunning():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+            self.wait()
 
 class LoginDialog(QDialog):
     def __init__(self):
@@ -162,8 +487,12 @@ class UserEditDialog(QDialog):
         self.role_combo.addItems(['client', 'admin'])
         self.registered_check = QCheckBox("Зарегистрирован")
         
+        # Telegram ID задаётся только при создании: по нему пользователя находит бот
+        self.telegram_id = QLineEdit()
         if user_data:
             self.user_id = user_data[0]
+            self.telegram_id.setText(str(self.user_id))
+            self.telegram_id.setReadOnly(True)
             self.full_name = QLineEdit(user_data[1])
             self.phone = QLineEdit(user_data[2])
             self.role_combo.setCurrentText(user_data[3])
@@ -175,6 +504,7 @@ class UserEditDialog(QDialog):
             self.role_combo.setCurrentText('client')
             self.registered_check.setChecked(False)
         
+        layout.addRow("Telegram ID:", self.telegram_id)
         layout.addRow("ФИО:", self.full_name)
         layout.addRow("Телефон:", self.phone)
         layout.addRow("Роль:", self.role_combo)
@@ -188,6 +518,9 @@ class UserEditDialog(QDialog):
         self.setStyleSheet(STYLES)
     
     def validate_input(self):
+        if not self.user_id and not self.telegram_id.text().strip().isdigit():
+            QMessageBox.warning(self, "Ошибка", "Telegram ID должен быть числом")
+            return False
         if not self.full_name.text().strip():
             QMessageBox.warning(self, "Ошибка", "Поле ФИО не может быть пустым")
             return False
@@ -212,7 +545,7 @@ class UserEditDialog(QDialog):
                     if self.role_combo.currentText() == 'admin':
                         cursor.execute("DELETE FROM masters WHERE user_id = %s", (self.user_id,))
                 else:
-                    new_id = str(uuid.uuid4())
+                    new_id = int(self.telegram_id.text().strip())
                     cursor.execute('''
                         INSERT INTO users 
                         (telegram_id, full_name, phone, role, registered) 
@@ -220,6 +553,8 @@ class UserEditDialog(QDialog):
                     ''', (new_id, self.full_name.text(), self.phone.text(), self.role_combo.currentText(), 
                           self.registered_check.isChecked()))
                     self.user_id = new_id
+                # Бот сбросит закэшированный профиль (в том числе профиль ещё не зарегистрированного пользователя)
+                notify_user_changed(cursor, self.user_id)
             QMessageBox.information(self, "Успех", "Пользователь обновлен")
             self.accept()
         except psycopg2.Error as e:
@@ -275,10 +610,10 @@ class RequestEditDialog(QDialog):
             QMessageBox.critical(self, "Ошибка", "Не удалось сохранить изменения")
 
 class FeedbackDialog(QDialog):
-    def __init__(self, report_id, bot_token: str):
+    def __init__(self, report_id, sender: NotificationSender):
         super().__init__()
         self.report_id = report_id
-        self.bot_token = bot_token
+        self.sender = sender
         self.setWindowTitle("Отправка фидбека")
         layout = QVBoxLayout()
         
@@ -310,18 +645,16 @@ class FeedbackDialog(QDialog):
                 ''', (self.report_id,))
                 user_data = cursor.fetchone()
                 
-                if user_data:
-                    user_id, report_text = user_data
-                    message = (
-                        f"📢 Новый фидбек по вашему отчету:\n\n"
-                        f"Ваш отчет: {report_text}\n\n"
-                        f"Фидбек администратора: {self.feedback_edit.toPlainText()}"
-                    )
-                    thread = FeedbackSender(user_id, message, self.bot_token)
-                    thread.start()
-                    thread.wait()
             
-            QMessageBox.information(self, "Успех", "Фидбек успешно отправлен!")
+            # Отправка идёт в фоне, о результате сообщит строка состояния главного окна
+            if user_data:
+                user_id, report_text = user_data
+                message = (
+                    f"📢 Новый фидбек по вашему отчету:\n\n"
+                    f"Ваш отчет: {report_text}\n\n"
+                    f"Фидбек администратора: {self.feedback_edit.toPlainText()}"
+                )
+                self.sender.send(user_id, message)
             self.accept()
         except Exception as e:
             logging.error(f"Error: {e}")
@@ -337,16 +670,50 @@ class AdminPanel(QMainWindow):
         self.tabs = QTabWidget()
         self.setCentralWidget(self.tabs)
         
+        self.sender = NotificationSender(bot_token)
+        self.sender.sent.connect(lambda job_id: self.statusBar().showMessage(f"Сообщение №{job_id} отправлено", 5000))
+        self.sender.failed.connect(lambda job_id, error: self.statusBar().showMessage(f"Ошибка отправки сообщения №{job_id}: {error}"))
+        self.sender.broadcast_progress.connect(lambda broadcast_id, processed, total, failed, rate: self.statusBar().showMessage(
+            f"Рассылка №{broadcast_id}: обработано {processed} из {total}, ошибок {failed}, {rate:.1f} сообщ./с"))
+        self.sender.broadcast_finished.connect(lambda broadcast_id, sent, total, failed, rate: self.statusBar().showMessage(
+            f"Рассылка №{broadcast_id} завершена: доставлено {sent} из {total}, ошибок {failed}, {rate:.1f} сообщ./с"))
+        self.sender.broadcast_failed.connect(lambda error: QMessageBox.critical(self, "Ошибка", f"Не удалось запустить рассылку: {error}"))
+        self.sender.start()
+        
         self.init_ui()
+        
+        # Запросы выполняются в фоне; по каждой вкладке в работе не больше одного запроса,
+        # а повторные запросы за это время схлопываются в одну отложенную перезагрузку/пачку ключей
+        self.loader_pool = QThreadPool(self)
+        self.loader_pool.setMaxThreadCount(LOADER_THREADS)
+        self.loader_signals = LoaderSignals(self)
+        self.loader_signals.finished.connect(self.on_task_finished)
+        self.loader_signals.failed.connect(self.on_task_failed)
+        self.loading = set()
+        self.queued_reloads = set()
+        self.queued_patches = {}
+        
+        # Инкрементальное обновление: перечитываются только строки, о которых пришло уведомление.
+        # Если уведомления недоступны, таблицы полностью перезагружаются по таймеру.
+        self.pending_changes = {}
+        self.changes_timer = QTimer(self)
+        self.changes_timer.setSingleShot(True)
+        self.changes_timer.setInterval(CHANGES_DEBOUNCE_MS)
+        self.changes_timer.timeout.connect(self.apply_changes)
+        self.listener = TableChangeListener(self)
+        self.listener.changes.connect(self.queue_changes)
+        self.listener.disconnected.connect(self.load_all_data)
+        self.listener.start()
         self.load_all_data()
         
         self.timer = QTimer(self)
-        self.timer.timeout.connect(self.load_all_data)
-        self.timer.start(5000)
+        self.timer.timeout.connect(self.fallback_reload)
+        self.timer.start(FALLBACK_RELOAD_MS)
         self.setStyleSheet(STYLES)
     
     def init_ui(self):
         self.tables = {}
+        self.models = {}
         self.init_tab("👥 Пользователи", ['ID', 'ФИО', 'Телефон', 'Зарегистрирован'], self.edit_user, add_btn=True)
         self.init_tab("📋 Отчеты", ['ID', 'Клиент', 'Отчет', 'Дата'], self.show_report_details)
         self.init_tab("🔧 Заявки", ['ID', 'Клиент', 'Мастер', 'Адрес', 'Статус', 'Дата создания'], self.edit_request)
@@ -359,6 +726,29 @@ class AdminPanel(QMainWindow):
         layout = QVBoxLayout()
         self.stats_label = QLabel()
         layout.addWidget(self.stats_label)
+        period_layout = QHBoxLayout()
+        period_layout.addWidget(QLabel("Период:"))
+        self.period_combo = QComboBox()
+        self.period_combo.addItems(list(ANALYTICS_PERIODS))
+        self.period_combo.currentTextChanged.connect(self.load_analytics)
+        period_layout.addWidget(self.period_combo)
+        period_layout.addStretch()
+        layout.addLayout(period_layout)
+        charts_layout = QHBoxLayout()
+        self.charts = []
+        for title, _ in ANALYTICS_CHARTS:
+            chart = QChart()
+            chart.setTitle(title)
+            chart.setTheme(QChart.ChartThemeDark)
+            view = QChartView(chart)
+            view.setRenderHint(QPainter.Antialiasing)
+            view.setMinimumHeight(260)
+            charts_layout.addWidget(view)
+            self.charts.append(chart)
+        layout.addLayout(charts_layout)
+        broadcast_btn = QPushButton("📢 Рассылка всем пользователям")
+        broadcast_btn.clicked.connect(self.start_broadcast)
+        layout.addWidget(broadcast_btn)
         widget.setLayout(layout)
         self.tabs.addTab(widget, "📊 Статистика")
 
@@ -366,9 +756,10 @@ class AdminPanel(QMainWindow):
         widget = QWidget()
         layout = QVBoxLayout()
         
-        table = QTableWidget()
-        table.setColumnCount(len(headers))
-        table.setHorizontalHeaderLabels(headers)
+        table = QTableView()
+        model = LazyTableModel(headers, partial(self.load_page, title), table)
+        table.setModel(model)
+        table.setAlternatingRowColors(True)
         table.doubleClicked.connect(double_click_handler)
         
         if add_btn:
@@ -381,67 +772,179 @@ class AdminPanel(QMainWindow):
         layout.addWidget(table)
         widget.setLayout(layout)
         self.tables[title] = table
+        self.models[title] = model
         self.tabs.addTab(widget, title)
 
-    def load_table_data(self, table, query, transform_row=None):
-        try:
-            with Database() as cursor:
-                cursor.execute(query)
-                data = cursor.fetchall()
-            
-            table.setRowCount(len(data))
-            for row_idx, row in enumerate(data):
-                row_data = transform_row(row) if transform_row else row
-                for col_idx, value in enumerate(row_data):
-                    item = QTableWidgetItem(str(value) if value is not None else "Не назначен")
-                    item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                    table.setItem(row_idx, col_idx, item)
-        except psycopg2.Error as e:
-            logging.error(f"Database error: {e}")
+    def start_task(self, job, mode, fetch, context=None):
+        self.loading.add(job)
+        self.loader_pool.start(QueryTask(job, mode, fetch, context, self.loader_signals))
+
+    # Перезагружает уже загруженную часть таблицы (не меньше одной страницы)
+    def reload_tab(self, title):
+        if title in self.loading:
+            self.queued_reloads.add(title)
+            self.queued_patches.pop(title, None)
+            return
+        limit = max(PAGE_SIZE, self.models[title].rowCount())
+        self.start_task(title, 'reload', partial(fetch_page, TABLE_TABS[title], None, limit + 1), limit)
+
+    def load_page(self, title, after_key):
+        model = self.models[title]
+        if title in self.loading:
+            # Идёт перезагрузка вкладки; представление запросит страницу снова при прокрутке
+            model.fetching = False
+            return
+        self.start_task(title, 'page', partial(fetch_page, TABLE_TABS[title], after_key, PAGE_SIZE + 1), PAGE_SIZE)
+
+    def on_task_finished(self, job, mode, context, result):
+        self.loading.discard(job)
+        if job == 'stats':
+            self.show_stats(result)
+        elif job == 'analytics':
+            self.show_analytics(result)
+        elif mode == 'reload':
+            self.models[job].set_rows(result[:context], len(result) > context)
+        elif mode == 'page':
+            self.models[job].append_rows(result[:context], len(result) > context)
+        else:
+            self.models[job].apply_patch(context, result)
+        self.run_queued(job)
+
+    def on_task_failed(self, job, mode):
+        self.loading.discard(job)
+        if job == 'stats':
+            self.stats_label.setText("Ошибка загрузки статистики")
+        elif job == 'analytics':
+            self.statusBar().showMessage("Ошибка загрузки аналитики", 5000)
+        elif mode == 'page':
+            self.models[job].fetching = False
+        self.run_queued(job)
+
+    def run_queued(self, job):
+        if job in self.queued_reloads:
+            self.queued_reloads.discard(job)
+            if job == 'stats':
+                self.load_stats()
+            elif job == 'analytics':
+                self.load_analytics()
+            else:
+                self.reload_tab(job)
+        elif job in self.queued_patches:
+            self.patch_tab(job, self.queued_patches.pop(job))
 
     def load_all_data(self):
-        self.load_table_data(self.tables["👥 Пользователи"], 
-                             "SELECT telegram_id, full_name, phone, registered FROM users")
-        self.load_table_data(self.tables["📋 Отчеты"], 
-                             "SELECT r.id, u.full_name, r.report_text, r.created_at FROM reports r JOIN users u ON r.user_id = u.telegram_id")
-        self.load_table_data(self.tables["🔧 Заявки"], 
-                             "SELECT r.id, c.full_name, m.full_name, r.address, r.status, r.created_at FROM requests r LEFT JOIN users c ON r.client_id = c.telegram_id LEFT JOIN users m ON r.master_id = m.telegram_id")
-        self.load_table_data(self.tables["📨 Фидбек"], 
-                             "SELECT r.id, u.full_name, r.report_text, r.admin_feedback FROM reports r JOIN users u ON r.user_id = u.telegram_id")
-        self.load_table_data(self.tables["👨‍🔧 Мастера"], 
-                             "SELECT u.telegram_id, u.full_name, m.busyness FROM users u JOIN masters m ON u.telegram_id = m.user_id")
-        self.load_table_data(self.tables["✅ Запросы мастеров"], 
-                             "SELECT mr.user_id, u.full_name FROM master_requests mr JOIN users u ON mr.user_id = u.telegram_id")
+        self.pending_changes.clear()
+        for title in TABLE_TABS:
+            self.reload_tab(title)
         self.load_stats()
+        self.load_analytics()
+
+    def fallback_reload(self):
+        if self.listener.active:
+            return
+        # Пытаемся восстановить подписку; изменения за время разрыва покроет полная перезагрузка
+        self.listener.start()
+        self.load_all_data()
+
+    def queue_changes(self, changes):
+        for table, op, key in changes:
+            pending = self.pending_changes.setdefault(table, {'keys': set(), 'structural': False})
+            pending['keys'].add(key)
+            # Изменение/удаление строки в таблице из JOIN меняет строки других вкладок
+            pending['structural'] = pending['structural'] or op != 'INSERT'
+        if not self.changes_timer.isActive():
+            self.changes_timer.start()
+
+    def apply_changes(self):
+        changed, self.pending_changes = self.pending_changes, {}
+        for title, tab in TABLE_TABS.items():
+            if any(changed.get(table, {}).get('structural') for table in tab['joins']):
+                self.reload_tab(title)
+            elif tab['table'] in changed:
+                self.patch_tab(title, changed[tab['table']]['keys'])
+        if STATS_TABLES & changed.keys():
+            self.load_stats()
+        if ANALYTICS_TABLES & changed.keys():
+            self.load_analytics()
+
+    # Перечитывает только строки с указанными ключами: обновляет, добавляет или удаляет их в таблице
+    def patch_tab(self, title, keys):
+        tab = TABLE_TABS[title]
+        keys = {key for key in keys if key is not None and key.lstrip('-').isdigit()}
+        if not keys:
+            return
+        if title in self.loading:
+            if title not in self.queued_reloads:
+                self.queued_patches.setdefault(title, set()).update(keys)
+            return
+        keys = [int(key) for key in keys]
+        query = f"{tab['query']} WHERE {tab['key']} = ANY(%s)"
+        self.start_task(title, 'patch', partial(fetch_rows, query, (keys,)), keys)
 
     def load_stats(self):
-        try:
-            with Database() as cursor:
-                cursor.execute("SELECT COUNT(*) FROM users")
-                total_users = cursor.fetchone()[0] or 0
-                cursor.execute("SELECT COUNT(*) FROM requests WHERE status = 'pending'")
-                pending = cursor.fetchone()[0] or 0
-                cursor.execute("SELECT COALESCE(AVG(busyness), 0) FROM masters")
-                avg_load = float(cursor.fetchone()[0] or 0)
-            
-            self.stats_label.setText(f"""
-📈 Статистика:
-👥 Всего пользователей: {total_users}
-⏳ Ожидающих заявок: {pending}
-📦 Средняя загрузка мастеров: {avg_load:.1f}
+        if 'stats' in self.loading:
+            self.queued_reloads.add('stats')
+            return
+        self.start_task('stats', 'reload', StatsDatabase.get_stats)
+
+    def show_stats(self, stats):
+        pool = pool_stats()
+        self.stats_label.setText(f"""
+{format_stats(stats)}
+
+🗄 Пул соединений: занято {pool['in_use']} из {pool['size']} (макс. {pool['max']}), ожиданий {pool['waits']}, среднее ожидание {pool['avg_wait'] * 1000:.1f} мс
 """)
-        except psycopg2.Error as e:
-            logging.error(f"Database error: {e}")
-            self.stats_label.setText("Ошибка загрузки статистики")
+
+    def load_analytics(self):
+        if 'analytics' in self.loading:
+            self.queued_reloads.add('analytics')
+            return
+        bucket, count = ANALYTICS_PERIODS[self.period_combo.currentText()]
+        self.start_task('analytics', 'reload', partial(StatsDatabase.get_analytics, bucket, count))
+
+    def show_analytics(self, analytics):
+        times = [bucket.timestamp() * 1000 for bucket in analytics.buckets]
+        for chart, (_, series_list) in zip(self.charts, ANALYTICS_CHARTS):
+            chart.removeAllSeries()
+            for axis in chart.axes():
+                chart.removeAxis(axis)
+            axis_x = QDateTimeAxis()
+            axis_x.setFormat("dd.MM HH:mm" if analytics.bucket == 'hour' else "dd.MM.yy")
+            axis_x.setTickCount(6)
+            axis_y = QValueAxis()
+            axis_y.setLabelFormat("%.1f")
+            chart.addAxis(axis_x, Qt.AlignBottom)
+            chart.addAxis(axis_y, Qt.AlignLeft)
+            top = 0.0
+            for name, attribute in series_list:
+                series = QLineSeries()
+                series.setName(name)
+                for moment, value in zip(times, getattr(analytics, attribute)):
+                    # Интервалы без завершённых заявок пропускаются: у них нет времени выполнения
+                    if value is not None:
+                        series.append(moment, value)
+                        top = max(top, value)
+                chart.addSeries(series)
+                series.attachAxis(axis_x)
+                series.attachAxis(axis_y)
+            if times:
+                axis_x.setRange(QDateTime.fromMSecsSinceEpoch(int(times[0])), QDateTime.fromMSecsSinceEpoch(int(times[-1])))
+            axis_y.setRange(0, top * 1.1 or 1)
+            chart.legend().setVisible(len(series_list) > 1)
+
+    def start_broadcast(self):
+        text, ok = QInputDialog.getMultiLineText(self, "Рассылка", "Текст сообщения для всех пользователей:")
+        if ok and text.strip():
+            self.sender.broadcast(text)
+            self.statusBar().showMessage("Рассылка запускается...")
 
     def add_user(self):
         dialog = UserEditDialog()
         if dialog.exec() == QDialog.Accepted:
-            self.load_table_data(self.tables["👥 Пользователи"], 
-                                 "SELECT telegram_id, full_name, phone, registered FROM users")
+            self.reload_tab("👥 Пользователи")
 
     def edit_user(self, index):
-        user_id = self.tables["👥 Пользователи"].item(index.row(), 0).text()
+        user_id = self.models["👥 Пользователи"].key_at(index.row())
         try:
             with Database() as cursor:
                 cursor.execute('SELECT full_name, phone, role, registered FROM users WHERE telegram_id = %s', (user_id,))
@@ -449,71 +952,78 @@ class AdminPanel(QMainWindow):
             
             dialog = UserEditDialog((user_id, *user_data))
             if dialog.exec() == QDialog.Accepted:
-                self.load_table_data(self.tables["👥 Пользователи"], 
-                                     "SELECT telegram_id, full_name, phone, registered FROM users")
+                self.reload_tab("👥 Пользователи")
         except psycopg2.Error as e:
             logging.error(f"Database error: {e}")
             QMessageBox.critical(self, "Ошибка", "Не удалось обновить пользователя")
 
     def edit_request(self, index):
-        request_id = self.tables["🔧 Заявки"].item(index.row(), 0).text()
+        request_id = self.models["🔧 Заявки"].key_at(index.row())
         dialog = RequestEditDialog(request_id)
         if dialog.exec() == QDialog.Accepted:
-            self.load_table_data(self.tables["🔧 Заявки"], 
-                                 "SELECT r.id, c.full_name, m.full_name, r.address, r.status, r.created_at FROM requests r LEFT JOIN users c ON r.client_id = c.telegram_id LEFT JOIN users m ON r.master_id = m.telegram_id")
-            self.load_table_data(self.tables["👨‍🔧 Мастера"], 
-                                 "SELECT u.telegram_id, u.full_name, m.busyness FROM users u JOIN masters m ON u.telegram_id = m.user_id")
+            self.reload_tab("🔧 Заявки")
+            self.reload_tab("👨‍🔧 Мастера")
             QMessageBox.information(self, "Успех", "Заявка успешно обновлена!")
 
     def edit_feedback(self, index):
-        report_id = self.tables["📨 Фидбек"].item(index.row(), 0).text()
-        dialog = FeedbackDialog(report_id, self.bot_token)
+        report_id = self.models["📨 Фидбек"].key_at(index.row())
+        dialog = FeedbackDialog(report_id, self.sender)
         if dialog.exec() == QDialog.Accepted:
-            self.load_table_data(self.tables["📨 Фидбек"], 
-                                 "SELECT r.id, u.full_name, r.report_text, r.admin_feedback FROM reports r JOIN users u ON r.user_id = u.telegram_id")
+            self.reload_tab("📨 Фидбек")
+            self.statusBar().showMessage("Фидбек сохранён, отправка клиенту...")
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.listener.stop()
+        self.sender.stop()
+        super().closeEvent(event)
 
     def edit_master(self, index):
-        master_id = self.tables["👨‍🔧 Мастера"].item(index.row(), 0).text()
+        master_id = self.models["👨‍🔧 Мастера"].key_at(index.row())
         try:
             with Database() as cursor:
                 cursor.execute('SELECT busyness FROM masters WHERE user_id = %s', (master_id,))
                 busyness = cursor.fetchone()[0]
-                
-                new_busyness, ok = QInputDialog.getInt(self, "Редактирование загруженности", "Новая загруженность:", busyness, 0, 100)
-                if ok:
+            
+            # Диалог показываем вне блока with, чтобы не держать соединение из пула
+            new_busyness, ok = QInputDialog.getInt(self, "Редактирование загруженности", "Новая загруженность:", busyness, 0, 100)
+            if ok:
+                with Database() as cursor:
                     cursor.execute('UPDATE masters SET busyness = %s WHERE user_id = %s', (new_busyness, master_id))
-                    self.load_table_data(self.tables["👨‍🔧 Мастера"], 
-                                         "SELECT u.telegram_id, u.full_name, m.busyness FROM users u JOIN masters m ON u.telegram_id = m.user_id")
+                self.reload_tab("👨‍🔧 Мастера")
         except psycopg2.Error as e:
             logging.error(f"Database error: {e}")
             QMessageBox.critical(self, "Ошибка", "Не удалось обновить загруженность мастера")
 
     def confirm_or_reject_master(self, index):
-        user_id = self.tables["✅ Запросы мастеров"].item(index.row(), 0).text()
+        model = self.models["✅ Запросы мастеров"]
+        user_id = model.key_at(index.row())
+        # Имя уже загружено во вкладку (и обновляется по уведомлениям об изменении users)
+        user_name = model.row_at(index.row())[1]
         action, ok = QInputDialog.getItem(self, "Подтверждение", "Выберите действие:", ["Подтвердить", "Отклонить"], 0, False)
         if not ok:
             return
         
         try:
             with Database() as cursor:
-                cursor.execute("SELECT full_name FROM users WHERE telegram_id = %s", (user_id,))
-                user_name = cursor.fetchone()[0]
-                
                 if action == "Подтвердить":
                     cursor.execute("INSERT INTO masters (user_id, busyness) VALUES (%s, 0) ON CONFLICT (user_id) DO NOTHING", (user_id,))
-                    QMessageBox.information(self, "Успех", f"Пользователь {user_name} теперь мастер.")
-                else:
-                    QMessageBox.information(self, "Успех", f"Запрос пользователя {user_name} отклонен.")
+                    notify_user_changed(cursor, user_id)
                 
                 cursor.execute("DELETE FROM master_requests WHERE user_id = %s", (user_id,))
-                self.load_table_data(self.tables["✅ Запросы мастеров"], 
-                                     "SELECT mr.user_id, u.full_name FROM master_requests mr JOIN users u ON mr.user_id = u.telegram_id")
+            
+            # Перезагружаем после COMMIT, иначе другое соединение пула не увидит удаления
+            self.reload_tab("✅ Запросы мастеров")
+            if action == "Подтвердить":
+                QMessageBox.information(self, "Успех", f"Пользователь {user_name} теперь мастер.")
+            else:
+                QMessageBox.information(self, "Успех", f"Запрос пользователя {user_name} отклонен.")
         except psycopg2.Error as e:
             logging.error(f"Database error: {e}")
             QMessageBox.critical(self, "Ошибка", "Не удалось обработать запрос.")
 
     def show_report_details(self, index):
-        report_id = self.tables["📋 Отчеты"].item(index.row(), 0).text()
+        report_id = self.models["📋 Отчеты"].key_at(index.row())
         try:
             with Database() as cursor:
                 cursor.execute('SELECT report_text, admin_feedback FROM reports WHERE id = %s', (report_id,))
@@ -555,6 +1065,14 @@ if __name__ == "__main__":
     if login_dialog.exec() != QDialog.Accepted:
         sys.exit(0)
     
+    if MIGRATE_ON_STARTUP:
+        try:
+            migrate()
+        except (MigrationError, psycopg2.Error) as e:
+            logging.error(f"Migration error: {e}")
+            QMessageBox.critical(None, "Ошибка", "Не удалось обновить схему базы данных")
+            sys.exit(1)
+    
     window = AdminPanel(bot_token)
     window.show()
     try:
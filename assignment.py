@@ -0,0 +1,153 @@
+import os
+import heapq
+import asyncio
+import logging
+import psycopg2
+from database import Database, AsyncDatabase
+
+# Автоматическое назначение мастеров: ожидающие заявки без мастера по очереди (старые первыми) достаются
+# ближайшему свободному мастеру, если известны координаты заявки и мастеров (geo.py), иначе —
+# наименее занятому (masters.busyness — число заявок в работе, его ведут триггеры).
+# Назначенная заявка сразу переходит в статус in_progress. AUTO_ASSIGN=0 — назначает только администратор.
+AUTO_ASSIGN = os.getenv('AUTO_ASSIGN', '1') != '0'
+# Сколько заявок назначается одной транзакцией
+ASSIGN_BATCH = int(os.getenv('ASSIGN_BATCH', '100'))
+# Больше заявок в работе мастеру не назначается; остальные ждут, пока кто-нибудь освободится
+MASTER_MAX_BUSYNESS = int(os.getenv('MASTER_MAX_BUSYNESS', '3'))
+# Проверка без сигнала wake(): заявки, созданные другими процессами, и освободившиеся мастера, с
+ASSIGN_INTERVAL = float(os.getenv('ASSIGN_INTERVAL', '30'))
+# Сколько ближайших свободных мастеров рассматривается для заявки с координатами
+ASSIGN_NEAREST_CANDIDATES = int(os.getenv('ASSIGN_NEAREST_CANDIDATES', '5'))
+
+
+class AssignmentDatabase(Database):
+    # Назначает до limit самых старых ожидающих заявок одной транзакцией; возвращает
+    # [(request_id, client_id, master_id, address)]. Заявки и мастера блокируются с SKIP LOCKED:
+    # несколько процессов распределяют одновременно, не дожидаясь друг друга и не назначая одно дважды
+    @staticmethod
+    def assign_batch(limit, max_busyness, candidates=ASSIGN_NEAREST_CANDIDATES):
+        with AssignmentDatabase() as cursor:
+            cursor.execute("""
+                SELECT id, location IS NOT NULL FROM requests
+                WHERE status = 'pending' AND master_id IS NULL
+                ORDER BY created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (limit,))
+            requests = cursor.fetchall()
+            if not requests:
+                return []
+            assignments = []
+            planned = {}
+            located = [request_id for request_id, has_location in requests if has_location]
+            if located and candidates:
+                # Для всех заявок с координатами сразу: по candidates ближайших свободных мастеров
+                # (обход GiST-индекса idx_masters_location), ближние первыми
+                cursor.execute("""
+                    SELECT r.id, m.user_id, m.busyness
+                    FROM unnest(%(ids)s::bigint[]) WITH ORDINALITY AS q(id, position)
+                    JOIN requests r ON r.id = q.id
+                    CROSS JOIN LATERAL (
+                        SELECT user_id, busyness, location <-> r.location AS distance FROM masters
+                        WHERE location IS NOT NULL AND busyness < %(max_busyness)s
+                        ORDER BY location <-> r.location
+                        LIMIT %(candidates)s
+                        FOR UPDATE SKIP LOCKED
+                    ) m
+                    ORDER BY q.position, m.distance
+                """, {'ids': located, 'max_busyness': max_busyness, 'candidates': candidates})
+                nearest = {}
+                for request_id, master_id, busyness in cursor.fetchall():
+                    nearest.setdefault(request_id, []).append((master_id, busyness))
+                for request_id in located:
+                    for master_id, busyness in nearest.get(request_id, ()):
+                        if busyness + planned.get(master_id, 0) < max_busyness:
+                            assignments.append((request_id, master_id))
+                            planned[master_id] = planned.get(master_id, 0) + 1
+                            break
+            assigned = {request_id for request_id, _ in assignments}
+            request_ids = [request_id for request_id, _ in requests if request_id not in assigned]
+            if request_ids:
+                # Жадному распределению n заявок хватает n наименее занятых мастеров
+                cursor.execute("""
+                    SELECT user_id, busyness FROM masters
+                    WHERE busyness < %s
+                    ORDER BY busyness
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                """, (max_busyness, len(request_ids) + len(planned)))
+                masters = [(master_id, busyness + planned.get(master_id, 0)) for master_id, busyness in cursor.fetchall()]
+                assignments += plan_assignments(request_ids, masters, max_busyness)
+            if not assignments:
+                return []
+            # busyness мастеров увеличит триггер requests_busyness_on_update
+            cursor.execute("""
+                UPDATE requests r SET master_id = a.master_id, status = 'in_progress'
+                FROM unnest(%s::bigint[], %s::bigint[]) AS a(id, master_id)
+                WHERE r.id = a.id
+                RETURNING r.id, r.client_id, r.master_id, r.address
+            """, ([request_id for request_id, _ in assignments], [master_id for _, master_id in assignments]))
+            return cursor.fetchall()
+
+
+# Каждая заявка по порядку достаётся мастеру, наименее занятому с учётом уже распределённых:
+# куча (busyness, user_id), O(log m) на заявку. masters — [(user_id, busyness)].
+# Возвращает [(request_id, master_id)]; заявки, на которые не хватило мастеров, не попадают в результат
+def plan_assignments(request_ids, masters, max_busyness):
+    heap = [(busyness, user_id) for user_id, busyness in masters]
+    heapq.heapify(heap)
+    assignments = []
+    for request_id in request_ids:
+        if not heap:
+            break
+        busyness, master_id = heap[0]
+        assignments.append((request_id, master_id))
+        if busyness + 1 < max_busyness:
+            heapq.heapreplace(heap, (busyness + 1, master_id))
+        else:
+            heapq.heappop(heap)
+    return assignments
+
+
+# Фоновое распределение заявок в процессе бота: пачками по batch_size, пока есть заявки и свободные мастера;
+# затем ждёт wake() (новая заявка, мастер освободился) или interval секунд
+class AssignmentEngine:
+    # on_assigned — корутина, получает пачку назначений [(request_id, client_id, master_id, address)]
+    def __init__(self, adb=None, batch_size=ASSIGN_BATCH, max_busyness=MASTER_MAX_BUSYNESS, on_assigned=None):
+        self.adb = adb or AsyncDatabase(AssignmentDatabase, max_workers=1)
+        self.batch_size = batch_size
+        self.max_busyness = max_busyness
+        self.on_assigned = on_assigned
+        self.wakeup = asyncio.Event()
+        self.metrics = {'batches': 0, 'assigned': 0}
+
+    def wake(self):
+        self.wakeup.set()
+
+    # Одно распределение до исчерпания заявок или свободных мастеров; возвращает число назначенных
+    async def run_once(self):
+        total = 0
+        while True:
+            assignments = await self.adb.assign_batch(self.batch_size, self.max_busyness)
+            if assignments:
+                self.metrics['batches'] += 1
+                self.metrics['assigned'] += len(assignments)
+                total += len(assignments)
+                if self.on_assigned:
+                    await self.on_assigned(assignments)
+            if len(assignments) < self.batch_size:
+                return total
+
+    async def run(self, interval=ASSIGN_INTERVAL):
+        while True:
+            self.wakeup.clear()
+            try:
+                assigned = await self.run_once()
+                if assigned:
+                    logging.info(f"Assigned {assigned} requests to masters")
+            except psycopg2.Error as e:
+                logging.error(f"Database error: {e}")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
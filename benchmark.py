@@ -0,0 +1,1498 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import random
+import sys
+import psycopg2
+import statistics
+import time
+from psycopg2.extras import execute_values
+from database import Database, AsyncDatabase, DB_CONFIG, POOL_MAX, get_pool
+from stats import BUCKET_LENGTHS
+
+# Бенчмарки бота (параметры подключения берутся из переменных DB_*).
+# Запуск: python benchmark.py [--db <база>] <сценарий> [параметры], список сценариев: python benchmark.py -h
+# Сценарии, которые пишут в базу, запускаются только на явно указанной базе (--db или DB_NAME),
+# а не на базе бота по умолчанию.
+
+# Тестовые строки получают отрицательные telegram_id от BENCH_ID_BASE: Telegram выдаёт пользователям
+# только положительные id, поэтому тестовые пользователи не пересекаются с настоящими,
+# а cleanup_seed удаляет только строки с отрицательными id
+BENCH_ID_BASE = -1_000_000_000_000
+
+
+class BenchDatabase(Database):
+    # Имитация медленного запроса: один round trip длительностью delay секунд
+    @staticmethod
+    def slow_query(delay: float):
+        with BenchDatabase() as cursor:
+            cursor.execute("SELECT pg_sleep(%s)", (delay,))
+
+
+# Пользователи с telegram_id от BENCH_ID_BASE, каждый masters_every-й — мастер, каждый тысячный — администратор.
+# Триггеры отключены: иначе все строки одной транзакции обновляют одну и ту же строку счётчиков статистики,
+# и её версии копятся до конца транзакции (миллион пользователей вставлялся бы десятки минут);
+# счётчики пересчитываются после вставки
+def seed_users(rows, masters_every=10):
+    with Database() as cursor:
+        cursor.execute("SET LOCAL session_replication_role = replica")
+        execute_values(
+            cursor,
+            "INSERT INTO users (telegram_id, full_name, phone, role, registered) VALUES %s",
+            ((BENCH_ID_BASE + i, f"Bench User {i}", "+70000000000", 'admin' if i % 1000 == 0 else 'client', True)
+             for i in range(rows)),
+            page_size=10000,
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO masters (user_id, busyness) VALUES %s",
+            ((BENCH_ID_BASE + i, 0) for i in range(0, rows, masters_every)),
+            page_size=10000,
+        )
+        cursor.execute("ANALYZE users")
+        cursor.execute("ANALYZE masters")
+    with Database() as cursor:
+        cursor.execute("SELECT refresh_stats()")
+
+
+# Пользователи (seed_users) и rows заявок, созданных равномерно за последние span секунд (по умолчанию rows):
+# последние 10% не завершены (каждая пятая ждёт мастера), остальные завершены; по отчёту на каждого
+# двадцатого клиента. Генерируется на стороне сервера с отключёнными триггерами, затем счётчики
+# статистики и итоги аналитики пересчитываются
+def seed_requests(rows, users=100000, masters_every=10, span=None):
+    seed_users(users, masters_every)
+    active_from = rows - rows // 10
+    with Database() as cursor:
+        cursor.execute("SET LOCAL session_replication_role = replica")
+        cursor.execute("""
+            INSERT INTO requests (client_id, master_id, address, status, created_at, started_at, completed_at)
+            SELECT client_id, master_id, address, status, created_at,
+                   CASE WHEN status != 'pending' THEN LEAST(created_at + interval '10 minutes', CURRENT_TIMESTAMP) END,
+                   CASE WHEN status = 'completed' THEN created_at + make_interval(mins => 30 + j %% 240) END
+            FROM (
+                SELECT j,
+                       %(base)s + j %% %(users)s AS client_id,
+                       CASE WHEN j >= %(active_from)s AND j %% 5 = 0 THEN NULL
+                            ELSE %(base)s + (j * 7 %% (%(users)s / %(masters_every)s)) * %(masters_every)s END AS master_id,
+                       'ул. Тестовая, ' || j AS address,
+                       CASE WHEN j < %(active_from)s THEN 'completed'
+                            WHEN j %% 5 = 0 THEN 'pending' ELSE 'in_progress' END AS status,
+                       CURRENT_TIMESTAMP - make_interval(secs => (%(rows)s - j)::float8 * %(span)s / %(rows)s) AS created_at
+                FROM generate_series(0, %(rows)s - 1) j
+            ) seed
+        """, {'base': BENCH_ID_BASE, 'users': users, 'masters_every': masters_every,
+              'rows': rows, 'active_from': active_from, 'span': span or rows})
+        cursor.execute("""
+            INSERT INTO reports (user_id, report_text, created_at)
+            SELECT %s + i, 'Отчёт ' || i, CURRENT_TIMESTAMP - make_interval(secs => i::float8 * %s / %s)
+            FROM generate_series(0, %s - 1, 20) i
+        """, (BENCH_ID_BASE, span or users, users, users))
+    with Database() as cursor:
+        for table in ("requests", "reports"):
+            cursor.execute(f"ANALYZE {table}")
+        cursor.execute("SELECT refresh_stats()")
+
+
+def cleanup_seed():
+    with Database() as cursor:
+        # Проверки внешних ключей отключены, поэтому чужие строки, ссылающиеся на тестовых пользователей,
+        # не трогаются и не остаются с висячей ссылкой: очистка прерывается
+        cursor.execute("SELECT COUNT(*) FROM requests WHERE master_id < 0 AND client_id > 0")
+        foreign = cursor.fetchone()[0]
+        if foreign:
+            raise RuntimeError(f"{foreign} requests of real clients are assigned to benchmark masters, "
+                               f"benchmark rows are left in place")
+        cursor.execute("SET LOCAL session_replication_role = replica")
+        for table, column in (("master_requests", "user_id"), ("masters", "user_id"), ("reports", "user_id"),
+                              ("requests", "client_id"), ("users", "telegram_id")):
+            cursor.execute(f"DELETE FROM {table} WHERE {column} < 0")
+    with Database() as cursor:
+        cursor.execute("SELECT refresh_stats()")
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def print_row(name, latencies, total_time, extra=""):
+    print(
+        f"{name:<22} n={len(latencies):<6} {len(latencies) / total_time:>9.1f} req/s  "
+        f"p50={percentile(latencies, 50) * 1000:>8.1f} ms  p99={percentile(latencies, 99) * 1000:>8.1f} ms  "
+        f"mean={statistics.fmean(latencies) * 1000:>8.1f} ms {extra}"
+    )
+
+
+# Измеряет максимальную задержку цикла событий: насколько позже срабатывает таймер с шагом interval
+async def monitor_loop_lag(stop: asyncio.Event, interval=0.01):
+    worst = 0.0
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        worst = max(worst, loop.time() - started - interval)
+    return worst
+
+
+async def run_handlers(handler, updates, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def process(_):
+        async with semaphore:
+            started = time.perf_counter()
+            await handler()
+            latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(monitor_loop_lag(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(process(i) for i in range(updates)))
+    total = time.perf_counter() - started
+    stop.set()
+    return latencies, total, await lag_task
+
+
+# Сравнение блокирующих запросов внутри async-обработчиков с выполнением через AsyncDatabase
+def bench_async_db(args):
+    adb = AsyncDatabase(BenchDatabase, max_workers=args.workers)
+
+    async def blocking_handler():
+        BenchDatabase.slow_query(args.latency)
+
+    async def async_handler():
+        await adb.slow_query(args.latency)
+
+    async def main():
+        # Прогрев пула, чтобы в замер не попало открытие соединений
+        await asyncio.gather(*(adb.slow_query(0) for _ in range(args.workers)))
+        print(f"updates={args.updates} concurrency={args.concurrency} query latency={args.latency * 1000:.0f} ms "
+              f"workers={args.workers}")
+        for name, handler in (("blocking psycopg2", blocking_handler), ("AsyncDatabase", async_handler)):
+            latencies, total, lag = await run_handlers(handler, args.updates, args.concurrency)
+            print_row(name, latencies, total, f"max loop lag={lag * 1000:.1f} ms")
+
+    try:
+        asyncio.run(main())
+    finally:
+        adb.shutdown()
+
+
+# Прежняя реализация show_users: отдельный get_user_role (соединение + 2 запроса) на каждого не-мастера
+def legacy_users_listing():
+    with Database() as cursor:
+        cursor.execute("SELECT telegram_id, full_name FROM users WHERE telegram_id >= %s", (BENCH_ID_BASE,))
+        users = cursor.fetchall()
+        cursor.execute("SELECT user_id FROM masters WHERE user_id >= %s", (BENCH_ID_BASE,))
+        masters = set(row[0] for row in cursor.fetchall())
+    result = []
+    for user in users:
+        if user[0] in masters:
+            role = 'master'
+        else:
+            with Database() as cursor:
+                cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (str(user[0]),))
+                user_role = cursor.fetchone()
+                if user_role and user_role[0] == 'admin':
+                    role = 'admin'
+                else:
+                    cursor.execute("SELECT COUNT(*) FROM masters WHERE user_id = %s", (str(user[0]),))
+                    role = 'master' if cursor.fetchone()[0] > 0 else 'client'
+        result.append((user[0], user[1], role))
+    return result
+
+
+def paged_users_listing(page_size):
+    result = []
+    after_id = BENCH_ID_BASE - 1
+    while True:
+        page = BotDatabase.get_users_page(after_id, page_size)
+        result.extend(page)
+        if len(page) < page_size:
+            return result
+        after_id = page[-1][0]
+
+
+# Список пользователей: N+1 (старый show_users) против постраничного запроса с ролью, вычисленной в БД
+def bench_show_users(args):
+    global BotDatabase
+    from main import Database as BotDatabase
+    for rows in args.rows:
+        seed_users(rows)
+        try:
+            variants = [("keyset pages", lambda: paged_users_listing(args.page_size))]
+            if rows <= args.legacy_limit:
+                variants.insert(0, ("legacy N+1", legacy_users_listing))
+            for name, listing in variants:
+                acquired = get_pool().stats()['acquired']
+                started = time.perf_counter()
+                result = listing()
+                elapsed = time.perf_counter() - started
+                connections = get_pool().stats()['acquired'] - acquired
+                print(f"rows={rows:<8} {name:<14} {elapsed * 1000:>10.1f} ms  "
+                      f"{elapsed / len(result) * 1e6:>8.2f} us/row  pool checkouts={connections}")
+        finally:
+            cleanup_seed()
+
+
+# Рассылка уведомлений: прямые bot.send_message из обработчиков против очереди Outbox (на fake_telegram)
+def bench_outbox(args):
+    from aiogram.exceptions import TelegramAPIError
+    from fake_telegram import FakeTelegram, make_bot
+    from outbox import Outbox
+
+    async def direct(bot):
+        failed = 0
+        latencies = []
+
+        async def handler(chat_id, i):
+            nonlocal failed
+            started = time.perf_counter()
+            try:
+                await bot.send_message(chat_id, f"notification {i}")
+            except TelegramAPIError:
+                failed += 1
+            latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(handler(chat_id, i) for i in range(args.per_chat) for chat_id in range(1, args.chats + 1)))
+        return latencies, failed
+
+    async def queued(bot):
+        outbox = Outbox(bot)
+        runner = asyncio.create_task(outbox.run())
+        latencies = []
+        futures = []
+        for i in range(args.per_chat):
+            for chat_id in range(1, args.chats + 1):
+                started = time.perf_counter()
+                futures.append(outbox.send(chat_id, f"notification {i}"))
+                latencies.append(time.perf_counter() - started)
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        runner.cancel()
+        stats = outbox.stats()
+        print(f"{'':<22} outbox: retried={stats['retried']} delivery p50={stats['delivery_p50'] * 1000:.0f} ms "
+              f"p99={stats['delivery_p99'] * 1000:.0f} ms")
+        return latencies, sum(isinstance(result, Exception) for result in results)
+
+    async def main():
+        fake = FakeTelegram(latency=args.latency)
+        url = await fake.start()
+        bot = make_bot(url)
+        try:
+            print(f"chats={args.chats} messages per chat={args.per_chat} API latency={args.latency * 1000:.0f} ms")
+            for name, variant in (("direct send_message", direct), ("Outbox", queued)):
+                fake.reset()
+                started = time.perf_counter()
+                latencies, failed = await variant(bot)
+                total = time.perf_counter() - started
+                stats = fake.stats()
+                print_row(name, latencies, total,
+                          f"delivered={stats['delivered']} lost={failed} 429={stats['rate_limited']} total={total:.1f} s")
+                # Пауза, чтобы лимиты fake-сервера восстановились перед следующим вариантом
+                await asyncio.sleep(2)
+        finally:
+            await bot.session.close()
+            await fake.stop()
+
+    asyncio.run(main())
+
+
+# Рассылка всем пользователям: скорость, пик памяти и продолжение с контрольной точки после остановки
+def bench_broadcast(args):
+    import resource
+    from broadcast import Broadcaster, BroadcastState
+    from fake_telegram import FakeTelegram, make_bot
+    from outbox import Outbox
+
+    async def main():
+        fake = FakeTelegram(latency=args.latency, global_rate=args.rate)
+        url = await fake.start()
+        bot = make_bot(url)
+        outbox = Outbox(bot, global_rate=args.rate, batch_size=max(30, int(args.rate * args.latency * 2)))
+        runner = asyncio.create_task(outbox.run())
+        broadcaster = Broadcaster(outbox, batch_size=args.batch)
+        state = None
+        try:
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            started = time.perf_counter()
+            # Рассылка начинается до первого тестового пользователя (по умолчанию — с telegram_id > 0)
+            state = BroadcastState(await broadcaster.adb.create_broadcast("benchmark broadcast", None))
+            state.last_user_id = BENCH_ID_BASE - 1
+            await broadcaster.adb.save_progress(state.id, state.last_user_id, 0, 0)
+            broadcaster._spawn(state)
+            if args.interrupt_after:
+                # Имитация перезапуска процесса посреди рассылки
+                await asyncio.sleep(args.interrupt_after)
+                await broadcaster.stop()
+                print(f"stopped: checkpoint user={state.last_user_id} processed={state.processed} of {state.total}")
+                with Database() as cursor:
+                    cursor.execute("SELECT id, author_id, text, total, last_user_id, sent, failed FROM broadcasts "
+                                   "WHERE id = %s", (state.id,))
+                    state = BroadcastState(cursor.fetchone())
+                broadcaster._spawn(state)
+            await broadcaster.tasks[state.id]
+            elapsed = time.perf_counter() - started
+            rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            stats = fake.stats()
+            print(f"recipients={state.total} sent={state.sent} failed={state.failed} "
+                  f"delivered={stats['delivered']} duplicates={stats['delivered'] - len(fake.messages)} "
+                  f"429={stats['rate_limited']}")
+            print(f"total={elapsed:.1f} s  {state.total / elapsed:.1f} msg/s (limit {args.rate:.0f})  "
+                  f"max RSS={rss_after / 1024:.0f} MB (+{(rss_after - rss_before) / 1024:.1f} MB during broadcast)")
+        finally:
+            runner.cancel()
+            await bot.session.close()
+            await fake.stop()
+            broadcaster.adb.shutdown()
+            if state is not None:
+                with Database() as cursor:
+                    cursor.execute("DELETE FROM broadcasts WHERE id = %s", (state.id,))
+
+    seed_users(args.rows)
+    try:
+        asyncio.run(main())
+    finally:
+        cleanup_seed()
+
+
+# Задержка обработки обновления: long polling против webhook (с дедупликацией и лимитом одновременных
+# обновлений). Обновления поступают с постоянной частотой --rate, задержка считается от появления
+# обновления до получения ответа fake-сервером. Обработчик — эхо, чтобы сравнивать только доставку.
+def bench_webhook(args):
+    from aiohttp import web
+    from aiogram import Dispatcher, Router, types
+    from fake_telegram import FakeTelegram, make_bot, make_message_update, post_updates
+    from webhook import make_app
+
+    def make_dispatcher():
+        router = Router()
+
+        @router.message()
+        async def echo(message: types.Message):
+            await message.answer(message.text)
+
+        dispatcher = Dispatcher()
+        dispatcher.include_router(router)
+        return dispatcher
+
+    async def main():
+        fake = FakeTelegram(latency=args.latency, global_rate=1e9, chat_rate=1e9, chat_burst=1000)
+        url = await fake.start()
+        created = {}
+        latencies = []
+        done = asyncio.Event()
+
+        def on_message(chat_id, text):
+            latencies.append(time.perf_counter() - created[text])
+            if len(latencies) == args.updates:
+                done.set()
+        fake.on_message = on_message
+
+        # Выпускает обновления с частотой args.rate, deliver(update) вызывается в момент появления
+        async def emit(deliver):
+            updates = [make_message_update(1 + i % args.users, f"update {i}") for i in range(args.updates)]
+            started = time.perf_counter()
+            tasks = []
+            for i, update in enumerate(updates):
+                delay = started + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                created[update['message']['text']] = time.perf_counter()
+                tasks.append(asyncio.create_task(deliver(update)))
+            await asyncio.gather(*tasks)
+            return updates, started
+
+        print(f"updates={args.updates} rate={args.rate:.0f}/s users={args.users} API latency={args.latency * 1000:.0f} ms")
+
+        # Long polling: обновления отдаются боту через getUpdates
+        bot = make_bot(url)
+        dispatcher = make_dispatcher()
+        polling = asyncio.create_task(dispatcher.start_polling(bot, handle_signals=False, close_bot_session=False))
+        await asyncio.sleep(0.5)
+
+        async def push(update):
+            fake.push_update(update)
+        updates, started = await emit(push)
+        await asyncio.wait_for(done.wait(), 120)
+        print_row("long polling", latencies, time.perf_counter() - started)
+        await dispatcher.stop_polling()
+        await polling
+
+        # Webhook: обновления присылаются POST-запросами, каждое дважды (как при повторе Telegram)
+        latencies.clear()
+        done.clear()
+        app = make_app(make_dispatcher(), bot, path='/webhook', primary=False, max_in_flight=args.max_in_flight)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        webhook_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/webhook"
+
+        async def post(update):
+            # 503 (превышен лимит) Telegram повторил бы позже — повторяем, пока обновление не будет принято
+            while (await post_updates(webhook_url, [update], latency=args.latency)).get(503):
+                await asyncio.sleep(0.1)
+            # Повторная доставка того же обновления должна быть отброшена
+            await post_updates(webhook_url, [update])
+        updates, started = await emit(post)
+        await asyncio.wait_for(done.wait(), 120)
+        total = time.perf_counter() - started
+        await asyncio.sleep(0.5)
+        handler_stats = app['webhook_handler'].stats()
+        print_row("webhook", latencies, total,
+                  f"processed={handler_stats['processed']} duplicates dropped={handler_stats['duplicates']} "
+                  f"503={handler_stats['rejected']} echoes={len(latencies)}")
+        await runner.cleanup()
+        await bot.session.close()
+        await fake.stop()
+        with Database() as cursor:
+            cursor.execute("DELETE FROM processed_updates WHERE update_id = ANY(%s)",
+                           ([update['update_id'] for update in updates],))
+
+    asyncio.run(main())
+
+
+# Прежний save_request: проверка и вставка отдельными запросами
+def legacy_create_request(client_id, address):
+    with Database() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM requests WHERE client_id = %s AND status != 'completed'", (str(client_id),))
+        if cursor.fetchone()[0] > 0:
+            return False
+        cursor.execute("INSERT INTO requests (client_id, address) VALUES (%s, %s)", (str(client_id), address))
+        return True
+
+
+# Создание заявки при двойном нажатии: каждый клиент отправляет --taps запросов одновременно.
+# Для старого варианта ошибки уникальности — гонки, которые без индекса idx_requests_active_client дали бы дубликаты
+def bench_create_request(args):
+    from main import Database as BotDatabase
+    adb = AsyncDatabase(BotDatabase)
+    seed_users(args.clients, masters_every=args.clients + 1)
+
+    async def run(create):
+        created = errors = 0
+        latencies = []
+
+        async def tap(client_id):
+            nonlocal created, errors
+            started = time.perf_counter()
+            try:
+                result = await adb.run(create, client_id, "ул. Тестовая, 1")
+                created += bool(result)
+            except psycopg2.Error:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(tap(BENCH_ID_BASE + i) for i in range(args.clients) for _ in range(args.taps)))
+        return latencies, time.perf_counter() - started, created, errors
+
+    async def main():
+        print(f"clients={args.clients} taps={args.taps} (идеально: {args.clients} заявок, 0 ошибок)")
+        for name, create in (("SELECT + INSERT", legacy_create_request), ("INSERT ON CONFLICT", BotDatabase.create_request)):
+            latencies, total, created, errors = await run(create)
+            with Database() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM requests WHERE client_id < 0")
+                rows = cursor.fetchone()[0]
+                cursor.execute("DELETE FROM requests WHERE client_id < 0")
+            print_row(name, latencies, total, f"created={created} rows={rows} unique violations={errors}")
+
+    try:
+        asyncio.run(main())
+    finally:
+        adb.shutdown()
+        cleanup_seed()
+
+
+# Горячие запросы бота и индекс, который должен их обслуживать на большой таблице
+# (параметры — мастер с активными заявками и клиент из seed_requests)
+HOT_QUERIES = [
+    ("get_active_requests", "idx_requests_master_active",
+     "SELECT id, client_id, address, status FROM requests WHERE master_id = %(master)s AND status != 'completed' "
+     "ORDER BY created_at DESC LIMIT 20"),
+    ("set_request_status", "requests_pkey",
+     "UPDATE requests SET status = 'in_progress' WHERE id = %(request)s AND master_id = %(master)s "
+     "AND status != 'completed' AND status != 'in_progress' RETURNING client_id"),
+    ("get_request_client", "requests_pkey",
+     "SELECT client_id FROM requests WHERE id = %(request)s AND master_id = %(master)s AND status != 'completed'"),
+    ("get_pending_requests", "idx_requests_pending",
+     "SELECT r.id, u.full_name, r.address FROM requests r JOIN users u ON r.client_id = u.telegram_id "
+     "WHERE r.status = 'pending' ORDER BY r.created_at LIMIT 30"),
+    ("create_request", "idx_requests_active_client",
+     "SELECT 1 FROM requests WHERE client_id = %(client)s AND status != 'completed'"),
+    ("get_recent_reports", "idx_reports_user_created",
+     "SELECT report_text, admin_feedback FROM reports WHERE user_id = %(client)s ORDER BY created_at DESC LIMIT 5"),
+    ("get_admin_id", "idx_users_admins",
+     "SELECT telegram_id FROM users WHERE role = 'admin' LIMIT 1"),
+]
+
+# Индексы до появления HOT_QUERIES: для сравнения в hot_queries
+NEW_INDEXES = ["idx_requests_master_active", "idx_requests_pending", "idx_reports_user_created", "idx_users_admins"]
+OLD_INDEXES = ["CREATE INDEX idx_reports_user_id ON reports(user_id)"]
+# request = 0: UPDATE из set_request_status не находит строку и ничего не меняет
+HOT_QUERY_PARAMS = {'master': BENCH_ID_BASE + 10, 'client': BENCH_ID_BASE, 'request': 0}
+
+
+def plan_indexes(plan):
+    found = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', []):
+        found |= plan_indexes(child)
+    return found
+
+
+def explain(cursor, sql):
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql, HOT_QUERY_PARAMS)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+# Планы горячих запросов: [(имя, ожидаемый индекс, использованные индексы, план)].
+# Общая проверка для сценария explain и tests/test_hot_queries.py
+def check_hot_query_indexes(cursor):
+    results = []
+    for name, index, sql in HOT_QUERIES:
+        plan = explain(cursor, sql)
+        results.append((name, index, plan_indexes(plan), plan))
+    return results
+
+
+# Проверка планов: каждый горячий запрос должен идти по своему индексу. Код выхода 1 — если нет
+def bench_explain(args):
+    seed_requests(args.rows)
+    failed = 0
+    try:
+        with Database() as cursor:
+            for name, index, used, plan in check_hot_query_indexes(cursor):
+                ok = index in used
+                failed += not ok
+                print(f"{'OK  ' if ok else 'FAIL'} {name:<24} expected {index:<28} "
+                      f"got {', '.join(sorted(used)) or plan['Node Type']}")
+    finally:
+        cleanup_seed()
+    if failed:
+        sys.exit(1)
+
+
+# Время горячих запросов на большой таблице с новыми индексами и без них
+def bench_hot_queries(args):
+    seed_requests(args.rows)
+
+    def measure(cursor):
+        result = {}
+        for name, _, sql in HOT_QUERIES:
+            latencies = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                cursor.execute(sql, HOT_QUERY_PARAMS)
+                cursor.fetchall()
+                latencies.append(time.perf_counter() - started)
+            result[name] = latencies
+        return result
+
+    try:
+        with Database() as cursor:
+            indexed = measure(cursor)
+        # Индексы удаляются внутри транзакции и возвращаются откатом
+        connection = get_pool().getconn()
+        try:
+            with connection.cursor() as cursor:
+                for index in NEW_INDEXES:
+                    cursor.execute(f"DROP INDEX {index}")
+                for statement in OLD_INDEXES:
+                    cursor.execute(statement)
+                cursor.execute("ANALYZE requests")
+                plain = measure(cursor)
+            connection.rollback()
+        finally:
+            get_pool().putconn(connection)
+    finally:
+        cleanup_seed()
+
+    print(f"rows={args.rows} repeat={args.repeat}, медиана, мс")
+    print(f"{'query':<24} {'old indexes':>12} {'new indexes':>12}")
+    for name, _, _ in HOT_QUERIES:
+        before = statistics.median(plain[name]) * 1000
+        after = statistics.median(indexed[name]) * 1000
+        print(f"{name:<24} {before:>12.3f} {after:>12.3f}")
+
+
+def legacy_stats():
+    with Database() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM users")
+        total_users = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM requests WHERE status = 'pending'")
+        pending = cursor.fetchone()[0]
+        cursor.execute("SELECT AVG(busyness) FROM masters")
+        avg_load = cursor.fetchone()[0] or 0
+        return total_users, pending, avg_load
+
+
+# Статистика: COUNT(*) по таблицам против счётчиков stats_counters; затем проверка, что счётчики,
+# которые поддерживали триггеры во время конкурентных записей, совпадают с пересчётом с нуля
+def bench_stats(args):
+    from stats import StatsDatabase
+    seed_requests(args.rows)
+    adb = AsyncDatabase(BenchDatabase)
+
+    def measure(func):
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            call_started = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - call_started)
+        return latencies, time.perf_counter() - started
+
+    def change_status(i):
+        with Database() as cursor:
+            cursor.execute('''
+                UPDATE requests SET status = CASE status WHEN 'pending' THEN 'in_progress'
+                                                        WHEN 'in_progress' THEN 'completed' ELSE 'pending' END
+                WHERE id = (SELECT id FROM requests WHERE client_id = %s ORDER BY id DESC LIMIT 1)
+            ''', (BENCH_ID_BASE + i,))
+
+    async def writes():
+        await asyncio.gather(*(adb.run(change_status, i % 100000) for i in range(args.writes)))
+
+    try:
+        print(f"rows={args.rows} repeat={args.repeat}")
+        print_row("COUNT(*) queries", *measure(legacy_stats))
+        print_row("stats_counters", *measure(StatsDatabase.get_stats))
+        started = time.perf_counter()
+        asyncio.run(writes())
+        print(f"{args.writes} concurrent status changes in {time.perf_counter() - started:.2f} s")
+        before = StatsDatabase.get_stats().counters
+        with Database() as cursor:
+            cursor.execute("SELECT refresh_stats()")
+        after = StatsDatabase.get_stats().counters
+        print("counters match recount" if before == after else f"MISMATCH: {before} != {after}")
+    finally:
+        adb.shutdown()
+        cleanup_seed()
+
+
+# Те же ряды, что StatsDatabase.get_analytics, но агрегацией по таблицам заявок и отчётов
+def legacy_analytics(bucket, count):
+    with Database() as cursor:
+        cursor.execute("""
+            WITH bounds AS (
+                SELECT date_trunc(%(bucket)s, CURRENT_TIMESTAMP, 'UTC') - %(length)s * (%(count)s - 1) AS start
+            )
+            SELECT date_trunc(%(bucket)s, event_at, 'UTC') AS bucket,
+                   SUM(created), SUM(completed), SUM(seconds), SUM(reports), SUM(busy)
+            FROM (
+                SELECT created_at AS event_at, 1 AS created, 0 AS completed, 0::BIGINT AS seconds, 0 AS reports, 0::BIGINT AS busy
+                FROM requests WHERE created_at >= (SELECT start FROM bounds)
+                UNION ALL
+                SELECT completed_at, 0, 1, completion_seconds(created_at, completed_at), 0, 0
+                FROM requests WHERE completed_at >= (SELECT start FROM bounds)
+                UNION ALL
+                SELECT created_at, 0, 0, 0, 1, 0 FROM reports WHERE created_at >= (SELECT start FROM bounds)
+                UNION ALL
+                SELECT busy.hour, 0, 0, 0, 0, busy.seconds
+                FROM requests r, busy_hours(r.started_at, COALESCE(r.completed_at, CURRENT_TIMESTAMP)) busy
+                WHERE r.started_at IS NOT NULL AND COALESCE(r.completed_at, CURRENT_TIMESTAMP) >= (SELECT start FROM bounds)
+            ) events
+            GROUP BY 1
+        """, {'bucket': bucket, 'count': count, 'length': BUCKET_LENGTHS[bucket]})
+        return cursor.fetchall()
+
+
+def rollup_totals(cursor):
+    totals = []
+    for table in ("request_stats_hourly", "request_stats_daily"):
+        cursor.execute(f"SELECT SUM(created), SUM(completed), SUM(completion_seconds), SUM(reports), SUM(busy_seconds) FROM {table}")
+        totals.append(cursor.fetchone())
+    cursor.execute("SELECT SUM(started), SUM(started_epoch) FROM requests_in_progress_hourly")
+    totals.append(cursor.fetchone())
+    return totals
+
+
+# Графики аналитики за год: агрегация по сырым таблицам против итогов request_stats_hourly/daily;
+# затем проверка, что итоги, которые вели триггеры при конкурентных записях, совпадают с пересчётом
+def bench_analytics(args):
+    from stats import StatsDatabase, ANALYTICS_PERIODS
+    seed_requests(args.rows, span=args.days * 86400)
+    adb = AsyncDatabase(BenchDatabase)
+
+    def change_status(i):
+        with Database() as cursor:
+            cursor.execute('''
+                UPDATE requests SET status = CASE status WHEN 'pending' THEN 'in_progress' ELSE 'completed' END
+                WHERE id = (SELECT id FROM requests WHERE client_id = %s AND status != 'completed')
+            ''', (BENCH_ID_BASE + i,))
+
+    async def writes():
+        await asyncio.gather(*(adb.run(change_status, i) for i in range(args.writes)))
+
+    try:
+        print(f"rows={args.rows} за {args.days} дней, repeat={args.repeat}, raw-repeat={args.raw_repeat}")
+        for period, (bucket, count) in ANALYTICS_PERIODS.items():
+            for name, func, repeat in (("raw tables", legacy_analytics, args.raw_repeat),
+                                       ("rollups", StatsDatabase.get_analytics, args.repeat)):
+                if not repeat:
+                    continue
+                latencies = []
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    call_started = time.perf_counter()
+                    func(bucket, count)
+                    latencies.append(time.perf_counter() - call_started)
+                print_row(f"{period}: {name}", latencies, time.perf_counter() - started)
+        started = time.perf_counter()
+        asyncio.run(writes())
+        print(f"{args.writes} concurrent status changes in {time.perf_counter() - started:.2f} s")
+        with Database() as cursor:
+            before = rollup_totals(cursor)
+            cursor.execute("SELECT refresh_rollups()")
+            cursor.execute("SELECT refresh_stats()")
+            after = rollup_totals(cursor)
+        print("rollups match recount" if before == after else f"MISMATCH: {before} != {after}")
+    finally:
+        adb.shutdown()
+        cleanup_seed()
+
+
+# Ожидающие заявки от rows разных клиентов (у клиента не больше одной незавершённой заявки)
+def seed_pending_requests(rows):
+    with Database() as cursor:
+        cursor.execute("""
+            INSERT INTO requests (client_id, address, created_at)
+            SELECT %s + j, 'ул. Тестовая, ' || j, CURRENT_TIMESTAMP - make_interval(secs => %s - j)
+            FROM generate_series(0, %s - 1) j
+        """, (BENCH_ID_BASE, rows, rows))
+        cursor.execute("ANALYZE requests")
+
+
+# Возвращает в очередь назначенные тестовые заявки; busyness мастеров уменьшат триггеры
+def reset_assignments():
+    with Database() as cursor:
+        cursor.execute("UPDATE requests SET master_id = NULL, status = 'pending' WHERE client_id < 0 AND master_id IS NOT NULL")
+
+
+# На время распределения прячет строки, которые бенчмарк не создавал: ожидающие заявки настоящих клиентов
+# и настоящих мастеров. AssignmentDatabase.assign_batch выбирает их с FOR UPDATE SKIP LOCKED, а FOR KEY SHARE
+# с ним конфликтует, поэтому они пропускаются; обычные UPDATE (статус, busyness) эта блокировка не задерживает
+@contextlib.contextmanager
+def hide_foreign_rows():
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM requests WHERE client_id > 0 AND status = 'pending' AND master_id IS NULL "
+                           "FOR KEY SHARE")
+            cursor.execute("SELECT 1 FROM masters WHERE user_id > 0 FOR KEY SHARE")
+        yield
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+# Назначение без очереди с приоритетом: транзакция на заявку, наименее занятый мастер выбирается запросом.
+# Только тестовые заявки и мастера
+def assign_one(max_busyness):
+    with Database() as cursor:
+        cursor.execute("""
+            SELECT id FROM requests WHERE status = 'pending' AND master_id IS NULL AND client_id < 0
+            ORDER BY created_at LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """)
+        request = cursor.fetchone()
+        if request is None:
+            return False
+        cursor.execute("""
+            SELECT user_id FROM masters WHERE busyness < %s AND user_id < 0
+            ORDER BY busyness LIMIT 1
+            FOR UPDATE
+        """, (max_busyness,))
+        master = cursor.fetchone()
+        if master is None:
+            return False
+        cursor.execute("UPDATE requests SET master_id = %s, status = 'in_progress' WHERE id = %s", (master[0], request[0]))
+        return True
+
+
+# Занятость тестовых мастеров: (назначено заявок, разброс max - min, busyness совпадает с числом заявок)
+def assignment_summary():
+    with Database() as cursor:
+        cursor.execute("""
+            SELECT COUNT(r.id), m.busyness
+            FROM masters m LEFT JOIN requests r ON r.master_id = m.user_id AND r.status = 'in_progress'
+            WHERE m.user_id < 0
+            GROUP BY m.user_id, m.busyness
+        """)
+        rows = cursor.fetchall()
+    counts = [count for count, _ in rows]
+    return sum(counts), max(counts) - min(counts), all(count == busyness for count, busyness in rows)
+
+
+# Распределение rows ожидающих заявок между мастерами: по одной заявке на транзакцию против
+# AssignmentEngine (куча по busyness, пачки по --batch), в обоих случаях --dispatchers параллельных распределителей
+def bench_assignment(args):
+    from assignment import AssignmentDatabase, AssignmentEngine
+    seed_users(args.rows, args.rows // args.masters)
+    seed_pending_requests(args.rows)
+    max_busyness = args.max_busyness or -(-args.rows // args.masters) + 1
+
+    async def legacy():
+        adb = AsyncDatabase(BenchDatabase, max_workers=args.dispatchers)
+        latencies = []
+
+        async def dispatcher():
+            while True:
+                started = time.perf_counter()
+                if not await adb.run(assign_one, max_busyness):
+                    return
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(dispatcher() for _ in range(args.dispatchers)))
+        adb.shutdown()
+        return latencies
+
+    async def engine():
+        latencies = []
+
+        class TimedAssignmentDatabase(AssignmentDatabase):
+            @staticmethod
+            def assign_batch(limit, busyness):
+                started = time.perf_counter()
+                try:
+                    return AssignmentDatabase.assign_batch(limit, busyness)
+                finally:
+                    latencies.append(time.perf_counter() - started)
+
+        adb = AsyncDatabase(TimedAssignmentDatabase, max_workers=args.dispatchers)
+        engines = [AssignmentEngine(adb=adb, batch_size=args.batch, max_busyness=max_busyness)
+                   for _ in range(args.dispatchers)]
+        await asyncio.gather(*(item.run_once() for item in engines))
+        adb.shutdown()
+        return latencies
+
+    try:
+        print(f"rows={args.rows} masters={args.masters} dispatchers={args.dispatchers} "
+              f"batch={args.batch} max_busyness={max_busyness}")
+        with hide_foreign_rows():
+            for name, scenario, unit in (("per-request", legacy, "req"), ("heap batches", engine, "batch")):
+                started = time.perf_counter()
+                latencies = asyncio.run(scenario())
+                total_time = time.perf_counter() - started
+                assigned, spread, consistent = assignment_summary()
+                print(f"{name:<14} {assigned} assigned in {total_time:.2f} s ({assigned / total_time:.0f} req/s), "
+                      f"per {unit} p50={percentile(latencies, 50) * 1000:.1f} ms p99={percentile(latencies, 99) * 1000:.1f} ms, "
+                      f"load spread {spread}, busyness {'consistent' if consistent else 'MISMATCH'}")
+                reset_assignments()
+    finally:
+        cleanup_seed()
+
+
+# Мастера и ожидающие заявки со случайными точками в круге GEO_CITY_RADIUS_KM вокруг центра города
+def seed_locations(rows, masters, seed=1):
+    from geo import GEO_CITY_RADIUS_KM, project, unproject
+    rng = random.Random(seed)
+
+    def random_point():
+        distance = GEO_CITY_RADIUS_KM * math.sqrt(rng.random())
+        angle = 2 * math.pi * rng.random()
+        latitude, longitude = unproject(distance * math.cos(angle), distance * math.sin(angle))
+        return (latitude, longitude) + project(latitude, longitude)
+
+    seed_users(max(rows, masters), 1)
+    with Database() as cursor:
+        # Мастерами остаются первые masters пользователей
+        cursor.execute("DELETE FROM masters WHERE user_id >= %s AND user_id < 0", (BENCH_ID_BASE + masters,))
+        execute_values(cursor, """
+            UPDATE masters m SET latitude = v.latitude, longitude = v.longitude, location = point(v.x, v.y)
+            FROM (VALUES %s) AS v(user_id, latitude, longitude, x, y)
+            WHERE m.user_id = v.user_id
+        """, [(BENCH_ID_BASE + i,) + random_point() for i in range(masters)], page_size=10000)
+        execute_values(cursor, """
+            INSERT INTO requests (client_id, address, created_at, latitude, longitude, location)
+            SELECT client_id, address, CURRENT_TIMESTAMP - make_interval(secs => age), latitude, longitude, point(x, y)
+            FROM (VALUES %s) AS v(age, client_id, address, latitude, longitude, x, y)
+        """, [(rows - j, BENCH_ID_BASE + j, f"ул. Тестовая, {j}") + random_point() for j in range(rows)], page_size=10000)
+        cursor.execute("ANALYZE masters")
+        cursor.execute("ANALYZE requests")
+        cursor.execute("SELECT refresh_stats()")
+
+
+# Тот же запрос, что GeoDatabase.nearest_masters, но без индекса: расстояние до каждого мастера и сортировка
+def nearest_masters_seqscan(latitude, longitude, max_busyness, limit=5):
+    from geo import project
+    x, y = project(latitude, longitude)
+    with Database() as cursor:
+        cursor.execute("SET LOCAL enable_indexscan = off")
+        cursor.execute("SET LOCAL enable_bitmapscan = off")
+        cursor.execute("""
+            SELECT user_id, busyness, location <-> point(%(x)s, %(y)s) FROM masters
+            WHERE location IS NOT NULL AND busyness < %(max_busyness)s
+            ORDER BY location <-> point(%(x)s, %(y)s)
+            LIMIT %(limit)s
+        """, {'x': x, 'y': y, 'max_busyness': max_busyness, 'limit': limit})
+        return cursor.fetchall()
+
+
+# Расстояния от тестовых заявок до назначенных мастеров, км: (среднее, p90)
+def assignment_distances():
+    with Database() as cursor:
+        cursor.execute("""
+            SELECT r.location <-> m.location FROM requests r JOIN masters m ON m.user_id = r.master_id
+            WHERE r.client_id < 0 AND r.location IS NOT NULL AND m.location IS NOT NULL
+        """)
+        distances = [row[0] for row in cursor.fetchall()]
+    return (statistics.fmean(distances), percentile(distances, 90)) if distances else (0.0, 0.0)
+
+
+# Ближайший свободный мастер: GiST-индекс против полного перебора; затем распределение заявок
+# с учётом расстояния против распределения только по занятости
+def bench_geo(args):
+    from assignment import AssignmentDatabase
+    from geo import GeoDatabase, Geocoder
+    geocoder = Geocoder(hash_fallback=True)
+    addresses = [f"ул. Тестовая {i % 500}, д. {i}" for i in range(args.queries)]
+    started = time.perf_counter()
+    points = [geocoder.locate(address) for address in addresses]
+    elapsed = time.perf_counter() - started
+    print(f"geocoding: {args.queries} addresses in {elapsed * 1000:.1f} ms ({elapsed / args.queries * 1e6:.1f} us/address)")
+
+    seed_locations(args.rows, args.masters)
+    max_busyness = args.max_busyness or -(-args.rows // args.masters) + 1
+    try:
+        print(f"masters={args.masters} rows={args.rows} max_busyness={max_busyness}")
+        for name, func in (("nearest: seq scan", nearest_masters_seqscan), ("nearest: GiST", GeoDatabase.nearest_masters)):
+            latencies = []
+            started = time.perf_counter()
+            for latitude, longitude in points:
+                call_started = time.perf_counter()
+                func(latitude, longitude, max_busyness)
+                latencies.append(time.perf_counter() - call_started)
+            print_row(name, latencies, time.perf_counter() - started)
+        with hide_foreign_rows():
+            for name, candidates in (("by busyness", 0), ("nearest", args.candidates)):
+                started = time.perf_counter()
+                assigned = 0
+                while True:
+                    batch = AssignmentDatabase.assign_batch(args.batch, max_busyness, candidates)
+                    assigned += len(batch)
+                    if len(batch) < args.batch:
+                        break
+                elapsed = time.perf_counter() - started
+                mean, p90 = assignment_distances()
+                print(f"assign {name:<12} {assigned} in {elapsed:.2f} s ({assigned / elapsed:.0f} req/s), "
+                      f"distance to master: mean {mean:.2f} km, p90 {p90:.2f} km")
+                reset_assignments()
+    finally:
+        cleanup_seed()
+
+
+def metrics_query(user_id):
+    with Database() as cursor:
+        cursor.execute("SELECT registered FROM users WHERE telegram_id = %s", (user_id,))
+        return cursor.fetchone()
+
+
+# Цена метрик: запрос к БД через Database с курсором MetricsCursor и без него, одно наблюдение
+# гистограммы и выдача /metrics
+def bench_metrics(args):
+    import database
+    import metrics
+    database.METRICS_ENABLED = False
+    for _ in range(100):
+        metrics_query(1)
+    for enabled in (False, True, False, True):
+        database.METRICS_ENABLED = enabled
+        metrics.metrics.reset()
+        latencies = []
+        started = time.perf_counter()
+        for i in range(args.queries):
+            query_started = time.perf_counter()
+            metrics_query(i)
+            latencies.append(time.perf_counter() - query_started)
+        print_row("metrics on" if enabled else "metrics off", latencies, time.perf_counter() - started)
+    database.METRICS_ENABLED = metrics.METRICS_ENABLED
+
+    metrics.metrics.reset()
+    started = time.perf_counter()
+    for i in range(args.observations):
+        metrics.metrics.observe('bench_seconds', i % 1000 / 1e5, handler='bench')
+    elapsed = time.perf_counter() - started
+    print(f"observe: {elapsed / args.observations * 1e6:.2f} us per observation")
+
+    for i in range(args.labels):
+        metrics.metrics.observe('db_query_seconds', 0.001, query=f"SELECT {i}")
+    started = time.perf_counter()
+    text = metrics.metrics.expose()
+    print(f"expose: {args.labels} label sets, {len(text) / 1024:.0f} KiB in {(time.perf_counter() - started) * 1000:.1f} ms")
+    metrics.metrics.reset()
+
+
+# Маршрутизация сообщений без БД и Telegram: прежняя цепочка фильтров F.text == "..." для каждой
+# кнопки меню и lambda для "<ID> confirm" против таблицы MENU_ROUTES (фильтр MenuRoute) и
+# ADMIN_DECISION; время выбора обработчика для кнопки в начале и в конце цепочки, ответа администратора
+# и обычного текста, который не подходит ни к одной кнопке. Затем сборка клавиатуры меню против ROLE_KEYBOARDS
+def bench_routing(args):
+    from aiogram import F, Router, types
+    from aiogram.filters import StateFilter
+    from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+    from fake_telegram import make_message_update
+    import main as bot_main
+
+    async def noop(message):
+        pass
+
+    texts = list(bot_main.MENU_ROUTES)
+    legacy = Router()
+    for text in texts:
+        legacy.message(F.text == text)(noop)
+    legacy.message(lambda message: message.text and len(message.text.split()) == 2
+                   and message.text.split()[0].isdigit())(noop)
+    table = Router()
+    table.message(bot_main.MenuRoute(bot_main.MENU_ROUTES))(noop)
+    table.message(StateFilter(None), F.text.regexp(bot_main.ADMIN_DECISION).as_('decision'))(noop)
+
+    cases = [("first button", texts[0]), ("last button", texts[-1]),
+             ("admin decision", "12345 confirm"), ("other text", "ул. Тестовая, 1")]
+
+    async def route(router, message):
+        started = time.perf_counter()
+        for _ in range(args.messages):
+            await router.message.trigger(message, raw_state=None)
+        return time.perf_counter() - started
+
+    async def run():
+        for name, text in cases:
+            message = types.Update.model_validate(make_message_update(1, text)).message
+            for label, router in (("F.text chain", legacy), ("MENU_ROUTES", table)):
+                elapsed = await route(router, message)
+                print(f"{name:<16} {label:<14} {elapsed / args.messages * 1e6:7.2f} us per message")
+
+    asyncio.run(run())
+
+    for role, rows in bot_main.ROLE_MENUS.items():
+        started = time.perf_counter()
+        for _ in range(args.keyboards):
+            ReplyKeyboardMarkup(
+                keyboard=[[KeyboardButton(text=text, request_location=text in bot_main.LOCATION_BUTTONS) for text in row]
+                          for row in rows],
+                resize_keyboard=True
+            )
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(args.keyboards):
+            bot_main.ROLE_KEYBOARDS[role]
+        prebuilt = time.perf_counter() - started
+        print(f"keyboard {role:<7} build {built / args.keyboards * 1e6:7.2f} us, "
+              f"ROLE_KEYBOARDS {prebuilt / args.keyboards * 1e6:7.3f} us")
+
+
+# Диалоги пользователей: каждый — список обновлений, которые отправляются по очереди (следующее —
+# после обработки предыдущего, как у живого пользователя); разные пользователи — одновременно,
+# не больше concurrency. Возвращает задержки обработки обновлений и общее время
+async def run_dialogs(dispatcher, bot, dialogs, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def talk(updates):
+        async with semaphore:
+            for update in updates:
+                started = time.perf_counter()
+                await dispatcher.feed_raw_update(bot, update)
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(talk(updates) for updates in dialogs))
+    return latencies, time.perf_counter() - started
+
+
+# Назначает заявки клиентов с telegram_id >= first мастерам по кругу (как сделал бы AssignmentEngine,
+# но предсказуемо); возвращает {master_id: [(request_id, client_id)]}
+def assign_round_robin(first, masters):
+    assigned = {}
+    with Database() as cursor:
+        cursor.execute("SELECT id, client_id FROM requests WHERE client_id >= %s AND client_id < 0 ORDER BY id", (first,))
+        requests = cursor.fetchall()
+        master_ids = [masters[i % len(masters)] for i in range(len(requests))]
+        cursor.execute("""
+            UPDATE requests r SET master_id = a.master_id, status = 'in_progress'
+            FROM unnest(%s::bigint[], %s::bigint[]) AS a(id, master_id)
+            WHERE r.id = a.id
+        """, ([request_id for request_id, _ in requests], master_ids))
+    for master_id, request in zip(master_ids, requests):
+        assigned.setdefault(master_id, []).append(request)
+    return assigned
+
+
+def count_answers(fake):
+    texts = [text for texts in fake.messages.values() for text in texts]
+    return len(texts), sum(text.startswith("⚠️") for text in texts)
+
+
+# Сквозной прогон бота: обновления проходят через main.dp со всеми обработчиками, хранилищем FSM и Outbox,
+# Bot API — fake_telegram, в базе заранее --rows пользователей и --requests заявок (seed_requests).
+# Новые пользователи (--users) регистрируются, отправляют отчёт, вызывают мастера; заявки назначаются
+# мастерам, мастера их завершают. Для каждого этапа: обновлений в секунду, задержка обработки обновления,
+# запросов и транзакций БД и вызовов Bot API на обновление, ответов с ошибкой (⚠️).
+# --save сохраняет результат в JSON, --baseline сравнивает с сохранённым и завершается с кодом 1, если
+# запросов на обновление стало больше, появились ошибки или p50 вырос больше чем в --tolerance раз
+def bench_e2e(args):
+    from fake_telegram import FakeTelegram, make_message_update, make_callback_update
+    import metrics
+
+    first = BENCH_ID_BASE + args.rows
+    users = range(first, first + args.users)
+    # seed_users: мастер — каждый десятый, каждый тысячный — администратор
+    masters = [BENCH_ID_BASE + i for i in range(0, args.rows, 10) if i % 1000]
+
+    def registration():
+        return [[make_message_update(user_id, "/start"),
+                 make_message_update(user_id, "Нагрузочный Тест"),
+                 make_message_update(user_id, f"+7900{user_id % 10 ** 7:07d}")]
+                for user_id in users]
+
+    def report():
+        return [[make_message_update(user_id, "📝 Отправить отчёт"),
+                 make_message_update(user_id, f"Отчёт пользователя {user_id}"),
+                 make_message_update(user_id, "📨 Посмотреть фидбек")]
+                for user_id in users]
+
+    def request():
+        return [[make_message_update(user_id, "🔧 Вызвать мастера"),
+                 make_message_update(user_id, f"ул. Нагрузочная, {user_id % 1000}")]
+                for user_id in users]
+
+    def status(bot_main):
+        assigned = assign_round_robin(first, masters)
+        print(f"{'assign':<22} {sum(map(len, assigned.values()))} requests to {len(assigned)} masters")
+        return [[make_message_update(master_id, "🔄 Изменить статус заявки")] +
+                [make_callback_update(master_id, bot_main.RequestStatus(id=request_id, status='completed').pack())
+                 for request_id, _ in requests]
+                for master_id, requests in assigned.items()]
+
+    async def main():
+        fake = FakeTelegram(latency=args.latency, global_rate=1e9, chat_rate=1e9, chat_burst=10 ** 9)
+        url = await fake.start()
+        # main.py читает их при импорте: бот ходит на fake-сервер, заявки назначает этап status, а не фоновая задача
+        os.environ['TELEGRAM_API_URL'] = url
+        os.environ['AUTO_ASSIGN'] = '0'
+        import main as bot_main
+        dispatcher, bot = bot_main.dp, bot_main.bot
+        await dispatcher.emit_startup(bot=bot)
+        print(f"users={args.users} seeded users={args.rows} requests={args.requests} "
+              f"concurrency={args.concurrency} API latency={args.latency * 1000:.0f} ms")
+        results = {}
+        try:
+            for name, make_dialogs in (("registration", registration), ("report", report), ("request", request),
+                                       ("status", lambda: status(bot_main))):
+                dialogs = await bot_main.adb.run(make_dialogs)
+                calls = sum(fake.calls.values())
+                answers, errors = count_answers(fake)
+                metrics.metrics.reset()
+                latencies, total = await run_dialogs(dispatcher, bot, dialogs, args.concurrency)
+                # Отложенная запись состояний FSM и уведомления из очереди — тоже работа этапа
+                await bot_main.storage.flush()
+                await bot_main.outbox.join()
+                counts = {}
+                for metric, _, count, _, _, _ in metrics.metrics.summary():
+                    counts[metric] = counts.get(metric, 0) + count
+                updates = len(latencies)
+                result = results[name] = {
+                    'updates': updates,
+                    'rate': updates / total,
+                    'p50': percentile(latencies, 50),
+                    'p99': percentile(latencies, 99),
+                    'queries': counts.get('db_query_seconds', 0) / updates,
+                    'transactions': counts.get('db_connect_seconds', 0) / updates,
+                    'api_calls': (sum(fake.calls.values()) - calls) / updates,
+                }
+                answers_after, errors_after = count_answers(fake)
+                result['answers'] = answers_after - answers
+                result['errors'] = errors_after - errors
+                print_row(name, latencies, total,
+                          f"queries/update={result['queries']:.2f} transactions/update={result['transactions']:.2f} "
+                          f"api calls/update={result['api_calls']:.2f} errors={result['errors']}")
+        finally:
+            await dispatcher.emit_shutdown(bot=bot)
+            await bot.session.close()
+            await fake.stop()
+        return results
+
+    if not metrics.METRICS_ENABLED:
+        print("METRICS_ENABLED=0: запросы и транзакции не будут посчитаны")
+    seed_requests(args.requests, users=args.rows)
+    try:
+        results = asyncio.run(main())
+    finally:
+        cleanup_seed()
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if result['queries'] > before['queries'] + 0.01:
+                regressions.append(f"{name}: queries/update {before['queries']:.2f} -> {result['queries']:.2f}")
+            if result['errors'] > before['errors']:
+                regressions.append(f"{name}: errors {before['errors']} -> {result['errors']}")
+            if result['p50'] > before['p50'] * args.tolerance:
+                regressions.append(f"{name}: p50 {before['p50'] * 1000:.1f} -> {result['p50'] * 1000:.1f} ms")
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+# Админ-панель без экрана (QT_QPA_PLATFORM=offscreen) на базе из --rows пользователей и заявок
+# (seed_requests): полное обновление load_all_data (первая страница всех вкладок, статистика, графики),
+# прокрутка вкладки заявок до --scroll строк, перезагрузка прокрученной вкладки и отрисовка таблицы.
+# Для каждого действия: время до применения всех результатов, сколько GUI-поток был занят (суммарно
+# и самая долгая остановка — по опозданию таймера с шагом 5 мс), выдачи и новые соединения пула
+# и пиковый прирост памяти Python (отдельным прогоном под tracemalloc, который сам замедляет код)
+def bench_admin_panel(args):
+    import resource
+    import tracemalloc
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PySide6.QtCore import Qt, QEventLoop, QTimer
+    from PySide6.QtWidgets import QApplication
+    import admin_panel
+
+    app = QApplication.instance() or QApplication([])
+    requests_tab = "🔧 Заявки"
+
+    # Опоздание срабатываний таймера — время, когда цикл событий GUI-потока был занят
+    class StallMonitor:
+        def __init__(self, interval=0.005):
+            self.interval = interval
+            self.timer = QTimer()
+            self.timer.setTimerType(Qt.PreciseTimer)
+            self.timer.setInterval(int(interval * 1000))
+            self.timer.timeout.connect(self.tick)
+
+        def start(self):
+            self.blocked = self.worst = 0.0
+            self.last = time.perf_counter()
+            self.timer.start()
+
+        def tick(self):
+            now = time.perf_counter()
+            lag = now - self.last - self.interval
+            if lag > 0:
+                self.blocked += lag
+                self.worst = max(self.worst, lag)
+            self.last = now
+
+        def stop(self):
+            self.tick()
+            self.timer.stop()
+
+    # Крутит цикл событий, пока панель не применит результаты всех запросов (проверка — таймером
+    # в GUI-потоке: сигналы задач приходят в слоты панели раньше, чем в сторонние функции)
+    def wait_idle(panel):
+        if not panel.loading:
+            return
+        loop = QEventLoop()
+        timer = QTimer()
+        timer.setInterval(1)
+        timer.timeout.connect(lambda: panel.loading or loop.quit())
+        timer.start()
+        loop.exec()
+        timer.stop()
+
+    monitor = StallMonitor()
+
+    def measure(panel, action):
+        pool = get_pool().stats()
+        monitor.start()
+        started = time.perf_counter()
+        action()
+        wait_idle(panel)
+        wall = time.perf_counter() - started
+        monitor.stop()
+        after = get_pool().stats()
+        return wall, monitor.blocked, monitor.worst, after['acquired'] - pool['acquired'], after['connects'] - pool['connects']
+
+    def peak_memory(panel, action):
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        action()
+        wait_idle(panel)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+        return peak
+
+    for rows in args.rows:
+        seed_requests(rows, users=rows)
+        panel = None
+        try:
+            panel = admin_panel.AdminPanel(os.getenv('BOT_TOKEN', '123456:BENCH'))
+            panel.show()
+            panel.tabs.setCurrentIndex(list(admin_panel.TABLE_TABS).index(requests_tab))
+            wait_idle(panel)
+            table, model = panel.tables[requests_tab], panel.models[requests_tab]
+
+            def scroll():
+                # Как при прокрутке колесом: представление само запрашивает страницу, дойдя до конца
+                while model.rowCount() < args.scroll and model.canFetchMore():
+                    table.scrollToBottom()
+                    wait_idle(panel)
+
+            actions = [
+                ("load_all_data", panel.load_all_data, args.repeat),
+                ("scroll", scroll, 1),
+                ("reload_tab", lambda: panel.reload_tab(requests_tab), args.repeat),
+                ("render", lambda: table.viewport().grab(), args.repeat),
+            ]
+            for name, action, repeat in actions:
+                results = [measure(panel, action) for _ in range(repeat)]
+                peak = peak_memory(panel, action) if name != "scroll" else None
+                walls, blocked, worst, checkouts, connects = zip(*results)
+                print(f"rows={rows:<8} {name:<14} rows shown={model.rowCount():<6} "
+                      f"wall p50={percentile(walls, 50) * 1000:>8.1f} ms  "
+                      f"GUI busy p50={percentile(blocked, 50) * 1000:>7.1f} ms  max stall={max(worst) * 1000:>7.1f} ms  "
+                      f"checkouts={statistics.fmean(checkouts):.1f} new connections={sum(connects)}"
+                      + (f"  Python peak={peak / 1024:.0f} KiB" if peak is not None else ""))
+        finally:
+            if panel is not None:
+                panel.close()
+                panel.loader_pool.waitForDone()
+                panel.deleteLater()
+            cleanup_seed()
+    print(f"max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки бота")
+    parser.add_argument("--db", help="тестовая база (вместо DB_NAME); нужна сценариям, которые пишут в базу")
+    parser.set_defaults(writes=False)
+    subparsers = parser.add_subparsers(dest="scenario", required=True)
+
+    parser_async = subparsers.add_parser("async_db", help="конкурентность обработчиков: блокирующие запросы против AsyncDatabase")
+    parser_async.add_argument("--updates", type=int, default=500)
+    parser_async.add_argument("--concurrency", type=int, default=200)
+    parser_async.add_argument("--latency", type=float, default=0.01, help="длительность одного запроса, с")
+    parser_async.add_argument("--workers", type=int, default=POOL_MAX)
+    parser_async.set_defaults(func=bench_async_db)
+
+    parser_users = subparsers.add_parser("show_users", help="список пользователей: N+1 против постраничного запроса")
+    parser_users.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser_users.add_argument("--page-size", type=int, default=50)
+    parser_users.add_argument("--legacy-limit", type=int, default=10000, help="не запускать N+1 вариант на больших объёмах")
+    parser_users.set_defaults(func=bench_show_users, writes=True)
+
+    parser_outbox = subparsers.add_parser("outbox", help="рассылка уведомлений: прямые send_message против Outbox")
+    parser_outbox.add_argument("--chats", type=int, default=100)
+    parser_outbox.add_argument("--per-chat", type=int, default=3)
+    parser_outbox.add_argument("--latency", type=float, default=0.05, help="задержка ответа Telegram, с")
+    parser_outbox.set_defaults(func=bench_outbox)
+
+    parser_broadcast = subparsers.add_parser("broadcast", help="рассылка всем пользователям через Outbox")
+    parser_broadcast.add_argument("--rows", type=int, default=100000)
+    parser_broadcast.add_argument("--rate", type=float, default=3000,
+                                  help="лимит сообщений в секунду (у Telegram 30; больше — чтобы прогон был коротким)")
+    parser_broadcast.add_argument("--latency", type=float, default=0.02, help="задержка ответа Telegram, с")
+    parser_broadcast.add_argument("--batch", type=int, default=200, help="получателей на контрольную точку")
+    parser_broadcast.add_argument("--interrupt-after", type=float, default=0, help="остановить рассылку через N секунд и продолжить")
+    parser_broadcast.set_defaults(func=bench_broadcast, writes=True)
+
+    parser_webhook = subparsers.add_parser("webhook", help="доставка обновлений: long polling против webhook")
+    parser_webhook.add_argument("--updates", type=int, default=1000)
+    parser_webhook.add_argument("--rate", type=float, default=100, help="обновлений в секунду")
+    parser_webhook.add_argument("--users", type=int, default=500)
+    parser_webhook.add_argument("--latency", type=float, default=0.05, help="сетевая задержка до Telegram, с")
+    parser_webhook.add_argument("--max-in-flight", type=int, default=100)
+    parser_webhook.set_defaults(func=bench_webhook, writes=True)
+
+    parser_request = subparsers.add_parser("create_request", help="создание заявки при двойных нажатиях")
+    parser_request.add_argument("--clients", type=int, default=1000)
+    parser_request.add_argument("--taps", type=int, default=2)
+    parser_request.set_defaults(func=bench_create_request, writes=True)
+
+    parser_explain = subparsers.add_parser("explain", help="проверка, что горячие запросы используют свои индексы")
+    parser_explain.add_argument("--rows", type=int, default=1000000)
+    parser_explain.set_defaults(func=bench_explain, writes=True)
+
+    parser_hot = subparsers.add_parser("hot_queries", help="горячие запросы: с новыми индексами и без них")
+    parser_hot.add_argument("--rows", type=int, default=1000000)
+    parser_hot.add_argument("--repeat", type=int, default=50)
+    parser_hot.set_defaults(func=bench_hot_queries, writes=True)
+
+    parser_stats = subparsers.add_parser("stats", help="статистика: COUNT(*) против счётчиков")
+    parser_stats.add_argument("--rows", type=int, default=1000000)
+    parser_stats.add_argument("--repeat", type=int, default=20)
+    parser_stats.add_argument("--writes", type=int, default=2000)
+    parser_stats.set_defaults(func=bench_stats, writes=True)
+
+    parser_analytics = subparsers.add_parser("analytics", help="графики аналитики: сырые таблицы против итогов")
+    parser_analytics.add_argument("--rows", type=int, default=1000000)
+    parser_analytics.add_argument("--days", type=int, default=365, help="за сколько дней созданы заявки")
+    parser_analytics.add_argument("--repeat", type=int, default=20)
+    parser_analytics.add_argument("--raw-repeat", type=int, default=1, help="агрегация по сырым таблицам идёт десятки секунд")
+    parser_analytics.add_argument("--writes", type=int, default=2000)
+    parser_analytics.set_defaults(func=bench_analytics, writes=True)
+
+    parser_assignment = subparsers.add_parser("assignment", help="назначение мастеров: по одной заявке против пачек с кучей")
+    parser_assignment.add_argument("--rows", type=int, default=5000, help="ожидающих заявок")
+    parser_assignment.add_argument("--masters", type=int, default=500)
+    parser_assignment.add_argument("--dispatchers", type=int, default=4, help="параллельных распределителей")
+    parser_assignment.add_argument("--batch", type=int, default=100)
+    parser_assignment.add_argument("--max-busyness", type=int, default=0, help="0 — хватает на все заявки")
+    parser_assignment.set_defaults(func=bench_assignment, writes=True)
+
+    parser_geo = subparsers.add_parser("geo", help="ближайший мастер: GiST-индекс против перебора, назначение с учётом расстояния")
+    parser_geo.add_argument("--masters", type=int, default=5000)
+    parser_geo.add_argument("--rows", type=int, default=5000, help="ожидающих заявок с координатами")
+    parser_geo.add_argument("--queries", type=int, default=2000)
+    parser_geo.add_argument("--batch", type=int, default=100)
+    parser_geo.add_argument("--candidates", type=int, default=5, help="ближайших мастеров на заявку")
+    parser_geo.add_argument("--max-busyness", type=int, default=0, help="0 — хватает на все заявки")
+    parser_geo.set_defaults(func=bench_geo, writes=True)
+
+    parser_metrics = subparsers.add_parser("metrics", help="накладные расходы метрик на запросы к БД")
+    parser_metrics.add_argument("--queries", type=int, default=5000)
+    parser_metrics.add_argument("--observations", type=int, default=200000)
+    parser_metrics.add_argument("--labels", type=int, default=200, help="разных запросов в выдаче /metrics")
+    parser_metrics.set_defaults(func=bench_metrics)
+
+    parser_routing = subparsers.add_parser("routing", help="выбор обработчика сообщения и клавиатуры меню")
+    parser_routing.add_argument("--messages", type=int, default=20000, help="повторов на каждый вид сообщения")
+    parser_routing.add_argument("--keyboards", type=int, default=20000)
+    parser_routing.set_defaults(func=bench_routing)
+
+    parser_e2e = subparsers.add_parser("e2e", help="сквозной прогон обработчиков бота: регистрация, отчёты, заявки, статусы")
+    parser_e2e.add_argument("--users", type=int, default=1000, help="новых пользователей в диалогах")
+    parser_e2e.add_argument("--rows", type=int, default=100000, help="пользователей в базе заранее")
+    parser_e2e.add_argument("--requests", type=int, default=1000000, help="заявок в базе заранее")
+    parser_e2e.add_argument("--concurrency", type=int, default=100, help="одновременных диалогов")
+    parser_e2e.add_argument("--latency", type=float, default=0.01, help="задержка ответа Telegram, с")
+    parser_e2e.add_argument("--save", metavar="FILE", help="сохранить результат в JSON")
+    parser_e2e.add_argument("--baseline", metavar="FILE", help="сравнить с сохранённым результатом")
+    parser_e2e.add_argument("--tolerance", type=float, default=1.5, help="допустимый рост p50, раз")
+    parser_e2e.set_defaults(func=bench_e2e, writes=True)
+
+    parser_panel = subparsers.add_parser("admin_panel", help="админ-панель без экрана: обновление, прокрутка и отрисовка таблиц")
+    parser_panel.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser_panel.add_argument("--scroll", type=int, default=10000, help="до скольких строк прокрутить вкладку заявок")
+    parser_panel.add_argument("--repeat", type=int, default=10)
+    parser_panel.set_defaults(func=bench_admin_panel, writes=True)
+
+    args = parser.parse_args()
+    if args.db:
+        DB_CONFIG['dbname'] = args.db
+    elif args.writes and 'DB_NAME' not in os.environ:
+        parser.error(f"сценарий {args.scenario} создаёт и удаляет тестовые строки; "
+                     f"укажите тестовую базу через --db или DB_NAME (база бота {DB_CONFIG['dbname']} не используется)")
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+import os
+import time
+import asyncio
+import logging
+import psycopg2
+from database import Database, AsyncDatabase
+
+# Сколько получателей читается из БД за раз; после отправки каждой пачки сохраняется контрольная точка
+BROADCAST_BATCH = int(os.getenv('BROADCAST_BATCH', '200'))
+# Рассылка, heartbeat_at которой не обновлялся дольше этого времени, считается брошенной
+# (процесс упал) и подхватывается другим процессом
+BROADCAST_STALE_AFTER = int(os.getenv('BROADCAST_STALE_AFTER', '120'))
+# Как часто владелец продлевает heartbeat_at независимо от пачек: массовые сообщения уступают обычным,
+# и при нагрузке одна пачка может отправляться дольше BROADCAST_STALE_AFTER
+BROADCAST_HEARTBEAT_INTERVAL = float(os.getenv('BROADCAST_HEARTBEAT_INTERVAL', str(BROADCAST_STALE_AFTER / 4)))
+BROADCAST_WATCH_INTERVAL = 60
+
+
+class BroadcastDatabase(Database):
+    # Создание рассылки: число получателей фиксируется сразу, сама рассылка принадлежит создавшему процессу
+    @staticmethod
+    def create_broadcast(text, author_id):
+        with BroadcastDatabase() as cursor:
+            cursor.execute("""
+                INSERT INTO broadcasts (author_id, text, total, heartbeat_at)
+                VALUES (%s, %s, (SELECT COUNT(*) FROM users WHERE registered), CURRENT_TIMESTAMP)
+                RETURNING id, author_id, text, total, last_user_id, sent, failed
+            """, (author_id, text))
+            return cursor.fetchone()
+
+    # Следующая пачка получателей после контрольной точки (keyset по уникальному индексу telegram_id)
+    @staticmethod
+    def get_recipients(after_id, limit):
+        with BroadcastDatabase() as cursor:
+            cursor.execute("""
+                SELECT telegram_id FROM users
+                WHERE registered AND telegram_id > %s
+                ORDER BY telegram_id
+                LIMIT %s
+            """, (after_id, limit))
+            return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def save_progress(broadcast_id, last_user_id, sent, failed):
+        with BroadcastDatabase() as cursor:
+            cursor.execute("""
+                UPDATE broadcasts
+                SET last_user_id = %s, sent = %s, failed = %s, heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (last_user_id, sent, failed, broadcast_id))
+
+    # Продление владения; отпущенную (heartbeat_at IS NULL) или завершённую рассылку не трогает,
+    # даже если release_broadcast закоммитился во время этого запроса
+    @staticmethod
+    def touch_broadcast(broadcast_id):
+        with BroadcastDatabase() as cursor:
+            cursor.execute("""
+                UPDATE broadcasts SET heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND status = 'running' AND heartbeat_at IS NOT NULL
+            """, (broadcast_id,))
+
+    @staticmethod
+    def finish_broadcast(broadcast_id, status):
+        with BroadcastDatabase() as cursor:
+            cursor.execute("""
+                UPDATE broadcasts SET status = %s, finished_at = CURRENT_TIMESTAMP, heartbeat_at = NULL
+                WHERE id = %s
+            """, (status, broadcast_id))
+
+    # Остановка процесса: рассылку сразу может подхватить другой процесс
+    @staticmethod
+    def release_broadcast(broadcast_id):
+        with BroadcastDatabase() as cursor:
+            cursor.execute("UPDATE broadcasts SET heartbeat_at = NULL WHERE id = %s", (broadcast_id,))
+
+    # Забирает незавершённые рассылки без живого владельца; SKIP LOCKED — чтобы два процесса не взяли одну
+    @staticmethod
+    def claim_stale_broadcasts(stale_after):
+        with BroadcastDatabase() as cursor:
+            cursor.execute("""
+                UPDATE broadcasts SET heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM broadcasts
+                    WHERE status = 'running'
+                      AND (heartbeat_at IS NULL OR heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, author_id, text, total, last_user_id, sent, failed
+            """, (stale_after,))
+            return cursor.fetchall()
+
+
+# Состояние рассылки в памяти процесса, который её отправляет
+class BroadcastState:
+    __slots__ = ('id', 'author_id', 'text', 'total', 'last_user_id', 'sent', 'failed', 'started', 'processed_at_start')
+
+    def __init__(self, row):
+        self.id, self.author_id, self.text, self.total, self.last_user_id, self.sent, self.failed = row
+        self.started = time.monotonic()
+        self.processed_at_start = self.sent + self.failed
+
+    @property
+    def processed(self):
+        return self.sent + self.failed
+
+    # Сообщений в секунду с момента запуска (или возобновления) в этом процессе
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.processed - self.processed_at_start) / elapsed if elapsed > 0 else 0.0
+
+
+# Рассылка сообщения всем зарегистрированным пользователям через Outbox.
+# Получатели читаются пачками по BROADCAST_BATCH, в очереди Outbox не больше двух пачек,
+# так что память не зависит от числа пользователей. После каждой пачки в broadcasts сохраняется
+# последний обработанный telegram_id; после падения рассылка продолжится с него
+# (сообщения из незафиксированной пачки могут прийти повторно). Пока рассылка идёт, heartbeat_at
+# продлевается каждые BROADCAST_HEARTBEAT_INTERVAL секунд, чтобы её не подхватил другой процесс.
+class Broadcaster:
+    # on_progress и on_done — корутины, получают BroadcastState
+    def __init__(self, outbox, adb=None, batch_size=BROADCAST_BATCH, on_progress=None, on_done=None,
+                 heartbeat_interval=BROADCAST_HEARTBEAT_INTERVAL):
+        self.outbox = outbox
+        self.adb = adb or AsyncDatabase(BroadcastDatabase, max_workers=2)
+        self.batch_size = batch_size
+        self.heartbeat_interval = heartbeat_interval
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.tasks = {}
+
+    async def start(self, text, author_id=None):
+        state = BroadcastState(await self.adb.create_broadcast(text, author_id))
+        self._spawn(state)
+        return state
+
+    # Подхватывает брошенные рассылки: при запуске и затем каждые interval секунд
+    async def watch(self, interval=BROADCAST_WATCH_INTERVAL):
+        while True:
+            try:
+                for row in await self.adb.claim_stale_broadcasts(BROADCAST_STALE_AFTER):
+                    state = BroadcastState(row)
+                    logging.info(f"Resuming broadcast {state.id} after user {state.last_user_id}")
+                    self._spawn(state)
+            except psycopg2.Error as e:
+                logging.error(f"Database error: {e}")
+            await asyncio.sleep(interval)
+
+    def _spawn(self, state):
+        task = asyncio.create_task(self.run(state))
+        self.tasks[state.id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(state.id, None))
+
+    async def run(self, state):
+        pending = []
+        after_id = state.last_user_id
+        heartbeat = asyncio.create_task(self._heartbeat(state.id))
+        try:
+            while True:
+                recipients = await self.adb.get_recipients(after_id, self.batch_size)
+                if recipients:
+                    after_id = recipients[-1]
+                    pending.append((recipients, [self.outbox.send(user_id, state.text, bulk=True) for user_id in recipients]))
+                # Пока отправляется одна пачка, следующая уже стоит в очереди
+                while len(pending) > 1 or (pending and not recipients):
+                    await self._settle(state, *pending[0])
+                    pending.pop(0)
+                    await self.adb.save_progress(state.id, state.last_user_id, state.sent, state.failed)
+                    if self.on_progress:
+                        await self.on_progress(state)
+                if not recipients:
+                    break
+            await self.adb.finish_broadcast(state.id, 'completed')
+            logging.info(f"Broadcast {state.id} completed: sent={state.sent} failed={state.failed} "
+                         f"rate={state.rate:.1f} msg/s")
+            if self.on_done:
+                await self.on_done(state)
+        except asyncio.CancelledError:
+            heartbeat.cancel()
+            await self._abandon(state, pending)
+            raise
+        except psycopg2.Error as e:
+            logging.error(f"Database error: {e}")
+            heartbeat.cancel()
+            # Рассылку продолжит процесс, который первым заберёт её в watch(), без ожидания BROADCAST_STALE_AFTER
+            try:
+                await self._abandon(state, pending)
+            except psycopg2.Error as e:
+                logging.error(f"Database error: {e}")
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, broadcast_id):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.adb.touch_broadcast(broadcast_id)
+            except psycopg2.Error as e:
+                logging.error(f"Database error: {e}")
+
+    # Неотправленные сообщения снимаются с очереди, уже отправленные попадают в контрольную точку,
+    # рассылка отпускается — её сразу может подхватить другой процесс
+    async def _abandon(self, state, pending):
+        for _, futures in pending:
+            for future in futures:
+                future.cancel()
+        for recipients, futures in pending:
+            if not await self._settle(state, recipients, futures):
+                break
+        await self.adb.save_progress(state.id, state.last_user_id, state.sent, state.failed)
+        await self.adb.release_broadcast(state.id)
+
+    # Дожидается пачки и сдвигает контрольную точку до первого неотправленного получателя
+    @staticmethod
+    async def _settle(state, recipients, futures):
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for user_id, result in zip(recipients, results):
+            if isinstance(result, asyncio.CancelledError):
+                return False
+            if isinstance(result, Exception):
+                state.failed += 1
+            else:
+                state.sent += 1
+            state.last_user_id = user_id
+        return True
+
+    async def stop(self):
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+
+# Через сколько вызовов set() удалять из кэша просроченные записи
+PURGE_EVERY = 1024
+
+
+# Кэш «ключ → значение» с временем жизни записей и счётчиками попаданий.
+# Используется только из цикла событий, поэтому блокировки не нужны.
+class TTLCache:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.data = {}
+        # Увеличивается при каждой инвалидации: значение, загруженное до неё, в кэш не попадёт
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._sets = 0
+
+    def get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > time.monotonic():
+                self.hits += 1
+                return value
+            del self.data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value, generation=None):
+        if generation is not None and generation != self.generation:
+            return
+        self.data[key] = (value, time.monotonic() + self.ttl)
+        self._sets += 1
+        if self._sets % PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def invalidate(self, key):
+        self.data.pop(key, None)
+        self.generation += 1
+        self.invalidations += 1
+
+    def clear(self):
+        self.data.clear()
+        self.generation += 1
+        self.invalidations += 1
+
+    def purge_expired(self):
+        now = time.monotonic()
+        for key in [key for key, (_, expires_at) in self.data.items() if expires_at <= now]:
+            del self.data[key]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'invalidations': self.invalidations,
+        }
+
+
+# TTLCache с ограничением размера: при переполнении вытесняется запись, к которой дольше всего
+# не обращались. Для кэшей по всем пользователям, где число ключей не ограничено ничем другим.
+class LRUCache(TTLCache):
+    def __init__(self, ttl: float, maxsize: int):
+        super().__init__(ttl)
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        value = super().get(key, default)
+        if key in self.data:
+            self.data.move_to_end(key)
+        return value
+
+    def set(self, key, value, generation=None):
+        if generation is not None and generation != self.generation:
+            return
+        self.data[key] = (value, time.monotonic() + self.ttl)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        result = super().stats()
+        result['maxsize'] = self.maxsize
+        result['evictions'] = self.evictions
+        return result
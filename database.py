@@ -0,0 +1,331 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+from metrics import metrics, MetricsCursor, METRICS_ENABLED
+
+# Параметры подключения (можно переопределить через переменные окружения)
+DB_CONFIG = {
+    'dbname': os.getenv('DB_NAME', 'cursova'),
+    'user': os.getenv('DB_USER', 'postgres'),
+    'password': os.getenv('DB_PASSWORD', '2791'),  # Замени на свой пароль
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'port': os.getenv('DB_PORT', '5432'),
+}
+
+POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+# Соединение, простоявшее дольше этого времени, проверяется запросом SELECT 1
+POOL_CHECK_INTERVAL = float(os.getenv('DB_POOL_CHECK_INTERVAL', '30'))
+
+# Канал LISTEN/NOTIFY, в который пишется telegram_id пользователя при изменении его профиля или роли
+USER_CHANGED_CHANNEL = 'user_changed'
+
+
+# Наследуемся от OperationalError, чтобы существующие обработчики psycopg2.Error ловили и эти ошибки
+class PoolError(psycopg2.OperationalError):
+    pass
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+# Потокобезопасный пул соединений с ограничением размера и проверкой живости
+class ConnectionPool:
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT,
+                 check_interval=POOL_CHECK_INTERVAL, **dsn):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: minconn=%s, maxconn=%s" % (minconn, maxconn))
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.dsn = dsn or DB_CONFIG
+        self._idle = deque()  # (conn, время возврата в пул)
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            'acquired': 0,
+            'connects': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'discarded': 0,
+        }
+        for _ in range(minconn):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.dsn)
+        with self._cond:
+            self._stats['connects'] += 1
+        return conn
+
+    def _is_healthy(self, conn, released_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("Connection pool is closed")
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, released_at = None, None
+                    break
+                waited = True
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"Timed out after {timeout:.1f}s waiting for a database connection")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._stats['acquired'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_time'] += time.monotonic() - started
+
+        try:
+            if conn is not None and not self._is_healthy(conn, released_at):
+                with self._cond:
+                    self._stats['health_check_failures'] += 1
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, broken=False):
+        if not broken and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                broken = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+        broken = bool(broken or conn.closed)
+
+        with self._cond:
+            self._in_use -= 1
+            if broken or self._closed:
+                self._size -= 1
+                self._stats['discarded'] += broken
+            else:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            result = dict(self._stats)
+            result.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._in_use,
+                max=self.maxconn,
+            )
+        result['avg_wait'] = result['wait_time'] / result['waits'] if result['waits'] else 0.0
+        return result
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Общий пул процесса, создаётся при первом обращении
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def pool_stats():
+    return _pool.stats() if _pool is not None else None
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+# Класс для работы с базой данных: берёт соединение из пула и возвращает его по выходу из блока with.
+# Замеряются ожидание соединения (db_connect_seconds), каждый запрос (MetricsCursor) и весь блок
+# до COMMIT/ROLLBACK (db_transaction_seconds с именем класса)
+class Database:
+    def __init__(self):
+        self.pool = get_pool()
+        self.conn = None
+        self.cursor = None
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.conn = self.pool.getconn()
+        try:
+            if METRICS_ENABLED:
+                metrics.observe('db_connect_seconds', time.perf_counter() - self.started)
+                self.cursor = self.conn.cursor(cursor_factory=MetricsCursor)
+            else:
+                self.cursor = self.conn.cursor()
+        except psycopg2.Error:
+            self.pool.putconn(self.conn, broken=True)
+            raise
+        return self.cursor
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.cursor.close()
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            # Разорванное соединение пул отбросит сам (conn.closed / статус транзакции)
+            self.pool.putconn(self.conn)
+            self.conn = None
+            self.cursor = None
+            if METRICS_ENABLED:
+                metrics.observe('db_transaction_seconds', time.perf_counter() - self.started,
+                                database=type(self).__name__)
+
+
+
+# Асинхронная обёртка: выполняет синхронные методы класса Database в пуле потоков,
+# чтобы запросы не блокировали цикл событий aiogram.
+# Пример: reports = await adb.get_recent_reports(user_id)
+class AsyncDatabase:
+    def __init__(self, database_cls, max_workers=None):
+        self.database_cls = database_cls
+        # Потоков не больше, чем соединений в пуле: лишние всё равно ждали бы соединения
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or POOL_MAX, thread_name_prefix='db')
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        func = getattr(self.database_cls, name)
+        if not callable(func):
+            return func
+
+        async def call(*args, **kwargs):
+            return await self.run(func, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+# Сообщает процессам бота об изменении пользователя (ФИО, регистрация, роль); уходит только после COMMIT
+def notify_user_changed(cursor, user_id):
+    cursor.execute("SELECT pg_notify(%s, %s)", (USER_CHANGED_CHANNEL, str(user_id)))
+
+
+# Слушает каналы LISTEN/NOTIFY на отдельном соединении (вне пула) внутри цикла asyncio.
+# handlers: {канал: функция(payload)}; on_connect вызывается после каждого (пере)подключения,
+# т.к. уведомления, пришедшие во время разрыва, потеряны.
+class NotificationListener:
+    def __init__(self, handlers: dict, on_connect=None, reconnect_delay=5.0):
+        self.handlers = handlers
+        self.on_connect = on_connect
+        self.reconnect_delay = reconnect_delay
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            conn = None
+            try:
+                conn = await loop.run_in_executor(None, partial(psycopg2.connect, **DB_CONFIG))
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    for channel in self.handlers:
+                        cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                if self.on_connect:
+                    self.on_connect()
+
+                ready = asyncio.Event()
+                loop.add_reader(conn.fileno(), ready.set)
+                try:
+                    while True:
+                        await ready.wait()
+                        ready.clear()
+                        conn.poll()
+                        while conn.notifies:
+                            notify = conn.notifies.pop(0)
+                            try:
+                                self.handlers[notify.channel](notify.payload)
+                            except Exception as e:
+                                logging.error(f"Notification handler error: {e}")
+                finally:
+                    loop.remove_reader(conn.fileno())
+            except psycopg2.Error as e:
+                logging.error(f"Notification listener error: {e}")
+            finally:
+                if conn is not None:
+                    conn.close()
+            await asyncio.sleep(self.reconnect_delay)
@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+from collections import defaultdict
+from aiohttp import ClientSession, web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from outbox import TokenBucket
+
+# Локальная имитация Bot API для проверки бота и бенчмарков без обращения к Telegram.
+# Отвечает на методы, которые использует бот, с задержкой latency и с теми же лимитами,
+# что и Telegram: при превышении возвращает 429 с parameters.retry_after.
+# Запуск отдельно: python fake_telegram.py --port 8081, затем TELEGRAM_API_URL=http://127.0.0.1:8081 python main.py
+# Обновления для бота: push_update() (отдаются через getUpdates) или post_updates() на адрес webhook.
+
+FAKE_BOT_ID = 123456
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.05, global_rate=30, chat_rate=1, chat_burst=3, error_rate=0.0):
+        self.latency = latency
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.error_rate = error_rate
+        self.global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self.chat_buckets = {}
+        # Доставленные сообщения по чатам, в порядке получения
+        self.messages = defaultdict(list)
+        self.calls = defaultdict(int)
+        self.rate_limited = 0
+        self.errors = 0
+        self.message_ids = 0
+        # Вызывается для каждого доставленного сообщения: on_message(chat_id, text)
+        self.on_message = None
+        self.updates = []
+        self.updates_ready = asyncio.Event()
+        self.runner = None
+        self.url = None
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.runner = web.AppRunner(self.make_app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def reset(self):
+        self.global_bucket = TokenBucket(self.global_rate, max(1, int(self.global_rate)))
+        self.chat_buckets.clear()
+        self.messages.clear()
+        self.calls.clear()
+        self.rate_limited = 0
+        self.errors = 0
+        self.updates.clear()
+
+    def push_update(self, update):
+        self.updates.append(update)
+        self.updates_ready.set()
+
+    @staticmethod
+    def ok(result):
+        return web.json_response({'ok': True, 'result': result})
+
+    @staticmethod
+    def error(code, description, **parameters):
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return web.json_response(body, status=code)
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        params = dict(await request.post())
+        if not params and request.can_read_body:
+            params = await request.json()
+        self.calls[method] += 1
+        if method == 'getUpdates':
+            return await self.get_updates(params)
+        await asyncio.sleep(self.latency)
+        handler = getattr(self, f"method_{method}", None)
+        if handler is None:
+            return self.ok(True)
+        return handler(params)
+
+    # Long polling: ждёт обновлений до timeout секунд; задержка сети — после появления обновлений,
+    # как у ответа настоящего Telegram
+    async def get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates:
+            self.updates_ready.clear()
+            try:
+                await asyncio.wait_for(self.updates_ready.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        await asyncio.sleep(self.latency)
+        return self.ok(self.updates[:int(params.get('limit') or 100)])
+
+    def method_getMe(self, params):
+        return self.ok({'id': FAKE_BOT_ID, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'})
+
+    def method_sendMessage(self, params):
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return self.error(500, "Internal Server Error")
+        chat_id = int(params['chat_id'])
+        now = time.monotonic()
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        wait = max(bucket.wait_time(now), self.global_bucket.wait_time(now))
+        if wait > 0:
+            self.rate_limited += 1
+            retry_after = math.ceil(wait)
+            return self.error(429, f"Too Many Requests: retry after {retry_after}", retry_after=retry_after)
+        bucket.consume()
+        self.global_bucket.consume()
+        self.messages[chat_id].append(params['text'])
+        if self.on_message:
+            self.on_message(chat_id, params['text'])
+        self.message_ids += 1
+        return self.ok({
+            'message_id': self.message_ids,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': FAKE_BOT_ID, 'is_bot': True, 'first_name': 'Fake'},
+            'text': params['text'],
+        })
+
+    def method_editMessageText(self, params):
+        return self.ok({
+            'message_id': int(params.get('message_id', 0)),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+            'text': params['text'],
+        })
+
+    def stats(self):
+        return {
+            'calls': dict(self.calls),
+            'delivered': sum(len(texts) for texts in self.messages.values()),
+            'rate_limited': self.rate_limited,
+            'errors': self.errors,
+        }
+
+
+update_ids = itertools.count(int(time.time() * 1000))
+
+
+# Обновление с текстовым сообщением от пользователя user_id
+def make_message_update(user_id, text, update_id=None):
+    update_id = next(update_ids) if update_id is None else update_id
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'},
+            'text': text,
+        },
+    }
+
+
+# Обновление с нажатием inline-кнопки (callback_data = data) под сообщением бота message_id
+def make_callback_update(user_id, data, message_id=1, update_id=None):
+    update_id = next(update_ids) if update_id is None else update_id
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'},
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': FAKE_BOT_ID, 'is_bot': True, 'first_name': 'Fake'},
+                'text': 'Выберите новый статус:',
+            },
+            'data': data,
+        },
+    }
+
+
+# Отправляет обновления на webhook бота так же, как Telegram: не больше concurrency запросов одновременно.
+# Возвращает {HTTP-статус: количество}
+async def post_updates(url, updates, concurrency=40, secret=None, latency=0.0):
+    statuses = defaultdict(int)
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+
+    async with ClientSession() as session:
+        async def post(update):
+            async with semaphore:
+                await asyncio.sleep(latency)
+                async with session.post(url, json=update, headers=headers) as response:
+                    statuses[response.status] += 1
+
+        await asyncio.gather(*(post(update) for update in updates))
+    return dict(statuses)
+
+
+# Bot, который ходит на fake-сервер вместо api.telegram.org
+def make_bot(url, token=f"{FAKE_BOT_ID}:FAKE", **kwargs):
+    return Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(url)), **kwargs)
+
+
+async def serve(args):
+    fake = FakeTelegram(latency=args.latency, global_rate=args.global_rate, chat_rate=args.chat_rate,
+                        error_rate=args.error_rate)
+    url = await fake.start(args.host, args.port)
+    print(f"Fake Telegram API on {url}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(json.dumps(fake.stats(), ensure_ascii=False))
+    finally:
+        await fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная имитация Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа, с")
+    parser.add_argument("--global-rate", type=float, default=30)
+    parser.add_argument("--chat-rate", type=float, default=1)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500 на sendMessage")
+    parser.add_argument("--post-to", help="вместо запуска сервера отправить обновления на этот адрес webhook")
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--text", default="/start")
+    parser.add_argument("--secret")
+    args = parser.parse_args()
+    try:
+        if args.post_to:
+            updates = [make_message_update(1 + i % args.users, args.text) for i in range(args.updates)]
+            started = time.perf_counter()
+            statuses = asyncio.run(post_updates(args.post_to, updates, secret=args.secret))
+            print(f"{args.updates} updates in {time.perf_counter() - started:.2f} s, statuses: {statuses}")
+        else:
+            asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import os
+import re
+import csv
+import math
+import hashlib
+import argparse
+from database import Database
+
+# Координаты адресов заявок и местоположение мастеров. Внешние геокодеры не используются:
+# улица ищется в справочнике GEO_GAZETTEER (CSV "улица;широта;долгота", например выгрузка улиц города из OSM).
+# Адреса с улицей не из справочника координат не получают — такие заявки распределяются только по занятости.
+# GEO_HASH_FALLBACK=1 — вместо этого давать им детерминированную точку в круге GEO_CITY_RADIUS_KM
+# вокруг центра города (для разработки и бенчмарков без справочника).
+GEO_GAZETTEER = os.getenv('GEO_GAZETTEER')
+GEO_HASH_FALLBACK = os.getenv('GEO_HASH_FALLBACK', '0') == '1'
+GEO_CITY_CENTER = tuple(float(value) for value in os.getenv('GEO_CITY_CENTER', '55.7558,37.6173').split(','))
+GEO_CITY_RADIUS_KM = float(os.getenv('GEO_CITY_RADIUS_KM', '20'))
+
+KM_PER_DEGREE = 111.195
+
+# Тип улицы и номер дома в ключ справочника не входят: "ул. Ленина, д. 5" и "Ленина улица 5" — одна улица
+STREET_TYPES = {
+    'ул', 'улица', 'пр', 'пр-т', 'просп', 'проспект', 'пер', 'переулок', 'б-р', 'бульвар', 'ш', 'шоссе',
+    'пл', 'площадь', 'наб', 'набережная', 'проезд', 'пр-д', 'туп', 'тупик', 'аллея', 'д', 'дом', 'кв', 'корп', 'стр',
+}
+WORD = re.compile(r'[^\W\d_]+(?:-[^\W\d_]+)*')
+
+
+def street_key(text):
+    return ' '.join(word for word in WORD.findall(text.lower().replace('ё', 'е')) if word not in STREET_TYPES)
+
+
+# Точка (широта, долгота) в км на плоскости вокруг центра города (равнопромежуточная проекция):
+# в пределах города расстояние между точками отличается от расстояния по поверхности Земли меньше чем на 1%
+def project(latitude, longitude, center=GEO_CITY_CENTER):
+    center_latitude, center_longitude = center
+    return ((longitude - center_longitude) * KM_PER_DEGREE * math.cos(math.radians(center_latitude)),
+            (latitude - center_latitude) * KM_PER_DEGREE)
+
+
+def unproject(x, y, center=GEO_CITY_CENTER):
+    center_latitude, center_longitude = center
+    return (center_latitude + y / KM_PER_DEGREE,
+            center_longitude + x / (KM_PER_DEGREE * math.cos(math.radians(center_latitude))))
+
+
+class Geocoder:
+    # streets — {street_key(улица): (широта, долгота)}
+    def __init__(self, streets=None, hash_fallback=GEO_HASH_FALLBACK, center=GEO_CITY_CENTER,
+                 radius_km=GEO_CITY_RADIUS_KM):
+        self.streets = streets or {}
+        self.hash_fallback = hash_fallback
+        self.center = center
+        self.radius_km = radius_km
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        streets = {}
+        with open(path, encoding='utf-8', newline='') as f:
+            for row in csv.reader(f, delimiter=';'):
+                if len(row) >= 3 and not row[0].startswith('#'):
+                    streets[street_key(row[0])] = (float(row[1]), float(row[2]))
+        return cls(streets, **kwargs)
+
+    # (широта, долгота) или None. Части адреса через запятую проверяются по очереди:
+    # "г. Москва, ул. Тверская, 7" находится по "тверская". Пустой адрес (или None) — None
+    def locate(self, address):
+        if not address or not address.strip():
+            return None
+        for part in address.split(','):
+            point = self.streets.get(street_key(part))
+            if point is not None:
+                return point
+        if not self.hash_fallback:
+            return None
+        digest = hashlib.sha1(' '.join(address.lower().split()).encode('utf-8')).digest()
+        # Равномерно по кругу: радиус — корень из равномерной величины
+        distance = self.radius_km * math.sqrt(int.from_bytes(digest[:4], 'big') / 2 ** 32)
+        angle = 2 * math.pi * int.from_bytes(digest[4:8], 'big') / 2 ** 32
+        return unproject(distance * math.cos(angle), distance * math.sin(angle), self.center)
+
+
+geocoder = Geocoder.from_file(GEO_GAZETTEER) if GEO_GAZETTEER else Geocoder()
+
+
+class GeoDatabase(Database):
+    @staticmethod
+    def set_master_location(user_id, latitude, longitude):
+        x, y = project(latitude, longitude)
+        with GeoDatabase() as cursor:
+            cursor.execute("""
+                UPDATE masters SET latitude = %s, longitude = %s, location = point(%s, %s), located_at = CURRENT_TIMESTAMP
+                WHERE user_id = %s
+            """, (latitude, longitude, x, y, user_id))
+            return cursor.rowcount > 0
+
+    # Ближайшие к точке мастера, у которых меньше max_busyness заявок в работе: [(user_id, busyness, км)]
+    @staticmethod
+    def nearest_masters(latitude, longitude, max_busyness, limit=5):
+        x, y = project(latitude, longitude)
+        with GeoDatabase() as cursor:
+            cursor.execute("""
+                SELECT user_id, busyness, location <-> point(%(x)s, %(y)s) FROM masters
+                WHERE location IS NOT NULL AND busyness < %(max_busyness)s
+                ORDER BY location <-> point(%(x)s, %(y)s)
+                LIMIT %(limit)s
+            """, {'x': x, 'y': y, 'max_busyness': max_busyness, 'limit': limit})
+            return cursor.fetchall()
+
+    # Пересчёт location после смены центра проекции (GEO_CITY_CENTER)
+    @staticmethod
+    def reproject():
+        latitude, longitude = GEO_CITY_CENTER
+        scale_x = KM_PER_DEGREE * math.cos(math.radians(latitude))
+        with GeoDatabase() as cursor:
+            for table in ("requests", "masters"):
+                cursor.execute(f"""
+                    UPDATE {table}
+                    SET location = point((longitude - %s) * %s, (latitude - %s) * %s)
+                    WHERE latitude IS NOT NULL
+                """, (longitude, scale_x, latitude, KM_PER_DEGREE))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Координаты заявок и мастеров")
+    parser.add_argument("--reproject", action="store_true", help="пересчитать location после смены GEO_CITY_CENTER")
+    parser.add_argument("--locate", metavar="АДРЕС", help="показать координаты адреса")
+    args = parser.parse_args()
+    if args.reproject:
+        GeoDatabase.reproject()
+        print("Координаты пересчитаны")
+    if args.locate:
+        point = geocoder.locate(args.locate)
+        print(f"{point[0]:.6f}, {point[1]:.6f}" if point else "Адрес не найден в справочнике")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 import os
+import asyncio
 import logging
 import psycopg2
 import re
+import html
 from functools import wraps
 from aiogram import Bot, Dispatcher, Router, types, F
 from aiogram.fsm.storage.memory import MemoryStorage
@@ -9,69 +11,232 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.types import ReplyKeyboardRemove, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramAPIError
+from aiogram.filters import Filter, StateFilter
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import ReplyKeyboardRemove, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from dotenv import load_dotenv
+from database import Database as BaseDatabase, AsyncDatabase, NotificationListener, USER_CHANGED_CHANNEL, notify_user_changed, pool_stats
+from profiles import ProfileCache
+from outbox import Outbox
+from broadcast import Broadcaster
+from assignment import AUTO_ASSIGN, AssignmentEngine
+from geo import GeoDatabase, geocoder, project
+from storage import PostgresStorage
+from migrations import MIGRATE_ON_STARTUP, migrate
+from stats import StatsDatabase, format_stats
+import metrics as bot_metrics
+from metrics import metrics, METRICS_LOG_INTERVAL
 
 load_dotenv('BOT_TOKEN.env')
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
-# Класс для работы с базой данных
-class Database:
-    def __init__(self):
-        self.conn = psycopg2.connect(
-            dbname="cursova",
-            user="postgres",
-            password="2791",  # Замени на свой пароль
-            host="localhost",
-            port="5432"
-        )
-
-    def __enter__(self):
-        self.cursor = self.conn.cursor()
-        return self.cursor
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.cursor.close()
-        if exc_type is None:
-            self.conn.commit()
-        else:
-            self.conn.rollback()
-        self.conn.close()
+# Класс для работы с базой данных (соединения берутся из общего пула)
+class Database(BaseDatabase):
+    @staticmethod
+    def get_admin_id() -> int:
+        with Database() as cursor:
+            cursor.execute("SELECT telegram_id FROM users WHERE role = 'admin' LIMIT 1")
+            result = cursor.fetchone()
+            return result[0] if result else None
 
+    # Вставка и уведомление USER_CHANGED_CHANNEL одним запросом; False, если пользователь уже есть
     @staticmethod
-    def get_user_role(user_id: int) -> str:
+    def register_user(user_id: int, full_name: str, phone: str) -> bool:
         with Database() as cursor:
-            cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (str(user_id),))
-            user_role = cursor.fetchone()
-            if user_role and user_role[0] == 'admin':
-                return 'admin'
-            cursor.execute("SELECT COUNT(*) FROM masters WHERE user_id = %s", (str(user_id),))
-            return 'master' if cursor.fetchone()[0] > 0 else 'client'
+            cursor.execute('''
+                WITH inserted AS (
+                    INSERT INTO users 
+                    (telegram_id, full_name, phone, role, registered) 
+                    VALUES (%s, %s, %s, 'client', TRUE)
+                    ON CONFLICT (telegram_id) DO NOTHING
+                    RETURNING telegram_id
+                )
+                SELECT pg_notify(%s, telegram_id::text) FROM inserted
+            ''', (user_id, full_name, phone, USER_CHANGED_CHANNEL))
+            return cursor.fetchone() is not None
 
     @staticmethod
-    def is_registered(user_id: int) -> bool:
+    def add_master_request(user_id: int) -> bool:
         with Database() as cursor:
-            cursor.execute("SELECT registered FROM users WHERE telegram_id = %s", (str(user_id),))
+            cursor.execute("SELECT COUNT(*) FROM master_requests WHERE user_id = %s", (user_id,))
+            if cursor.fetchone()[0] > 0:
+                return False
+            cursor.execute("INSERT INTO master_requests (user_id) VALUES (%s)", (user_id,))
+            return True
+
+    @staticmethod
+    def get_master_requests() -> list:
+        with Database() as cursor:
+            cursor.execute('''
+                SELECT mr.user_id, u.full_name 
+                FROM master_requests mr 
+                JOIN users u ON mr.user_id = u.telegram_id
+            ''')
+            return cursor.fetchall()
+
+    # Удаляет запрос и при confirm делает пользователя мастером. False, если запроса не было
+    @staticmethod
+    def resolve_master_request(user_id: int, confirm: bool) -> bool:
+        with Database() as cursor:
+            cursor.execute("DELETE FROM master_requests WHERE user_id = %s RETURNING user_id", (user_id,))
+            if cursor.fetchone() is None:
+                return False
+            if confirm:
+                cursor.execute("INSERT INTO masters (user_id, busyness) VALUES (%s, 0) ON CONFLICT (user_id) DO NOTHING", (user_id,))
+                notify_user_changed(cursor, user_id)
+            return True
+
+    @staticmethod
+    def add_report(user_id: int, text: str):
+        with Database() as cursor:
+            cursor.execute("INSERT INTO reports (user_id, report_text) VALUES (%s, %s)", 
+                           (user_id, text))
+
+    @staticmethod
+    def get_recent_reports(user_id: int, limit: int = 5) -> list:
+        with Database() as cursor:
+            cursor.execute('''SELECT report_text, admin_feedback 
+                            FROM reports 
+                            WHERE user_id = %s 
+                            ORDER BY created_at DESC LIMIT %s''',
+                           (user_id, limit))
+            return cursor.fetchall()
+
+    # Одна активная заявка на клиента гарантируется частичным уникальным индексом idx_requests_active_client:
+    # при повторном нажатии вставка ничего не делает. Возвращает номер новой заявки или None
+    # coordinates — (широта, долгота) адреса или None, если адрес не удалось геокодировать
+    @staticmethod
+    def create_request(client_id: int, address: str, coordinates=None):
+        latitude, longitude = coordinates or (None, None)
+        x, y = project(latitude, longitude) if coordinates else (None, None)
+        with Database() as cursor:
+            cursor.execute('''
+                INSERT INTO requests (client_id, address, latitude, longitude, location)
+                VALUES (%s, %s, %s, %s, point(%s, %s))
+                ON CONFLICT (client_id) WHERE status != 'completed' DO NOTHING
+                RETURNING id
+            ''', (client_id, address, latitude, longitude, x, y))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    @staticmethod
+    def get_master_jobs(master_id: int) -> list:
+        with Database() as cursor:
+            cursor.execute('''
+                SELECT r.id, r.address, r.status, u.full_name 
+                FROM requests r 
+                JOIN users u ON r.client_id = u.telegram_id 
+                WHERE r.master_id = %s
+            ''', (master_id,))
+            return cursor.fetchall()
+
+    # Незавершённые заявки мастера, новые сверху: [(id, client_id, address, status)]
+    @staticmethod
+    def get_active_requests(master_id: int, limit: int) -> list:
+        with Database() as cursor:
+            cursor.execute('''
+                SELECT id, client_id, address, status
+                FROM requests
+                WHERE master_id = %s AND status != 'completed'
+                ORDER BY created_at DESC LIMIT %s
+            ''', (master_id, limit))
+            return cursor.fetchall()
+
+    # Клиент незавершённой заявки мастера (по первичному ключу) или None, если заявка не его или уже завершена
+    @staticmethod
+    def get_request_client(request_id: int, master_id: int):
+        with Database() as cursor:
+            cursor.execute('''
+                SELECT client_id FROM requests
+                WHERE id = %s AND master_id = %s AND status != 'completed'
+            ''', (request_id, master_id))
             result = cursor.fetchone()
-            return bool(result[0]) if result else False
+            return result[0] if result else None
 
+    # Меняет статус заявки мастера одним UPDATE по первичному ключу. Возвращает client_id или None,
+    # если заявка не его, уже завершена или статус уже установлен
     @staticmethod
-    def get_admin_id() -> int:
+    def set_request_status(request_id: int, master_id: int, new_status: str):
         with Database() as cursor:
-            cursor.execute("SELECT telegram_id FROM users WHERE role = 'admin' LIMIT 1")
+            cursor.execute('''
+                UPDATE requests SET status = %s
+                WHERE id = %s AND master_id = %s AND status != 'completed' AND status != %s
+                RETURNING client_id
+            ''', (new_status, request_id, master_id, new_status))
             result = cursor.fetchone()
             return result[0] if result else None
 
+    # Самые старые ожидающие заявки (частичный индекс idx_requests_pending уже упорядочен по created_at)
+    @staticmethod
+    def get_pending_requests(limit: int) -> list:
+        with Database() as cursor:
+            cursor.execute('''SELECT r.id, u.full_name, r.address 
+                            FROM requests r 
+                            JOIN users u ON r.client_id = u.telegram_id 
+                            WHERE r.status = 'pending'
+                            ORDER BY r.created_at LIMIT %s''', (limit,))
+            return cursor.fetchall()
+
+    # Страница списка пользователей (keyset-пагинация по telegram_id): [(telegram_id, full_name, role)]
+    @staticmethod
+    def get_users_page(after_id: int, limit: int) -> list:
+        with Database() as cursor:
+            cursor.execute('''
+                SELECT u.telegram_id, u.full_name,
+                       CASE
+                           WHEN m.is_master THEN 'master'
+                           WHEN u.role = 'admin' THEN 'admin'
+                           ELSE 'client'
+                       END
+                FROM users u
+                -- LATERAL с LIMIT 1 даёт точечную проверку по индексу для каждой строки страницы,
+                -- чтобы планировщик не сканировал всю таблицу masters ради 50 строк
+                LEFT JOIN LATERAL (
+                    SELECT TRUE AS is_master FROM masters WHERE user_id = u.telegram_id LIMIT 1
+                ) m ON TRUE
+                WHERE u.telegram_id > %s
+                ORDER BY u.telegram_id
+                LIMIT %s
+            ''', (after_id, limit))
+            return cursor.fetchall()
+
+# Асинхронный доступ к БД для обработчиков: запросы выполняются вне цикла событий
+adb = AsyncDatabase(Database)
+
+# Профили пользователей (ФИО, регистрация, роль): у зарегистрированного пользователя, нажимающего
+# кнопки, в БД идёт один запрос за PROFILE_CACHE_TTL. Записи сбрасываются по уведомлениям
+# USER_CHANGED_CHANNEL (в т.ч. из админ-панели), после переподключения слушателя — все.
+profiles = ProfileCache(adb)
+
+async def get_role(user_id: int) -> str:
+    return (await profiles.get(user_id)).role
+
+profile_listener = NotificationListener({USER_CHANGED_CHANNEL: profiles.invalidate}, on_connect=profiles.clear)
+
 # Инициализация бота
 router = Router()
+# TELEGRAM_API_URL позволяет направить бота на локальный Bot API сервер или fake_telegram.py
+api_url = os.getenv("TELEGRAM_API_URL")
 bot = Bot(
     token=os.getenv("BOT_TOKEN"),
+    session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
-dp = Dispatcher(storage=MemoryStorage())
+# Все уведомления другим пользователям идут через очередь с учётом лимитов Telegram
+outbox = Outbox(bot)
+# Состояния диалогов хранятся в Postgres, чтобы их видели все процессы бота и они переживали перезапуск.
+# FSM_STORAGE=memory — прежнее хранилище в памяти (один процесс, для отладки)
+storage = MemoryStorage() if os.getenv("FSM_STORAGE") == "memory" else PostgresStorage()
+dp = Dispatcher(storage=storage)
 dp.include_router(router)
+# Время и ошибки каждого обработчика router (metrics.py)
+bot_metrics.install_middleware(router)
 
 # Определение состояний для FSM
 class Registration(StatesGroup):
@@ -87,13 +252,17 @@ class RequestMaster(StatesGroup):
 class MessageClient(StatesGroup):
     text = State()
 
+class Broadcast(StatesGroup):
+    text = State()
+
 # Декоратор для проверки ролей
 def role_required(*allowed_roles):
     def decorator(handler):
         @wraps(handler)
         async def wrapper(message: types.Message, *args, **kwargs):
             user_id = message.from_user.id
-            user_role = Database.get_user_role(user_id)
+            with metrics.timer('bot_role_check_seconds'):
+                user_role = await get_role(user_id)
             if user_role not in allowed_roles:
                 await message.answer(f"⚠️ Эта команда доступна только {' или '.join(allowed_roles)}ам!")
                 return
@@ -109,27 +278,62 @@ ROLE_MENUS = {
     ],
     'master': [
         ["📋 Мои заявки", "📍 Текущий адрес"],
-        ["✉️ Сообщить клиенту", "🔄 Изменить статус заявки"]
+        ["✉️ Сообщить клиенту", "🔄 Изменить статус заявки"],
+        ["📡 Передать местоположение"]
     ],
     'admin': [
         ["👥 Пользователи", "📊 Статистика"],
-        ["🔔 Новые заявки", "✅ Подтвердить мастера"]
+        ["🔔 Новые заявки", "✅ Подтвердить мастера"],
+        ["📢 Рассылка"]
     ]
 }
 
-async def show_main_menu(user_id: int):
-    role = Database.get_user_role(user_id)
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text=text) for text in row] for row in ROLE_MENUS[role]],
+# Кнопки, которые отправляют геопозицию пользователя
+LOCATION_BUTTONS = {"📡 Передать местоположение"}
+
+# Клавиатуры меню собираются один раз; объекты aiogram неизменяемы, их можно отправлять всем
+ROLE_KEYBOARDS = {
+    role: ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=text, request_location=text in LOCATION_BUTTONS) for text in row]
+                  for row in rows],
         resize_keyboard=True
     )
-    await bot.send_message(user_id, "Выберите действие:", reply_markup=keyboard)
+    for role, rows in ROLE_MENUS.items()
+}
+
+# Сколько активных заявок мастера показывается в списке выбора
+ACTIVE_REQUESTS_LIMIT = 20
+# Названия статусов заявок и подписи кнопок для их смены
+STATUS_NAMES = {'pending': '⏳ Ожидает', 'in_progress': '🚗 В процессе', 'completed': '✅ Завершена'}
+STATUS_ACTIONS = {'pending': "⏳ Ожидает", 'in_progress': "🚗 В процессе", 'completed': "✅ Завершить"}
+
+async def show_main_menu(user_id: int):
+    outbox.send(user_id, "Выберите действие:", reply_markup=ROLE_KEYBOARDS[await get_role(user_id)])
+
+# Кнопки меню и текстовые команды: текст → обработчик. Вместо цепочки фильтров F.text == "...",
+# которые aiogram проверяет по очереди для каждого сообщения, — один поиск в словаре (фильтр MenuRoute)
+MENU_ROUTES = {}
+
+def menu_route(text):
+    def decorator(handler):
+        MENU_ROUTES[text] = CallableObject(handler)
+        return handler
+    return decorator
+
+# Пропускает сообщения, текст которых есть в routes; выбранный обработчик передаётся как route
+class MenuRoute(Filter):
+    def __init__(self, routes: dict):
+        self.routes = routes
+
+    async def __call__(self, message: types.Message):
+        route = self.routes.get(message.text)
+        return {'route': route} if route is not None else False
 
 # Команда /start
 @router.message(F.text == "/start")
 async def cmd_start(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    if not Database.is_registered(user_id):
+    if not (await profiles.get(user_id)).registered:
         await state.set_state(Registration.full_name)
         await message.answer("👋 Добро пожаловать! Для регистрации укажите ваше ФИО:", reply_markup=ReplyKeyboardRemove())
     else:
@@ -158,18 +362,14 @@ async def process_phone(message: types.Message, state: FSMContext):
     data = await state.get_data()
     user_id = message.from_user.id
     try:
-        with Database() as cursor:
-            cursor.execute("SELECT COUNT(*) FROM users WHERE telegram_id = %s", (str(user_id),))
-            if cursor.fetchone()[0] > 0:
-                await message.answer("⚠️ Вы уже зарегистрированы!")
-                await state.clear()
-                await show_main_menu(user_id)
-                return
-            cursor.execute('''
-                INSERT INTO users 
-                (telegram_id, full_name, phone, role, registered) 
-                VALUES (%s, %s, %s, 'client', TRUE)
-            ''', (str(user_id), data['full_name'], phone))
+        registered = await adb.register_user(user_id, data['full_name'], phone)
+        # Не дожидаясь уведомления: меню ниже должно видеть нового пользователя
+        profiles.invalidate(user_id)
+        if not registered:
+            await message.answer("⚠️ Вы уже зарегистрированы!")
+            await state.clear()
+            await show_main_menu(user_id)
+            return
         await state.clear()
         await show_main_menu(user_id)
     except psycopg2.Error as e:
@@ -177,22 +377,26 @@ async def process_phone(message: types.Message, state: FSMContext):
         await message.answer("⚠️ Ошибка при регистрации. Попробуйте позже.")
         await state.clear()
 
+# Все кнопки меню и команды из MENU_ROUTES. Регистрируется после шагов регистрации (до неё меню недоступно),
+# но раньше остальных диалогов: нажатая кнопка меню выполняется, а не сохраняется как текст отчёта или адреса.
+# Обработчик получает только те аргументы, которые объявил (как при обычной регистрации в router)
+@router.message(MenuRoute(MENU_ROUTES))
+async def route_menu(message: types.Message, route: CallableObject, **data):
+    return await route.call(message, **data)
+
 # Команда /become_master
-@router.message(F.text == "/become_master")
+@menu_route("/become_master")
 @role_required('client')
 async def request_master_status(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     try:
-        with Database() as cursor:
-            cursor.execute("SELECT COUNT(*) FROM master_requests WHERE user_id = %s", (str(user_id),))
-            if cursor.fetchone()[0] > 0:
-                await message.answer("⚠️ Вы уже отправили запрос на статус мастера. Ожидайте подтверждения.")
-                return
-            cursor.execute("INSERT INTO master_requests (user_id) VALUES (%s)", (str(user_id),))
+        if not await adb.add_master_request(user_id):
+            await message.answer("⚠️ Вы уже отправили запрос на статус мастера. Ожидайте подтверждения.")
+            return
         
-        admin_id = Database.get_admin_id()
+        admin_id = await adb.get_admin_id()
         if admin_id:
-            await bot.send_message(
+            outbox.send(
                 admin_id,
                 f"Пользователь {message.from_user.full_name} (ID: {user_id}) запросил статус мастера."
             )
@@ -202,17 +406,11 @@ async def request_master_status(message: types.Message, state: FSMContext):
         await message.answer("⚠️ Ошибка при отправке запроса.")
 
 # Подтверждение мастера (админ)
-@router.message(F.text == "✅ Подтвердить мастера")
+@menu_route("✅ Подтвердить мастера")
 @role_required('admin')
 async def confirm_master_menu(message: types.Message):
     try:
-        with Database() as cursor:
-            cursor.execute('''
-                SELECT mr.user_id, u.full_name 
-                FROM master_requests mr 
-                JOIN users u ON mr.user_id = u.telegram_id
-            ''')
-            requests = cursor.fetchall()
+        requests = await adb.get_master_requests()
         
         if not requests:
             await message.answer("Нет запросов на статус мастера.")
@@ -227,46 +425,41 @@ async def confirm_master_menu(message: types.Message):
         logging.error(f"Database error: {e}")
         await message.answer("⚠️ Ошибка при получении запросов.")
 
-# Обработка подтверждения/отклонения мастера
-@router.message(lambda message: message.text and len(message.text.split()) == 2 and message.text.split()[0].isdigit())
+# Обработка подтверждения/отклонения мастера: "<ID> confirm" или "<ID> reject" вне диалогов
+ADMIN_DECISION = re.compile(r'^\s*(\d+)\s+(\S+)\s*$')
+
+@router.message(StateFilter(None), F.text.regexp(ADMIN_DECISION).as_('decision'))
 @role_required('admin')
-async def process_master_confirmation(message: types.Message):
+async def process_master_confirmation(message: types.Message, decision: re.Match):
     try:
-        user_id, action = message.text.split()
-        user_id = str(user_id)
+        user_id, action = int(decision[1]), decision[2]
         if action not in ['confirm', 'reject']:
             await message.answer("⚠️ Используйте 'confirm' или 'reject'.")
             return
         
-        with Database() as cursor:
-            cursor.execute("SELECT full_name FROM users WHERE telegram_id = %s", (user_id,))
-            user = cursor.fetchone()
-            if not user:
-                await message.answer("⚠️ Пользователь не найден.")
-                return
-            
-            cursor.execute("SELECT COUNT(*) FROM master_requests WHERE user_id = %s", (user_id,))
-            if cursor.fetchone()[0] == 0:
-                await message.answer("⚠️ Запрос от этого пользователя не найден.")
-                return
-            
-            if action == 'confirm':
-                cursor.execute("INSERT INTO masters (user_id, busyness) VALUES (%s, 0) ON CONFLICT (user_id) DO NOTHING", (user_id,))
-                await bot.send_message(user_id, "✅ Ваш запрос на статус мастера подтвержден!")
-                await message.answer(f"Пользователь {user[0]} теперь мастер.")
-            else:
-                await bot.send_message(user_id, "❌ Ваш запрос на статус мастера отклонен.")
-                await message.answer(f"Запрос пользователя {user[0]} отклонен.")
-            
-            cursor.execute("DELETE FROM master_requests WHERE user_id = %s", (user_id,))
+        full_name = (await profiles.get(user_id)).full_name
+        if full_name is None:
+            await message.answer("⚠️ Пользователь не найден.")
+            return
+        if not await adb.resolve_master_request(user_id, action == 'confirm'):
+            await message.answer("⚠️ Запрос от этого пользователя не найден.")
+            return
         
-        await show_main_menu(int(user_id))
-    except (ValueError, psycopg2.Error) as e:
-        logging.error(f"Error: {e}")
-        await message.answer("⚠️ Ошибка. Формат: 'ID confirm' или 'ID reject'.")
+        if action == 'confirm':
+            profiles.invalidate(user_id)
+            outbox.send(user_id, "✅ Ваш запрос на статус мастера подтвержден!")
+            await message.answer(f"Пользователь {full_name} теперь мастер.")
+        else:
+            outbox.send(user_id, "❌ Ваш запрос на статус мастера отклонен.")
+            await message.answer(f"Запрос пользователя {full_name} отклонен.")
+        
+        await show_main_menu(user_id)
+    except psycopg2.Error as e:
+        logging.error(f"Database error: {e}")
+        await message.answer("⚠️ Ошибка при обработке запроса.")
 
 # Отправка отчёта (клиент)
-@router.message(F.text == "📝 Отправить отчёт")
+@menu_route("📝 Отправить отчёт")
 @role_required('client')
 async def start_report(message: types.Message, state: FSMContext):
     await state.set_state(Report.text)
@@ -275,9 +468,7 @@ async def start_report(message: types.Message, state: FSMContext):
 @router.message(Report.text)
 async def save_report(message: types.Message, state: FSMContext):
     try:
-        with Database() as cursor:
-            cursor.execute("INSERT INTO reports (user_id, report_text) VALUES (%s, %s)", 
-                           (str(message.from_user.id), message.text))
+        await adb.add_report(message.from_user.id, message.text)
         await state.clear()
         await message.answer("✅ Отчёт успешно сохранён!")
         await show_main_menu(message.from_user.id)
@@ -287,17 +478,11 @@ async def save_report(message: types.Message, state: FSMContext):
         await state.clear()
 
 # Просмотр фидбека (клиент)
-@router.message(F.text == "📨 Посмотреть фидбек")
+@menu_route("📨 Посмотреть фидбек")
 @role_required('client')
 async def view_feedback(message: types.Message):
     try:
-        with Database() as cursor:
-            cursor.execute('''SELECT report_text, admin_feedback 
-                            FROM reports 
-                            WHERE user_id = %s 
-                            ORDER BY created_at DESC LIMIT 5''',
-                           (str(message.from_user.id),))
-            reports = cursor.fetchall()
+        reports = await adb.get_recent_reports(message.from_user.id)
         
         if not reports:
             await message.answer("ℹ️ У вас пока нет отчетов.")
@@ -312,8 +497,16 @@ async def view_feedback(message: types.Message):
         logging.error(f"Database error: {e}")
         await message.answer("⚠️ Ошибка при получении данных")
 
+# Уведомления о назначениях, сделанных AssignmentEngine
+async def notify_assignments(assignments):
+    for request_id, client_id, master_id, address in assignments:
+        outbox.send(master_id, f"🔧 Вам назначена заявка №{request_id}\nАдрес: {address}")
+        outbox.send(client_id, f"👨‍🔧 На вашу заявку №{request_id} назначен мастер")
+
+assigner = AssignmentEngine(on_assigned=notify_assignments)
+
 # Вызов мастера (клиент)
-@router.message(F.text == "🔧 Вызвать мастера")
+@menu_route("🔧 Вызвать мастера")
 @role_required('client')
 async def request_master(message: types.Message, state: FSMContext):
     await state.set_state(RequestMaster.address)
@@ -321,19 +514,21 @@ async def request_master(message: types.Message, state: FSMContext):
 
 @router.message(RequestMaster.address)
 async def save_request(message: types.Message, state: FSMContext):
+    # Фото, стикер или голосовое вместо адреса: остаёмся в диалоге и просим адрес ещё раз
+    address = (message.text or '').strip()
+    if not address:
+        await message.answer("⚠️ Отправьте адрес текстом:")
+        return
     try:
-        with Database() as cursor:
-            cursor.execute("SELECT COUNT(*) FROM requests WHERE client_id = %s AND status != 'completed'", 
-                           (str(message.from_user.id),))
-            if cursor.fetchone()[0] > 0:
-                await message.answer("⚠️ У вас уже есть активная заявка!")
-                await state.clear()
-                await show_main_menu(message.from_user.id)
-                return
-            cursor.execute("INSERT INTO requests (client_id, address) VALUES (%s, %s)",
-                           (str(message.from_user.id), message.text))
+        request_id = await adb.create_request(message.from_user.id, address, geocoder.locate(address))
+        if not request_id:
+            await message.answer("⚠️ У вас уже есть активная заявка!")
+            await state.clear()
+            await show_main_menu(message.from_user.id)
+            return
         await state.clear()
-        await message.answer("✅ Заявка создана! Администратор назначит мастера в ближайшее время.")
+        await message.answer(f"✅ Заявка №{request_id} создана! Мастер будет назначен в ближайшее время.")
+        assigner.wake()
         await show_main_menu(message.from_user.id)
     except psycopg2.Error as e:
         logging.error(f"Database error: {e}")
@@ -341,192 +536,263 @@ async def save_request(message: types.Message, state: FSMContext):
         await state.clear()
 
 # Просмотр заявок (мастер)
-@router.message(F.text == "📋 Мои заявки")
+@menu_route("📋 Мои заявки")
 @role_required('master')
 async def show_requests(message: types.Message):
     try:
-        with Database() as cursor:
-            cursor.execute('''
-                SELECT r.id, r.address, r.status, u.full_name 
-                FROM requests r 
-                JOIN users u ON r.client_id = u.telegram_id 
-                WHERE r.master_id = %s
-            ''', (str(message.from_user.id),))
-            requests = cursor.fetchall()
+        requests = await adb.get_master_jobs(message.from_user.id)
         
         if not requests:
             await message.answer("У вас нет активных заявок")
             return
         
         response = ["Ваши заявки:"]
-        status_map = {'pending': '⏳ Ожидает', 'in_progress': '🚗 В процессе', 'completed': '✅ Завершена'}
         for req in requests:
-            response.append(f"№{req[0]} | Адрес: {req[1]} | Статус: {status_map.get(req[2], '❓ Неизвестно')} | Клиент: {req[3]}")
+            response.append(f"№{req[0]} | Адрес: {req[1]} | Статус: {STATUS_NAMES.get(req[2], '❓ Неизвестно')} | Клиент: {req[3]}")
         await message.answer("\n".join(response))
     except psycopg2.Error as e:
         logging.error(f"Database error: {e}")
         await message.answer("⚠️ Ошибка при получении заявок")
 
-# Просмотр текущего адреса (мастер)
-@router.message(F.text == "📍 Текущий адрес")
+# Адреса заявок в работе (мастер)
+@menu_route("📍 Текущий адрес")
 @role_required('master')
 async def show_current_address(message: types.Message):
     try:
-        with Database() as cursor:
-            cursor.execute('''SELECT address FROM requests 
-                            WHERE master_id = %s AND status = 'in_progress' 
-                            ORDER BY created_at DESC LIMIT 1''',
-                            (str(message.from_user.id),))
-            address = cursor.fetchone()
+        requests = await adb.get_active_requests(message.from_user.id, ACTIVE_REQUESTS_LIMIT)
+        addresses = [f"№{request_id}: {address}" for request_id, _, address, status in requests if status == 'in_progress']
         
-        if address:
-            await message.answer(f"🏠 Текущий адрес: {address[0]}")
+        if addresses:
+            await message.answer("🏠 Текущий адрес:\n" + "\n".join(addresses))
         else:
             await message.answer("У вас нет активных заявок в работе")
     except psycopg2.Error as e:
         logging.error(f"Database error: {e}")
         await message.answer("⚠️ Ошибка при получении данных")
 
+# Местоположение мастера: по нему заявки назначаются ближайшему свободному мастеру
+@router.message(F.location)
+@role_required('master')
+async def save_master_location(message: types.Message):
+    try:
+        await adb.run(GeoDatabase.set_master_location, message.from_user.id,
+                      message.location.latitude, message.location.longitude)
+        await message.answer("✅ Местоположение сохранено. Новые заявки будут назначаться с учётом расстояния.")
+        assigner.wake()
+    except psycopg2.Error as e:
+        logging.error(f"Database error: {e}")
+        await message.answer("⚠️ Ошибка при сохранении местоположения")
+
+# Трансляция геопозиции: Telegram присылает новые координаты правкой исходного сообщения.
+# Не мастера просто не найдутся в masters, отвечать на каждое обновление не нужно
+@router.edited_message(F.location)
+async def update_master_location(message: types.Message):
+    try:
+        await adb.run(GeoDatabase.set_master_location, message.from_user.id,
+                      message.location.latitude, message.location.longitude)
+    except psycopg2.Error as e:
+        logging.error(f"Database error: {e}")
+
+# Выбор заявки мастером: у мастера может быть несколько заявок, номер выбранной приходит
+# в callback_data, поэтому дальше не нужен запрос "последней заявки". Клиента callback_data не содержит:
+# её присылает Telegram-клиент, поэтому клиент берётся из БД по заявке и мастеру
+class RequestPick(CallbackData, prefix="req"):
+    action: str  # 'status' или 'message'
+    id: int
+
+class RequestStatus(CallbackData, prefix="rst"):
+    id: int
+    status: str
+
+def request_picker(requests, action):
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
+            text=f"№{request_id} · {STATUS_NAMES[status]} · {address[:40]}",
+            callback_data=RequestPick(action=action, id=request_id).pack()
+        )]
+        for request_id, _, address, status in requests
+    ])
+
+def status_keyboard(request_id):
+    buttons = [
+        InlineKeyboardButton(text=text, callback_data=RequestStatus(id=request_id, status=status).pack())
+        for status, text in STATUS_ACTIONS.items()
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=[buttons[:2], buttons[2:]])
+
 # Изменение статуса заявки (мастер)
-@router.message(F.text == "🔄 Изменить статус заявки")
+@menu_route("🔄 Изменить статус заявки")
 @role_required('master')
 async def change_request_status(message: types.Message):
     try:
-        with Database() as cursor:
-            cursor.execute('''
-                SELECT id, status 
-                FROM requests 
-                WHERE master_id = %s AND status != 'completed' 
-                ORDER BY created_at DESC LIMIT 1
-            ''', (str(message.from_user.id),))
-            request = cursor.fetchone()
+        requests = await adb.get_active_requests(message.from_user.id, ACTIVE_REQUESTS_LIMIT)
         
-        if not request:
+        if not requests:
             await message.answer("⚠️ У вас нет активных заявок для изменения статуса.")
             return
         
-        request_id, current_status = request
-        keyboard = ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text="⏳ Ожидает"), KeyboardButton(text="🚗 В процессе")],
-                [KeyboardButton(text="✅ Завершить")]
-            ],
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
-        await message.answer(f"Текущий статус заявки №{request_id}: {current_status}. Выберите новый статус:", reply_markup=keyboard)
+        if len(requests) == 1:
+            request_id, _, _, current_status = requests[0]
+            await message.answer(f"Текущий статус заявки №{request_id}: {STATUS_NAMES[current_status]}. Выберите новый статус:",
+                                 reply_markup=status_keyboard(request_id))
+        else:
+            await message.answer("Выберите заявку:", reply_markup=request_picker(requests, 'status'))
     except psycopg2.Error as e:
         logging.error(f"Database error: {e}")
         await message.answer("⚠️ Ошибка при получении заявки")
 
+@router.callback_query(RequestPick.filter(F.action == 'status'))
+@role_required('master')
+async def pick_request_status(callback: types.CallbackQuery, callback_data: RequestPick):
+    await callback.message.edit_text(f"Заявка №{callback_data.id}. Выберите новый статус:",
+                                     reply_markup=status_keyboard(callback_data.id))
+    await callback.answer()
+
 # Обработка изменения статуса
-@router.message(F.text.in_(["⏳ Ожидает", "🚗 В процессе", "✅ Завершить"]))
+@router.callback_query(RequestStatus.filter())
 @role_required('master')
-async def process_status_change(message: types.Message):
-    status_map = {"⏳ Ожидает": "pending", "🚗 В процессе": "in_progress", "✅ Завершить": "completed"}
-    new_status = status_map[message.text]
+async def process_status_change(callback: types.CallbackQuery, callback_data: RequestStatus):
+    request_id = callback_data.id
+    # callback_data присылает Telegram-клиент, статус в ней может быть любым
+    status_text = STATUS_ACTIONS.get(callback_data.status)
+    if status_text is None:
+        await callback.answer("⚠️ Неизвестный статус заявки.", show_alert=True)
+        return
     
     try:
-        with Database() as cursor:
-            cursor.execute('''
-                SELECT id, client_id, status 
-                FROM requests 
-                WHERE master_id = %s AND status != 'completed' 
-                ORDER BY created_at DESC LIMIT 1
-            ''', (str(message.from_user.id),))
-            request = cursor.fetchone()
-            
-            if not request:
-                await message.answer("⚠️ Нет активных заявок для изменения статуса.")
-                return
-            
-            request_id, client_id, old_status = request
-            if old_status == new_status:
-                await message.answer("⚠️ Этот статус уже установлен.")
-                return
-            
-            cursor.execute("UPDATE requests SET status = %s WHERE id = %s", (new_status, request_id))
+        client_id = await adb.set_request_status(request_id, callback.from_user.id, callback_data.status)
         
-        await bot.send_message(client_id, f"ℹ️ Статус вашей заявки №{request_id} изменён на: {message.text}")
-        await message.answer(f"✅ Статус заявки №{request_id} изменён на: {message.text}", reply_markup=ReplyKeyboardRemove())
-        await show_main_menu(message.from_user.id)
+        if not client_id:
+            await callback.answer("⚠️ Этот статус уже установлен или заявка уже завершена.", show_alert=True)
+            return
+        
+        outbox.send(client_id, f"ℹ️ Статус вашей заявки №{request_id} изменён на: {status_text}")
+        # Мастер мог освободиться для ожидающих заявок
+        assigner.wake()
+        await callback.message.edit_text(f"✅ Статус заявки №{request_id} изменён на: {status_text}")
+        await callback.answer()
     except psycopg2.Error as e:
         logging.error(f"Database error: {e}")
-        await message.answer("⚠️ Ошибка при изменении статуса")
+        await callback.answer("⚠️ Ошибка при изменении статуса", show_alert=True)
 
 # Сообщение клиенту (мастер)
-@router.message(F.text == "✉️ Сообщить клиенту")
+@menu_route("✉️ Сообщить клиенту")
 @role_required('master')
 async def message_client_start(message: types.Message, state: FSMContext):
     try:
-        with Database() as cursor:
-            cursor.execute('''
-                SELECT client_id 
-                FROM requests 
-                WHERE master_id = %s AND status = 'in_progress' 
-                ORDER BY created_at DESC LIMIT 1
-            ''', (str(message.from_user.id),))
-            client = cursor.fetchone()
+        requests = await adb.get_active_requests(message.from_user.id, ACTIVE_REQUESTS_LIMIT)
         
-        if not client:
+        if not requests:
             await message.answer("⚠️ У вас нет активных заявок для связи с клиентом.")
             return
         
-        await state.update_data(client_id=client[0])
-        await state.set_state(MessageClient.text)
-        await message.answer("Введите сообщение для клиента:")
+        if len(requests) == 1:
+            request_id, client_id, _, _ = requests[0]
+            await start_client_message(message, state, request_id, client_id)
+        else:
+            await message.answer("Кому написать? Выберите заявку:", reply_markup=request_picker(requests, 'message'))
     except psycopg2.Error as e:
         logging.error(f"Database error: {e}")
         await message.answer("⚠️ Ошибка при получении данных клиента")
 
+@router.callback_query(RequestPick.filter(F.action == 'message'))
+@role_required('master')
+async def pick_request_message(callback: types.CallbackQuery, callback_data: RequestPick, state: FSMContext):
+    try:
+        client_id = await adb.get_request_client(callback_data.id, callback.from_user.id)
+    except psycopg2.Error as e:
+        logging.error(f"Database error: {e}")
+        await callback.answer("⚠️ Ошибка при получении данных клиента", show_alert=True)
+        return
+    if not client_id:
+        await callback.answer("⚠️ Заявка уже завершена или назначена другому мастеру.", show_alert=True)
+        return
+    await callback.answer()
+    await start_client_message(callback.message, state, callback_data.id, client_id)
+
+async def start_client_message(message: types.Message, state: FSMContext, request_id: int, client_id: int):
+    await state.update_data(client_id=client_id, request_id=request_id)
+    await state.set_state(MessageClient.text)
+    await message.answer(f"Введите сообщение для клиента по заявке №{request_id}:")
+
 @router.message(MessageClient.text)
 async def send_message_to_client(message: types.Message, state: FSMContext):
     data = await state.get_data()
     client_id = data['client_id']
-    try:
-        await bot.send_message(client_id, f"Сообщение от мастера: {message.text}")
-        await message.answer("✅ Сообщение отправлено клиенту!")
-        await state.clear()
-        await show_main_menu(message.from_user.id)
-    except Exception as e:
-        logging.error(f"Error sending message: {e}")
-        await message.answer("⚠️ Ошибка при отправке сообщения")
-        await state.clear()
+    master_id = message.from_user.id
+    # В состояниях, сохранённых до выбора заявки из списка, номера заявки нет
+    request_id = data.get('request_id')
+    prefix = f"Сообщение от мастера по заявке №{request_id}" if request_id else "Сообщение от мастера"
+    delivery = outbox.send(client_id, f"{prefix}: {message.text}")
+    # Доставка идёт в фоне: если Telegram её отклонит, сообщаем мастеру отдельным сообщением
+    def report_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            outbox.send(master_id, "⚠️ Не удалось доставить сообщение клиенту")
+    delivery.add_done_callback(report_failure)
+    await message.answer("✅ Сообщение отправлено клиенту!")
+    await state.clear()
+    await show_main_menu(master_id)
 
 # Статистика (админ)
-@router.message(F.text == "📊 Статистика")
+@menu_route("📊 Статистика")
 @role_required('admin')
 async def show_stats(message: types.Message):
     try:
-        with Database() as cursor:
-            cursor.execute("SELECT COUNT(*) FROM users")
-            total_users = cursor.fetchone()[0]
-            cursor.execute("SELECT COUNT(*) FROM requests WHERE status = 'pending'")
-            pending = cursor.fetchone()[0]
-            cursor.execute("SELECT AVG(busyness) FROM masters")
-            avg_load = cursor.fetchone()[0] or 0
-        
-        await message.answer(f"""
-📈 Статистика:
-👥 Всего пользователей: {total_users}
-⏳ Ожидающих заявок: {pending}
-📦 Средняя загрузка мастеров: {avg_load:.1f}
-""")
+        stats = await adb.run(StatsDatabase.get_stats)
+        await message.answer(format_stats(stats))
     except psycopg2.Error as e:
         logging.error(f"Database error: {e}")
         await message.answer("⚠️ Ошибка при получении статистики")
 
-# Новые заявки (админ)
-@router.message(F.text == "🔔 Новые заявки")
+# Состояние пула соединений с БД (админ)
+@menu_route("/pool_stats")
+@role_required('admin')
+async def show_pool_stats(message: types.Message):
+    stats = pool_stats()
+    if not stats:
+        await message.answer("Пул соединений ещё не создан")
+        return
+    await message.answer(f"""
+🗄 Пул соединений:
+Соединений: {stats['size']} (свободно {stats['idle']}, занято {stats['in_use']}, максимум {stats['max']})
+Выдано: {stats['acquired']} | Новых подключений: {stats['connects']}
+Ожиданий: {stats['waits']} | Среднее ожидание: {stats['avg_wait'] * 1000:.1f} мс | Таймаутов: {stats['timeouts']}
+""")
+
+# Состояние очереди исходящих сообщений (админ)
+@menu_route("/outbox_stats")
+@role_required('admin')
+async def show_outbox_stats(message: types.Message):
+    stats = outbox.stats()
+    await message.answer(f"""
+📤 Очередь сообщений:
+В очереди: {stats['queue_depth']} | Отправляется: {stats['in_flight']}
+Отправлено: {stats['sent']} | Ошибок: {stats['failed']} | Повторов: {stats['retried']} (из них 429: {stats['rate_limited']})
+Задержка доставки: p50 {stats['delivery_p50'] * 1000:.0f} мс, p99 {stats['delivery_p99'] * 1000:.0f} мс
+Время запроса к Telegram: p50 {stats['send_p50'] * 1000:.0f} мс, p99 {stats['send_p99'] * 1000:.0f} мс
+""")
+
+# Самые медленные обработчики и запросы к БД с момента запуска процесса (админ)
+@menu_route("/metrics")
+@role_required('admin')
+async def show_metrics(message: types.Message):
+    handlers = bot_metrics.format_summary('bot_handler_seconds', 'handler', limit=10)
+    queries = bot_metrics.format_summary('db_query_seconds', 'query', limit=5)
+    if not handlers and not queries:
+        await message.answer("Метрик пока нет")
+        return
+    # Текст запросов может содержать < и >, а сообщения отправляются с ParseMode.HTML
+    text = "⏱ Обработчики:\n" + "\n".join(handlers) + "\n\n🗄 Запросы к БД:\n" + "\n".join(queries)
+    await message.answer(html.escape(text))
+
+# Новые заявки (админ); больше не помещается в одно сообщение Telegram
+PENDING_LIST_LIMIT = 30
+
+@menu_route("🔔 Новые заявки")
 @role_required('admin')
 async def show_pending_requests(message: types.Message):
     try:
-        with Database() as cursor:
-            cursor.execute('''SELECT r.id, u.full_name, r.address 
-                            FROM requests r 
-                            JOIN users u ON r.client_id = u.telegram_id 
-                            WHERE r.status = 'pending' ''')
-            requests = cursor.fetchall()
+        requests = await adb.get_pending_requests(PENDING_LIST_LIMIT)
         
         if not requests:
             await message.answer("Нет новых заявок")
@@ -535,32 +801,160 @@ async def show_pending_requests(message: types.Message):
         response = ["Новые заявки:"]
         for req in requests:
             response.append(f"№{req[0]} | Клиент: {req[1]} | Адрес: {req[2]}")
+        if len(requests) == PENDING_LIST_LIMIT:
+            response.append(f"Показаны {PENDING_LIST_LIMIT} самых старых заявок")
         await message.answer("\n".join(response))
     except psycopg2.Error as e:
         logging.error(f"Database error: {e}")
         await message.answer("⚠️ Ошибка при получении заявок")
 
-# Список пользователей (админ)
-@router.message(F.text == "👥 Пользователи")
+# Список пользователей (админ), постранично
+USERS_PAGE_SIZE = 50
+MESSAGE_LIMIT = 4096
+
+class UsersPage(CallbackData, prefix="users"):
+    after: int
+
+# Собирает текст страницы, не превышая лимит Telegram; возвращает (текст, клавиатура)
+async def build_users_page(after_id: int):
+    users = await adb.get_users_page(after_id, USERS_PAGE_SIZE + 1)
+    has_more = len(users) > USERS_PAGE_SIZE
+    role_names = {'master': '👨‍🔧 Мастер', 'admin': '👑 Админ', 'client': '👤 Клиент'}
+    response = ["Список пользователей:"]
+    length = len(response[0])
+    last_id = after_id
+    for telegram_id, full_name, role in users[:USERS_PAGE_SIZE]:
+        line = f"ID: {telegram_id} | {full_name} | {role_names[role]}"
+        if length + len(line) + 1 > MESSAGE_LIMIT:
+            has_more = True
+            break
+        response.append(line)
+        length += len(line) + 1
+        last_id = telegram_id
+
+    if len(response) == 1:
+        response.append("Пользователей нет")
+    buttons = []
+    if after_id > 0:
+        buttons.append(InlineKeyboardButton(text="⏮ В начало", callback_data=UsersPage(after=0).pack()))
+    if has_more:
+        buttons.append(InlineKeyboardButton(text="Далее ▶", callback_data=UsersPage(after=last_id).pack()))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return "\n".join(response), keyboard
+
+@menu_route("👥 Пользователи")
 @role_required('admin')
 async def show_users(message: types.Message):
     try:
-        with Database() as cursor:
-            cursor.execute('''SELECT telegram_id, full_name FROM users''')
-            users = cursor.fetchall()
-            cursor.execute('''SELECT user_id FROM masters''')
-            masters = set(row[0] for row in cursor.fetchall())
-
-        response = ["Список пользователей:"]
-        for user in users:
-            role = '👨‍🔧 Мастер' if user[0] in masters else ('👑 Админ' if Database.get_user_role(int(user[0])) == 'admin' else '👤 Клиент')
-            response.append(f"ID: {user[0]} | {user[1]} | {role}")
-        await message.answer("\n".join(response))
+        text, keyboard = await build_users_page(0)
+        await message.answer(text, reply_markup=keyboard)
     except psycopg2.Error as e:
         logging.error(f"Database error: {e}")
         await message.answer("⚠️ Ошибка при получении списка пользователей")
 
-# Запуск бота
+@router.callback_query(UsersPage.filter())
+@role_required('admin')
+async def show_users_page(callback: types.CallbackQuery, callback_data: UsersPage):
+    try:
+        text, keyboard = await build_users_page(callback_data.after)
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer()
+    except psycopg2.Error as e:
+        logging.error(f"Database error: {e}")
+        await callback.answer("⚠️ Ошибка при получении списка пользователей", show_alert=True)
+
+# Рассылка всем пользователям (админ)
+# broadcast_messages: номер рассылки → (chat_id, message_id) сообщения с прогрессом
+broadcast_messages = {}
+
+def format_broadcast_progress(state):
+    return (f"📢 Рассылка №{state.id}: обработано {state.processed} из {state.total} "
+            f"(ошибок: {state.failed}), {state.rate:.1f} сообщ./с")
+
+async def report_broadcast_progress(state):
+    target = broadcast_messages.get(state.id)
+    if not target:
+        return
+    try:
+        await bot.edit_message_text(format_broadcast_progress(state), chat_id=target[0], message_id=target[1])
+    except TelegramAPIError as e:
+        logging.error(f"Broadcast progress update error: {e}")
+
+async def report_broadcast_done(state):
+    broadcast_messages.pop(state.id, None)
+    if state.author_id:
+        outbox.send(state.author_id, f"✅ Рассылка №{state.id} завершена: доставлено {state.sent}, "
+                                     f"ошибок {state.failed}, {state.rate:.1f} сообщ./с")
+
+broadcaster = Broadcaster(outbox, on_progress=report_broadcast_progress, on_done=report_broadcast_done)
+
+@menu_route("📢 Рассылка")
+@role_required('admin')
+async def broadcast_start(message: types.Message, state: FSMContext):
+    await state.set_state(Broadcast.text)
+    await message.answer("Введите текст рассылки для всех пользователей:", reply_markup=ReplyKeyboardRemove())
+
+@router.message(Broadcast.text)
+@role_required('admin')
+async def broadcast_send(message: types.Message, state: FSMContext):
+    await state.clear()
+    try:
+        broadcast = await broadcaster.start(message.html_text, message.from_user.id)
+        status = await message.answer(format_broadcast_progress(broadcast))
+        broadcast_messages[broadcast.id] = (status.chat.id, status.message_id)
+    except psycopg2.Error as e:
+        logging.error(f"Database error: {e}")
+        await message.answer("⚠️ Ошибка при запуске рассылки")
+    await show_main_menu(message.from_user.id)
+
+async def on_startup():
+    # Схема обновляется до запуска слушателей NOTIFY и фоновых задач, которые к ней обращаются
+    if MIGRATE_ON_STARTUP:
+        await adb.run(migrate)
+    dp['profile_listener_task'] = asyncio.create_task(profile_listener.run())
+    dp['outbox_task'] = asyncio.create_task(outbox.run())
+    dp['broadcast_watch_task'] = asyncio.create_task(broadcaster.watch())
+    if AUTO_ASSIGN:
+        dp['assign_task'] = asyncio.create_task(assigner.run())
+    if isinstance(storage, PostgresStorage):
+        dp['storage_task'] = asyncio.create_task(storage.run())
+    # Порт метрик у каждого процесса webhook свой (webhook.py), кроме того они есть на порту webhook
+    if bot_metrics.METRICS_PORT:
+        dp['metrics_runner'] = await bot_metrics.start_server(bot_metrics.METRICS_PORT)
+    if METRICS_LOG_INTERVAL:
+        dp['metrics_log_task'] = asyncio.create_task(bot_metrics.log_loop(METRICS_LOG_INTERVAL))
+
+async def on_shutdown():
+    if bot_metrics.METRICS_PORT:
+        await dp['metrics_runner'].cleanup()
+    if METRICS_LOG_INTERVAL:
+        dp['metrics_log_task'].cancel()
+    dp['profile_listener_task'].cancel()
+    dp['broadcast_watch_task'].cancel()
+    if AUTO_ASSIGN:
+        dp['assign_task'].cancel()
+    # Незавершённые рассылки сохраняют контрольную точку и будут продолжены после перезапуска
+    await broadcaster.stop()
+    if isinstance(storage, PostgresStorage):
+        dp['storage_task'].cancel()
+    await storage.close()
+    # Даём очереди доотправить уведомления, но не ждём бесконечно
+    try:
+        await asyncio.wait_for(outbox.join(), 10)
+    except asyncio.TimeoutError:
+        logging.error(f"Outbox not drained on shutdown: {outbox.stats()['queue_depth']} messages dropped")
+    dp['outbox_task'].cancel()
+
+# Текущие значения в выдаче /metrics
+metrics.add_collector('db_pool', pool_stats)
+metrics.add_collector('outbox', outbox.stats)
+metrics.add_collector('profile_cache', profiles.stats)
+metrics.add_collector('assignment', lambda: assigner.metrics)
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+# Запуск бота (long polling; режим webhook с несколькими процессами — python webhook.py)
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     dp.run_polling(bot)
\ No newline at end of file
@@ -0,0 +1,250 @@
+import os
+import re
+import time
+import bisect
+import asyncio
+import logging
+import threading
+from functools import lru_cache
+import psycopg2.extensions
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+# Метрики процесса: гистограммы задержек обработчиков бота и запросов к БД, счётчики строк и ошибок.
+# Отдаются в текстовом формате Prometheus: GET METRICS_PATH на порту METRICS_PORT (в режиме webhook —
+# на порту webhook, каждый процесс отдаёт свои метрики), раз в METRICS_LOG_INTERVAL секунд
+# p50/p99 пишутся в лог, администратору — по команде /metrics. METRICS_ENABLED=0 — ничего не собирать.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+METRICS_LOG_INTERVAL = float(os.getenv('METRICS_LOG_INTERVAL', '0'))
+
+# Верхние границы интервалов гистограммы, с
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Длина текста запроса в метке query
+QUERY_LABEL_LENGTH = 120
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Оценка квантиля по интервалам, как histogram_quantile в Prometheus: линейно внутри интервала
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if i == len(BUCKETS):
+                    return BUCKETS[-1]
+                lower = BUCKETS[i - 1] if i else 0.0
+                return lower + (BUCKETS[i] - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+# Реестр метрик. Наблюдения приходят и из цикла событий, и из потоков AsyncDatabase, поэтому под блокировкой
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {(имя, ((метка, значение), ...)): Histogram}
+        self.histograms = {}
+        self.counters = {}
+        # {префикс: функция, возвращающая {имя: число}} — текущие значения (пул соединений, очередь Outbox)
+        self.collectors = {}
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_collector(self, prefix, func):
+        self.collectors[prefix] = func
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    # [(имя, метки, число наблюдений, p50, p99, сумма)] по убыванию суммарного времени
+    def summary(self, name=None):
+        with self.lock:
+            rows = [(key[0], dict(key[1]), h.count, h.quantile(0.5), h.quantile(0.99), h.sum)
+                    for key, h in self.histograms.items() if name is None or key[0] == name]
+        return sorted(rows, key=lambda row: row[5], reverse=True)
+
+    # Текстовый формат Prometheus
+    def expose(self):
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            histograms = [(key, list(h.counts), h.sum, h.count) for key, h in histograms]
+        declared = set()
+        for (name, labels), counts, total, count in histograms:
+            if name not in declared:
+                lines.append(f"# TYPE {name} histogram")
+                declared.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        for (name, labels), value in counters:
+            if name not in declared:
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for prefix, func in self.collectors.items():
+            try:
+                values = func() or {}
+            except Exception as e:
+                logging.error(f"Metrics collector {prefix} error: {e}")
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def timer(name, **labels):
+        return Timer(name, labels)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"'
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+metrics = Metrics()
+
+
+class Timer:
+    __slots__ = ('name', 'labels', 'started')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if METRICS_ENABLED:
+            metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+
+
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+VALUES_LIST = re.compile(r"\(\?(?:, ?\?)*\)(?:, ?\(\?(?:, ?\?)*\))+")
+
+
+# Текст запроса без значений: запросы из кода статичны (параметры передаются отдельно), а execute_values
+# подставляет строки в текст — их литералы заменяются на ?, чтобы не плодить метки
+@lru_cache(maxsize=1024)
+def query_label(query):
+    text = ' '.join(query.split())
+    text = VALUES_LIST.sub('(...)', LITERAL.sub('?', text))
+    return text[:QUERY_LABEL_LENGTH]
+
+
+# Курсор, который замеряет каждый запрос: db_query_seconds и db_rows_total с меткой query
+class MetricsCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - started
+            if isinstance(query, bytes):
+                query = query.decode('utf-8', 'replace')
+            elif not isinstance(query, str):
+                query = query.as_string(self)
+            label = query_label(query)
+            metrics.observe('db_query_seconds', elapsed, query=label)
+            if self.rowcount > 0:
+                metrics.inc('db_rows_total', self.rowcount, query=label)
+
+
+# Время каждого обработчика router (bot_handler_seconds) и число исключений (bot_handler_errors_total).
+# Регистрируется как внутренний middleware: к этому моменту фильтры выбрали обработчик, его имя — метка handler.
+# Для кнопок меню это обработчик из таблицы (route, фильтр MenuRoute в main.py), а не общий route_menu
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('route') or data.get('handler')
+        name = handler_object.callback.__name__ if handler_object is not None else type(event).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.inc('bot_handler_errors_total', handler=name)
+            raise
+        finally:
+            metrics.observe('bot_handler_seconds', time.perf_counter() - started, handler=name)
+
+
+def install_middleware(router):
+    if METRICS_ENABLED:
+        middleware = HandlerMetricsMiddleware()
+        for observer in (router.message, router.edited_message, router.callback_query):
+            observer.middleware(middleware)
+
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.expose(), content_type='text/plain', charset='utf-8')
+
+
+def add_routes(app, path=METRICS_PATH):
+    app.router.add_get(path, handle_metrics)
+
+
+# Отдельный HTTP-сервер метрик для режима long polling; возвращает AppRunner (остановка — runner.cleanup())
+async def start_server(port=METRICS_PORT, host='0.0.0.0', path=METRICS_PATH):
+    app = web.Application()
+    add_routes(app, path)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+# Строки "имя p50/p99" для лога и команды /metrics
+def format_summary(name, label, limit=10):
+    lines = []
+    for _, labels, count, p50, p99, total in metrics.summary(name)[:limit]:
+        lines.append(f"{labels.get(label, '-')}: n={count} p50={p50 * 1000:.1f} мс p99={p99 * 1000:.1f} мс "
+                     f"всего {total:.2f} с")
+    return lines
+
+
+async def log_loop(interval=METRICS_LOG_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        for name, label in (('bot_handler_seconds', 'handler'), ('db_query_seconds', 'query')):
+            for line in format_summary(name, label):
+                logging.info(f"{name} {line}")
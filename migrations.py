@@ -0,0 +1,102 @@
+import os
+import re
+import sys
+import logging
+import argparse
+import psycopg2
+from database import Database
+
+# Версионированные миграции схемы: файлы migrations/NNNN_описание.sql применяются по возрастанию номера,
+# номера применённых записываются в schema_migrations. Бот и админ-панель вызывают migrate() при запуске
+# (MIGRATE_ON_STARTUP=0 — не вызывать); вручную: python migrations.py [--status]
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATE_ON_STARTUP = os.getenv('MIGRATE_ON_STARTUP', '1') != '0'
+# Ключ pg_advisory_xact_lock: процессы, запущенные одновременно (webhook.py --workers), применяют миграции по очереди
+MIGRATIONS_LOCK_ID = 727140001
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.sql$')
+
+
+class MigrationError(Exception):
+    pass
+
+
+# [(версия, имя, текст SQL)] по возрастанию версии
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = MIGRATION_FILE.match(filename)
+        if not match:
+            continue
+        with open(os.path.join(directory, filename), encoding='utf-8') as f:
+            migrations.append((int(match.group(1)), match.group(2), f.read()))
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise MigrationError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+class MigrationDatabase(Database):
+    @staticmethod
+    def applied_migrations(cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+
+    # Применяет все неприменённые миграции одной транзакцией: при ошибке схема остаётся прежней.
+    # Возвращает список применённых ["NNNN_имя"]
+    @staticmethod
+    def migrate(directory=MIGRATIONS_DIR):
+        migrations = load_migrations(directory)
+        applied = []
+        with MigrationDatabase() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_ID,))
+            done = MigrationDatabase.applied_migrations(cursor)
+            for version, name, statements in migrations:
+                if version in done:
+                    continue
+                logging.info(f"Applying migration {version:04d}_{name}")
+                try:
+                    cursor.execute(statements)
+                except psycopg2.Error as e:
+                    raise MigrationError(f"Migration {version:04d}_{name} failed: {e}") from e
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                applied.append(f"{version:04d}_{name}")
+        return applied
+
+    # [(версия, имя, применена ли)]
+    @staticmethod
+    def status(directory=MIGRATIONS_DIR):
+        with MigrationDatabase() as cursor:
+            done = MigrationDatabase.applied_migrations(cursor)
+        return [(version, name, version in done) for version, name, _ in load_migrations(directory)]
+
+
+def migrate():
+    return MigrationDatabase.migrate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных")
+    parser.add_argument("--status", action="store_true", help="показать применённые и ожидающие миграции")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        if args.status:
+            for version, name, done in MigrationDatabase.status():
+                print(f"{version:04d}_{name}: {'применена' if done else 'ожидает'}")
+        else:
+            applied = migrate()
+            print(f"Применено миграций: {len(applied)}")
+    except (MigrationError, psycopg2.Error) as e:
+        logging.error(f"Migration error: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+-- Исходная схема. Telegram ID не помещаются в INTEGER, поэтому все идентификаторы пользователей — BIGINT.
+CREATE TABLE IF NOT EXISTS users (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    telegram_id BIGINT UNIQUE NOT NULL,
+    full_name TEXT NOT NULL,
+    phone TEXT,
+    role TEXT CHECK(role IN ('client', 'admin')) DEFAULT 'client',
+    registered BOOLEAN DEFAULT FALSE
+);
+
+CREATE TABLE IF NOT EXISTS reports (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(telegram_id),
+    report_text TEXT NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    admin_feedback TEXT
+);
+
+CREATE TABLE IF NOT EXISTS requests (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    client_id BIGINT NOT NULL REFERENCES users(telegram_id),
+    master_id BIGINT REFERENCES users(telegram_id),
+    address TEXT NOT NULL,
+    status TEXT CHECK(status IN ('pending', 'in_progress', 'completed')) DEFAULT 'pending',
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS masters (
+    user_id BIGINT PRIMARY KEY REFERENCES users(telegram_id),
+    busyness INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS master_requests (
+    user_id BIGINT PRIMARY KEY REFERENCES users(telegram_id),
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_requests_client_id ON requests(client_id);
+CREATE INDEX IF NOT EXISTS idx_requests_master_id ON requests(master_id);
+
+-- Индексы под горячие запросы бота (проверка: python benchmark.py explain).
+-- Незавершённые заявки мастера, новые сверху: текущий адрес, смена статуса, сообщение клиенту
+CREATE INDEX IF NOT EXISTS idx_requests_master_active ON requests(master_id, created_at DESC) WHERE status != 'completed';
+-- Ожидающие заявки: список для админа (по created_at) и счётчик в статистике (index-only scan)
+CREATE INDEX IF NOT EXISTS idx_requests_pending ON requests(created_at) WHERE status = 'pending';
+-- Последние отчёты клиента; заменяет idx_reports_user_id
+CREATE INDEX IF NOT EXISTS idx_reports_user_created ON reports(user_id, created_at DESC);
+-- Поиск администратора для уведомлений
+CREATE INDEX IF NOT EXISTS idx_users_admins ON users(telegram_id) WHERE role = 'admin';
+-- Не больше одной незавершённой заявки на клиента (на этом индексе держится INSERT ... ON CONFLICT в create_request).
+-- Если миграция падает на существующей базе, сначала завершите дубликаты:
+-- SELECT client_id FROM requests WHERE status != 'completed' GROUP BY client_id HAVING COUNT(*) > 1;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_requests_active_client ON requests(client_id) WHERE status != 'completed';
+
+-- Уведомления об изменениях строк для админ-панели (LISTEN table_changes).
+-- Полезная нагрузка: {"table": ..., "op": INSERT|UPDATE|DELETE, "key": значение столбца TG_ARGV[0]}
+CREATE OR REPLACE FUNCTION notify_table_change() RETURNS trigger AS $$
+DECLARE
+    row_data JSONB;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_data := to_jsonb(OLD);
+    ELSE
+        row_data := to_jsonb(NEW);
+    END IF;
+    PERFORM pg_notify('table_changes', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'key', row_data ->> TG_ARGV[0]
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_notify_change ON users;
+CREATE TRIGGER users_notify_change AFTER INSERT OR UPDATE OR DELETE ON users
+FOR EACH ROW EXECUTE FUNCTION notify_table_change('telegram_id');
+
+DROP TRIGGER IF EXISTS reports_notify_change ON reports;
+CREATE TRIGGER reports_notify_change AFTER INSERT OR UPDATE OR DELETE ON reports
+FOR EACH ROW EXECUTE FUNCTION notify_table_change('id');
+
+DROP TRIGGER IF EXISTS requests_notify_change ON requests;
+CREATE TRIGGER requests_notify_change AFTER INSERT OR UPDATE OR DELETE ON requests
+FOR EACH ROW EXECUTE FUNCTION notify_table_change('id');
+
+DROP TRIGGER IF EXISTS masters_notify_change ON masters;
+CREATE TRIGGER masters_notify_change AFTER INSERT OR UPDATE OR DELETE ON masters
+FOR EACH ROW EXECUTE FUNCTION notify_table_change('user_id');
+
+DROP TRIGGER IF EXISTS master_requests_notify_change ON master_requests;
+CREATE TRIGGER master_requests_notify_change AFTER INSERT OR UPDATE OR DELETE ON master_requests
+FOR EACH ROW EXECUTE FUNCTION notify_table_change('user_id');
+
+-- Массовые рассылки администратора. last_user_id — контрольная точка: всем зарегистрированным
+-- пользователям с telegram_id <= last_user_id сообщение уже отправлено.
+-- heartbeat_at обновляет процесс, который ведёт рассылку; NULL или давнее значение — рассылка брошена.
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    author_id BIGINT,
+    text TEXT NOT NULL,
+    status TEXT CHECK(status IN ('running', 'completed')) DEFAULT 'running',
+    total INTEGER DEFAULT 0,
+    last_user_id BIGINT DEFAULT 0,
+    sent INTEGER DEFAULT 0,
+    failed INTEGER DEFAULT 0,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    heartbeat_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_broadcasts_running ON broadcasts(heartbeat_at) WHERE status = 'running';
+
+-- Состояния FSM бота (storage.PostgresStorage), общие для всех процессов.
+-- key строится aiogram DefaultKeyBuilder: fsm:<bot_id>:<chat_id>:<user_id>:<destiny>
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at);
+
+-- update_id обновлений, принятых через webhook: отсекает повторную доставку одного обновления
+-- в другой процесс бота. Строки старше суток удаляются (дольше Telegram не повторяет).
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id BIGINT PRIMARY KEY,
+    received_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_processed_updates_received_at ON processed_updates(received_at);
@@ -0,0 +1,71 @@
+-- Базы, созданные до появления миграций (вручную по прежнему schema.sql): их таблицы 0001 не пересоздаёт,
+-- поэтому столбцы приводятся к типам из 0001 здесь. На новой базе типы уже совпадают, и ALTER ничего не меняет.
+-- Значения TIMESTAMP без зоны считаются временем в зоне сервера (параметр TimeZone).
+ALTER TABLE users ALTER COLUMN id TYPE BIGINT, ALTER COLUMN telegram_id TYPE BIGINT;
+ALTER TABLE reports ALTER COLUMN id TYPE BIGINT, ALTER COLUMN user_id TYPE BIGINT,
+    ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+ALTER TABLE requests ALTER COLUMN id TYPE BIGINT, ALTER COLUMN client_id TYPE BIGINT,
+    ALTER COLUMN master_id TYPE BIGINT, ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+ALTER TABLE masters ALTER COLUMN user_id TYPE BIGINT;
+ALTER TABLE master_requests ALTER COLUMN user_id TYPE BIGINT, ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+ALTER TABLE broadcasts ALTER COLUMN id TYPE BIGINT, ALTER COLUMN created_at TYPE TIMESTAMPTZ,
+    ALTER COLUMN heartbeat_at TYPE TIMESTAMPTZ, ALTER COLUMN finished_at TYPE TIMESTAMPTZ;
+ALTER TABLE fsm_states ALTER COLUMN updated_at TYPE TIMESTAMPTZ;
+ALTER TABLE processed_updates ALTER COLUMN received_at TYPE TIMESTAMPTZ;
+
+-- id без значения по умолчанию (INTEGER PRIMARY KEY) получают identity, SERIAL — 64-битную последовательность
+DO $$
+DECLARE
+    tbl TEXT;
+    seq TEXT;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['users', 'reports', 'requests', 'broadcasts'] LOOP
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns c
+            WHERE c.table_schema = current_schema() AND c.table_name = tbl AND c.column_name = 'id'
+              AND c.column_default IS NULL AND c.is_identity = 'NO'
+        ) THEN
+            EXECUTE format('ALTER TABLE %I ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY', tbl);
+        END IF;
+        seq := pg_get_serial_sequence(tbl, 'id');
+        EXECUTE format('ALTER SEQUENCE %s AS BIGINT', seq);
+        EXECUTE format('SELECT setval(%L, COALESCE((SELECT MAX(id) FROM %I), 0) + 1, false)', seq, tbl);
+    END LOOP;
+END;
+$$;
+
+-- Индексы, которые дублируют другие: telegram_id проиндексирован ограничением UNIQUE,
+-- user_id в reports — индексом idx_reports_user_created
+DROP INDEX IF EXISTS idx_users_telegram_id;
+DROP INDEX IF EXISTS idx_reports_user_id;
+
+-- Занятость мастера — число его заявок в статусе in_progress. Прежние триггеры были написаны для SQLite
+-- и в Postgres не создавались, поэтому после их создания занятость пересчитывается.
+CREATE OR REPLACE FUNCTION update_master_busyness() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF OLD.status = 'in_progress' AND OLD.master_id IS NOT NULL THEN
+            UPDATE masters SET busyness = busyness - 1 WHERE user_id = OLD.master_id;
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF NEW.status = 'in_progress' AND NEW.master_id IS NOT NULL THEN
+            UPDATE masters SET busyness = busyness + 1 WHERE user_id = NEW.master_id;
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS requests_busyness_on_change ON requests;
+CREATE TRIGGER requests_busyness_on_change AFTER INSERT OR DELETE ON requests
+FOR EACH ROW EXECUTE FUNCTION update_master_busyness();
+
+DROP TRIGGER IF EXISTS requests_busyness_on_update ON requests;
+CREATE TRIGGER requests_busyness_on_update AFTER UPDATE OF status, master_id ON requests
+FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.master_id IS DISTINCT FROM NEW.master_id)
+EXECUTE FUNCTION update_master_busyness();
+
+UPDATE masters m SET busyness = (
+    SELECT COUNT(*) FROM requests r WHERE r.master_id = m.user_id AND r.status = 'in_progress'
+);
@@ -0,0 +1,183 @@
+-- Счётчики статистики, которые поддерживают триггеры: show_stats и панель читают несколько строк
+-- вместо COUNT(*) по таблицам. Каждый счётчик разбит на 8 строк (по номеру процесса сервера),
+-- чтобы одновременные транзакции не ждали блокировки одной строки; значение — сумма по строкам.
+-- Пересчёт с нуля (например, после загрузки данных с отключёнными триггерами): SELECT refresh_stats();
+LOCK TABLE users, requests, masters IN SHARE MODE;
+
+-- Время завершения заявки (ставит триггер), по нему считается среднее время выполнения
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS completed_at TIMESTAMPTZ;
+
+-- users, masters, busyness (сумма занятости), requests_<статус>, completed_timed (заявки с completed_at)
+-- и completion_seconds (их суммарное время выполнения)
+CREATE TABLE IF NOT EXISTS stats_counters (
+    name TEXT NOT NULL,
+    shard SMALLINT NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, shard)
+);
+
+-- Заявки по дням (UTC): созданные в этот день и завершённые в этот день
+CREATE TABLE IF NOT EXISTS request_stats_daily (
+    day DATE NOT NULL,
+    shard SMALLINT NOT NULL,
+    created INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    completion_seconds BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, shard)
+);
+
+CREATE OR REPLACE FUNCTION stats_shard() RETURNS SMALLINT AS $$
+    SELECT (pg_backend_pid() % 8)::SMALLINT
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION stats_day(ts TIMESTAMPTZ) RETURNS DATE AS $$
+    SELECT (ts AT TIME ZONE 'UTC')::DATE
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION completion_seconds(created_at TIMESTAMPTZ, completed_at TIMESTAMPTZ) RETURNS BIGINT AS $$
+    SELECT COALESCE(round(extract(epoch FROM completed_at - created_at))::BIGINT, 0)
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION stats_add(counter TEXT, delta BIGINT) RETURNS void AS $$
+    INSERT INTO stats_counters (name, shard, value)
+    SELECT counter, stats_shard(), delta WHERE counter IS NOT NULL
+    ON CONFLICT (name, shard) DO UPDATE SET value = stats_counters.value + EXCLUDED.value
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION stats_add_daily(event_day DATE, created_delta INTEGER, completed_delta INTEGER,
+                                           seconds_delta BIGINT) RETURNS void AS $$
+    INSERT INTO request_stats_daily (day, shard, created, completed, completion_seconds)
+    SELECT event_day, stats_shard(), created_delta, completed_delta, seconds_delta WHERE event_day IS NOT NULL
+    ON CONFLICT (day, shard) DO UPDATE SET
+        created = request_stats_daily.created + EXCLUDED.created,
+        completed = request_stats_daily.completed + EXCLUDED.completed,
+        completion_seconds = request_stats_daily.completion_seconds + EXCLUDED.completion_seconds
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION requests_set_completed_at() RETURNS trigger AS $$
+BEGIN
+    IF NEW.status IS DISTINCT FROM 'completed' THEN
+        NEW.completed_at := NULL;
+    ELSIF TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM 'completed' THEN
+        NEW.completed_at := COALESCE(NEW.completed_at, CURRENT_TIMESTAMP);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Строка заявки учитывается в счётчиках при вставке и снимается при удалении;
+-- изменение — это снятие старой версии и учёт новой
+CREATE OR REPLACE FUNCTION requests_update_stats() RETURNS trigger AS $$
+DECLARE
+    seconds BIGINT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM stats_add('requests_' || OLD.status, -1);
+        IF TG_OP = 'DELETE' THEN
+            PERFORM stats_add_daily(stats_day(OLD.created_at), -1, 0, 0);
+        END IF;
+        IF OLD.completed_at IS NOT NULL THEN
+            seconds := completion_seconds(OLD.created_at, OLD.completed_at);
+            PERFORM stats_add('completed_timed', -1);
+            PERFORM stats_add('completion_seconds', -seconds);
+            PERFORM stats_add_daily(stats_day(OLD.completed_at), 0, -1, -seconds);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM stats_add('requests_' || NEW.status, 1);
+        IF TG_OP = 'INSERT' THEN
+            PERFORM stats_add_daily(stats_day(NEW.created_at), 1, 0, 0);
+        END IF;
+        IF NEW.completed_at IS NOT NULL THEN
+            seconds := completion_seconds(NEW.created_at, NEW.completed_at);
+            PERFORM stats_add('completed_timed', 1);
+            PERFORM stats_add('completion_seconds', seconds);
+            PERFORM stats_add_daily(stats_day(NEW.completed_at), 0, 1, seconds);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_update_stats() RETURNS trigger AS $$
+BEGIN
+    PERFORM stats_add('users', CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION masters_update_stats() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM stats_add('busyness', -COALESCE(OLD.busyness, 0));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM stats_add('busyness', COALESCE(NEW.busyness, 0));
+    END IF;
+    IF TG_OP <> 'UPDATE' THEN
+        PERFORM stats_add('masters', CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS requests_completed_at ON requests;
+CREATE TRIGGER requests_completed_at BEFORE INSERT OR UPDATE OF status ON requests
+FOR EACH ROW EXECUTE FUNCTION requests_set_completed_at();
+
+DROP TRIGGER IF EXISTS requests_stats_on_change ON requests;
+CREATE TRIGGER requests_stats_on_change AFTER INSERT OR DELETE ON requests
+FOR EACH ROW EXECUTE FUNCTION requests_update_stats();
+
+DROP TRIGGER IF EXISTS requests_stats_on_update ON requests;
+CREATE TRIGGER requests_stats_on_update AFTER UPDATE OF status, completed_at ON requests
+FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.completed_at IS DISTINCT FROM NEW.completed_at)
+EXECUTE FUNCTION requests_update_stats();
+
+DROP TRIGGER IF EXISTS users_stats ON users;
+CREATE TRIGGER users_stats AFTER INSERT OR DELETE ON users
+FOR EACH ROW EXECUTE FUNCTION users_update_stats();
+
+DROP TRIGGER IF EXISTS masters_stats_on_change ON masters;
+CREATE TRIGGER masters_stats_on_change AFTER INSERT OR DELETE ON masters
+FOR EACH ROW EXECUTE FUNCTION masters_update_stats();
+
+DROP TRIGGER IF EXISTS masters_stats_on_update ON masters;
+CREATE TRIGGER masters_stats_on_update AFTER UPDATE OF busyness ON masters
+FOR EACH ROW WHEN (OLD.busyness IS DISTINCT FROM NEW.busyness)
+EXECUTE FUNCTION masters_update_stats();
+
+CREATE OR REPLACE FUNCTION refresh_stats() RETURNS void AS $$
+BEGIN
+    -- Пока идёт пересчёт, записи в таблицы ждут, иначе их изменения потерялись бы
+    LOCK TABLE users, requests, masters IN SHARE MODE;
+    DELETE FROM stats_counters;
+    DELETE FROM request_stats_daily;
+    INSERT INTO stats_counters (name, shard, value)
+    SELECT 'users', 0, COUNT(*) FROM users
+    UNION ALL
+    SELECT 'masters', 0, COUNT(*) FROM masters
+    UNION ALL
+    SELECT 'busyness', 0, COALESCE(SUM(busyness), 0) FROM masters
+    UNION ALL
+    SELECT 'requests_' || status, 0, COUNT(*) FROM requests WHERE status IS NOT NULL GROUP BY status
+    UNION ALL
+    SELECT 'completed_timed', 0, COUNT(*) FROM requests WHERE completed_at IS NOT NULL
+    UNION ALL
+    SELECT 'completion_seconds', 0, COALESCE(SUM(completion_seconds(created_at, completed_at)), 0)
+    FROM requests WHERE completed_at IS NOT NULL;
+    INSERT INTO request_stats_daily (day, shard, created, completed, completion_seconds)
+    SELECT day, 0, SUM(created), SUM(completed), SUM(seconds)
+    FROM (
+        SELECT stats_day(created_at) AS day, 1 AS created, 0 AS completed, 0::BIGINT AS seconds
+        FROM requests WHERE created_at IS NOT NULL
+        UNION ALL
+        SELECT stats_day(completed_at), 0, 1, completion_seconds(created_at, completed_at)
+        FROM requests WHERE completed_at IS NOT NULL
+    ) events
+    GROUP BY day;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Завершённые до этой миграции заявки остаются без completed_at и в среднее время не входят
+SELECT refresh_stats();
@@ -0,0 +1,252 @@
+-- Почасовые и дневные итоги для графиков аналитики в админ-панели: объём заявок, время выполнения,
+-- отчёты и загрузка мастеров. Поддерживаются триггерами, как stats_counters (0003), поэтому график
+-- за год читает не больше 365 * 8 строк вместо таблицы заявок.
+LOCK TABLE requests, reports IN SHARE MODE;
+
+-- Когда заявка последний раз взята в работу (ставит триггер)
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS started_at TIMESTAMPTZ;
+
+-- Часы в UTC. busy_seconds — суммарное время в статусе in_progress всех заявок внутри часа
+-- (busy_seconds / 3600 — сколько заявок в среднем было в работе); засчитывается, когда заявка выходит из in_progress
+CREATE TABLE IF NOT EXISTS request_stats_hourly (
+    hour TIMESTAMPTZ NOT NULL,
+    shard SMALLINT NOT NULL,
+    created INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    completion_seconds BIGINT NOT NULL DEFAULT 0,
+    reports INTEGER NOT NULL DEFAULT 0,
+    busy_seconds BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, shard)
+);
+
+-- Заявки, которые сейчас в работе, по часу взятия в работу. Их время ещё не попало в busy_seconds,
+-- график досчитывает его на момент запроса. started_epoch — сумма started_at в секундах Unix
+CREATE TABLE IF NOT EXISTS requests_in_progress_hourly (
+    hour TIMESTAMPTZ NOT NULL,
+    shard SMALLINT NOT NULL,
+    started INTEGER NOT NULL DEFAULT 0,
+    started_epoch BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, shard)
+);
+
+ALTER TABLE request_stats_daily
+    ADD COLUMN IF NOT EXISTS reports INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS busy_seconds BIGINT NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION stats_hour(ts TIMESTAMPTZ) RETURNS TIMESTAMPTZ AS $$
+    SELECT date_trunc('hour', ts, 'UTC')
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION stats_add_hourly(event_hour TIMESTAMPTZ, created_delta INTEGER, completed_delta INTEGER,
+                                            seconds_delta BIGINT, reports_delta INTEGER, busy_delta BIGINT) RETURNS void AS $$
+    INSERT INTO request_stats_hourly (hour, shard, created, completed, completion_seconds, reports, busy_seconds)
+    SELECT event_hour, stats_shard(), created_delta, completed_delta, seconds_delta, reports_delta, busy_delta
+    WHERE event_hour IS NOT NULL
+    ON CONFLICT (hour, shard) DO UPDATE SET
+        created = request_stats_hourly.created + EXCLUDED.created,
+        completed = request_stats_hourly.completed + EXCLUDED.completed,
+        completion_seconds = request_stats_hourly.completion_seconds + EXCLUDED.completion_seconds,
+        reports = request_stats_hourly.reports + EXCLUDED.reports,
+        busy_seconds = request_stats_hourly.busy_seconds + EXCLUDED.busy_seconds
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION stats_add_daily_activity(event_day DATE, reports_delta INTEGER, busy_delta BIGINT) RETURNS void AS $$
+    INSERT INTO request_stats_daily (day, shard, reports, busy_seconds)
+    SELECT event_day, stats_shard(), reports_delta, busy_delta WHERE event_day IS NOT NULL
+    ON CONFLICT (day, shard) DO UPDATE SET
+        reports = request_stats_daily.reports + EXCLUDED.reports,
+        busy_seconds = request_stats_daily.busy_seconds + EXCLUDED.busy_seconds
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION stats_add_in_progress(started TIMESTAMPTZ, delta INTEGER) RETURNS void AS $$
+    INSERT INTO requests_in_progress_hourly (hour, shard, started, started_epoch)
+    SELECT stats_hour(started), stats_shard(), delta, delta * round(extract(epoch FROM started))::BIGINT
+    WHERE started IS NOT NULL
+    ON CONFLICT (hour, shard) DO UPDATE SET
+        started = requests_in_progress_hourly.started + EXCLUDED.started,
+        started_epoch = requests_in_progress_hourly.started_epoch + EXCLUDED.started_epoch
+$$ LANGUAGE sql;
+
+-- Время в работе с started по ended, разложенное по часам: [(час, секунд)]
+CREATE OR REPLACE FUNCTION busy_hours(started TIMESTAMPTZ, ended TIMESTAMPTZ)
+RETURNS TABLE (hour TIMESTAMPTZ, seconds BIGINT) AS $$
+    SELECT bucket, round(extract(epoch FROM LEAST(bucket + interval '1 hour', ended) - GREATEST(bucket, started)))::BIGINT
+    FROM generate_series(stats_hour(started), ended, interval '1 hour') bucket
+    WHERE started < ended AND bucket < ended
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Одна вставка на таблицу, а не на каждый час: заявка бывает в работе неделями.
+-- Строки обновляются по возрастанию ключа, чтобы параллельные транзакции не ждали друг друга по кругу
+CREATE OR REPLACE FUNCTION stats_add_busy(started TIMESTAMPTZ, ended TIMESTAMPTZ) RETURNS void AS $$
+    INSERT INTO request_stats_hourly (hour, shard, busy_seconds)
+    SELECT hour, stats_shard(), seconds FROM busy_hours(started, ended) ORDER BY hour
+    ON CONFLICT (hour, shard) DO UPDATE SET busy_seconds = request_stats_hourly.busy_seconds + EXCLUDED.busy_seconds;
+    INSERT INTO request_stats_daily (day, shard, busy_seconds)
+    SELECT stats_day(hour), stats_shard(), SUM(seconds) FROM busy_hours(started, ended) GROUP BY 1 ORDER BY 1
+    ON CONFLICT (day, shard) DO UPDATE SET busy_seconds = request_stats_daily.busy_seconds + EXCLUDED.busy_seconds
+$$ LANGUAGE sql;
+
+-- Заменяет requests_set_completed_at из 0003: дополнительно отмечает взятие в работу
+CREATE OR REPLACE FUNCTION requests_set_timestamps() RETURNS trigger AS $$
+BEGIN
+    IF NEW.status IS DISTINCT FROM 'completed' THEN
+        NEW.completed_at := NULL;
+    ELSIF TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM 'completed' THEN
+        NEW.completed_at := COALESCE(NEW.completed_at, CURRENT_TIMESTAMP);
+    END IF;
+    IF NEW.status = 'in_progress' AND (TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM 'in_progress') THEN
+        NEW.started_at := COALESCE(NEW.started_at, CURRENT_TIMESTAMP);
+        IF TG_OP = 'UPDATE' AND NEW.started_at IS NOT DISTINCT FROM OLD.started_at THEN
+            NEW.started_at := CURRENT_TIMESTAMP;
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS requests_completed_at ON requests;
+DROP FUNCTION IF EXISTS requests_set_completed_at();
+DROP TRIGGER IF EXISTS requests_timestamps ON requests;
+CREATE TRIGGER requests_timestamps BEFORE INSERT OR UPDATE OF status ON requests
+FOR EACH ROW EXECUTE FUNCTION requests_set_timestamps();
+
+CREATE OR REPLACE FUNCTION requests_update_rollups() RETURNS trigger AS $$
+DECLARE
+    seconds BIGINT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM stats_add_hourly(stats_hour(OLD.created_at), -1, 0, 0, 0, 0);
+        END IF;
+        IF OLD.completed_at IS NOT NULL THEN
+            seconds := completion_seconds(OLD.created_at, OLD.completed_at);
+            PERFORM stats_add_hourly(stats_hour(OLD.completed_at), 0, -1, -seconds, 0, 0);
+        END IF;
+        -- Время в работе — уже прошедшее: при выходе из in_progress оно засчитывается и больше не снимается
+        IF OLD.status = 'in_progress' AND (TG_OP = 'DELETE' OR NEW.status IS DISTINCT FROM 'in_progress') THEN
+            PERFORM stats_add_busy(OLD.started_at, CURRENT_TIMESTAMP);
+            PERFORM stats_add_in_progress(OLD.started_at, -1);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM stats_add_hourly(stats_hour(NEW.created_at), 1, 0, 0, 0, 0);
+        END IF;
+        IF NEW.completed_at IS NOT NULL THEN
+            seconds := completion_seconds(NEW.created_at, NEW.completed_at);
+            PERFORM stats_add_hourly(stats_hour(NEW.completed_at), 0, 1, seconds, 0, 0);
+        END IF;
+        IF NEW.status = 'in_progress' AND (TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM 'in_progress') THEN
+            PERFORM stats_add_in_progress(NEW.started_at, 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION reports_update_rollups() RETURNS trigger AS $$
+DECLARE
+    report RECORD;
+    delta INTEGER;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        report := NEW;
+        delta := 1;
+    ELSE
+        report := OLD;
+        delta := -1;
+    END IF;
+    PERFORM stats_add_hourly(stats_hour(report.created_at), 0, 0, 0, delta, 0);
+    PERFORM stats_add_daily_activity(stats_day(report.created_at), delta, 0);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS requests_rollups_on_change ON requests;
+CREATE TRIGGER requests_rollups_on_change AFTER INSERT OR DELETE ON requests
+FOR EACH ROW EXECUTE FUNCTION requests_update_rollups();
+
+DROP TRIGGER IF EXISTS requests_rollups_on_update ON requests;
+CREATE TRIGGER requests_rollups_on_update AFTER UPDATE OF status, completed_at ON requests
+FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.completed_at IS DISTINCT FROM NEW.completed_at)
+EXECUTE FUNCTION requests_update_rollups();
+
+DROP TRIGGER IF EXISTS reports_rollups ON reports;
+CREATE TRIGGER reports_rollups AFTER INSERT OR DELETE ON reports
+FOR EACH ROW EXECUTE FUNCTION reports_update_rollups();
+
+-- Пересчёт итогов с нуля. Время в работе восстанавливается только для завершённых заявок
+-- (от started_at до completed_at): промежутки заявок, возвращённых из работы, не сохраняются
+CREATE OR REPLACE FUNCTION refresh_rollups() RETURNS void AS $$
+BEGIN
+    LOCK TABLE requests, reports IN SHARE MODE;
+    DELETE FROM request_stats_hourly;
+    DELETE FROM requests_in_progress_hourly;
+    UPDATE request_stats_daily SET reports = 0, busy_seconds = 0 WHERE reports <> 0 OR busy_seconds <> 0;
+    INSERT INTO request_stats_hourly (hour, shard, created, completed, completion_seconds, reports, busy_seconds)
+    SELECT hour, 0, SUM(created), SUM(completed), SUM(seconds), SUM(reports), SUM(busy)
+    FROM (
+        SELECT stats_hour(created_at) AS hour, 1 AS created, 0 AS completed, 0::BIGINT AS seconds,
+               0 AS reports, 0::BIGINT AS busy
+        FROM requests WHERE created_at IS NOT NULL
+        UNION ALL
+        SELECT stats_hour(completed_at), 0, 1, completion_seconds(created_at, completed_at), 0, 0
+        FROM requests WHERE completed_at IS NOT NULL
+        UNION ALL
+        SELECT stats_hour(created_at), 0, 0, 0, 1, 0
+        FROM reports WHERE created_at IS NOT NULL
+        UNION ALL
+        SELECT busy.hour, 0, 0, 0, 0, busy.seconds
+        FROM requests r, busy_hours(r.started_at, r.completed_at) busy
+        WHERE r.started_at IS NOT NULL AND r.completed_at IS NOT NULL
+    ) events
+    GROUP BY hour;
+    INSERT INTO requests_in_progress_hourly (hour, shard, started, started_epoch)
+    SELECT stats_hour(started_at), 0, COUNT(*), SUM(round(extract(epoch FROM started_at))::BIGINT)
+    FROM requests
+    WHERE status = 'in_progress' AND started_at IS NOT NULL
+    GROUP BY stats_hour(started_at);
+    INSERT INTO request_stats_daily (day, shard, reports, busy_seconds)
+    SELECT stats_day(hour), 0, SUM(reports), SUM(busy_seconds)
+    FROM request_stats_hourly
+    GROUP BY stats_day(hour)
+    ON CONFLICT (day, shard) DO UPDATE SET reports = EXCLUDED.reports, busy_seconds = EXCLUDED.busy_seconds;
+END;
+$$ LANGUAGE plpgsql;
+
+-- refresh_stats() из 0003 очищает request_stats_daily целиком, поэтому пересчитывает и итоги
+CREATE OR REPLACE FUNCTION refresh_stats() RETURNS void AS $$
+BEGIN
+    LOCK TABLE users, requests, masters, reports IN SHARE MODE;
+    DELETE FROM stats_counters;
+    DELETE FROM request_stats_daily;
+    INSERT INTO stats_counters (name, shard, value)
+    SELECT 'users', 0, COUNT(*) FROM users
+    UNION ALL
+    SELECT 'masters', 0, COUNT(*) FROM masters
+    UNION ALL
+    SELECT 'busyness', 0, COALESCE(SUM(busyness), 0) FROM masters
+    UNION ALL
+    SELECT 'requests_' || status, 0, COUNT(*) FROM requests WHERE status IS NOT NULL GROUP BY status
+    UNION ALL
+    SELECT 'completed_timed', 0, COUNT(*) FROM requests WHERE completed_at IS NOT NULL
+    UNION ALL
+    SELECT 'completion_seconds', 0, COALESCE(SUM(completion_seconds(created_at, completed_at)), 0)
+    FROM requests WHERE completed_at IS NOT NULL;
+    INSERT INTO request_stats_daily (day, shard, created, completed, completion_seconds)
+    SELECT day, 0, SUM(created), SUM(completed), SUM(seconds)
+    FROM (
+        SELECT stats_day(created_at) AS day, 1 AS created, 0 AS completed, 0::BIGINT AS seconds
+        FROM requests WHERE created_at IS NOT NULL
+        UNION ALL
+        SELECT stats_day(completed_at), 0, 1, completion_seconds(created_at, completed_at)
+        FROM requests WHERE completed_at IS NOT NULL
+    ) events
+    GROUP BY day;
+    PERFORM refresh_rollups();
+END;
+$$ LANGUAGE plpgsql;
+
+-- Заявки, которые уже в работе, считаются взятыми в работу сейчас
+UPDATE requests SET started_at = CURRENT_TIMESTAMP WHERE status = 'in_progress' AND started_at IS NULL;
+SELECT refresh_rollups();
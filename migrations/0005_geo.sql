@@ -0,0 +1,19 @@
+-- Координаты заявок и мастеров для назначения ближайшего мастера (geo.py).
+-- latitude/longitude — градусы WGS 84; location — та же точка в км на плоскости вокруг центра города
+-- (geo.project), чтобы расстояние <-> между точками было расстоянием в км.
+-- Если меняется GEO_CITY_CENTER, location пересчитывается: python geo.py --reproject
+ALTER TABLE requests
+    ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS location POINT;
+
+-- Последнее местоположение, которое прислал мастер (в т.ч. трансляцией геопозиции)
+ALTER TABLE masters
+    ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS location POINT,
+    ADD COLUMN IF NOT EXISTS located_at TIMESTAMPTZ;
+
+-- R-дерево (GiST) по местоположению: ближайшие мастера — ORDER BY location <-> точка LIMIT n
+-- обходом индекса, без перебора всех мастеров
+CREATE INDEX IF NOT EXISTS idx_masters_location ON masters USING gist (location);
@@ -0,0 +1,238 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота и около 1 в секунду в один чат
+GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', '30'))
+CHAT_RATE = float(os.getenv('TG_CHAT_RATE', '1'))
+# Небольшой запас, чтобы ответ и следующее за ним меню уходили без паузы
+CHAT_BURST = int(os.getenv('TG_CHAT_BURST', '3'))
+# Сколько отправок может выполняться одновременно
+BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '30'))
+# Повторы при сетевых ошибках и 5xx (на 429 повторяем всегда, выждав retry_after)
+MAX_RETRIES = 3
+LATENCY_WINDOW = 1000
+
+
+# Ведро токенов: rate токенов в секунду, не больше capacity
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    # Через сколько секунд будет доступен токен (0 — уже доступен)
+    def wait_time(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    # Запрет отправки до момента until (ответ 429 с retry_after)
+    def block(self, now, until):
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - (until - now) * self.rate)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboxMessage:
+    __slots__ = ('chat_id', 'text', 'kwargs', 'future', 'bulk', 'enqueued_at', 'attempts')
+
+    def __init__(self, chat_id, text, kwargs, future, bulk=False):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.future = future
+        self.bulk = bulk
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+# Очередь исходящих сообщений бота. Обработчики не ждут Telegram: send() ставит сообщение в очередь
+# и возвращает Future. Сообщения в один чат уходят строго по порядку и не чаще CHAT_RATE,
+# все вместе — не чаще GLOBAL_RATE; на 429 сообщение возвращается в голову очереди чата до retry_after.
+# Массовые сообщения (bulk=True, рассылки) отправляются только когда нет обычных уведомлений;
+# если Future такого сообщения отменён до отправки, оно пропускается.
+class Outbox:
+    def __init__(self, bot, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 batch_size=BATCH_SIZE, max_retries=MAX_RETRIES):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self.chat_buckets = {}
+        # Чаты с ожидающими сообщениями, которые можно отправлять (порядок — round-robin)
+        self.ready = OrderedDict()
+        # То же для чатов, в очереди которых только массовые сообщения
+        self.bulk_ready = OrderedDict()
+        # Чаты, сообщение в которые сейчас отправляется: остальные ждут своей очереди
+        self.busy = {}
+        self.sending = set()
+        self.depth = 0
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.metrics = {'enqueued': 0, 'sent': 0, 'failed': 0, 'cancelled': 0, 'retried': 0, 'rate_limited': 0}
+        self.delivery_latencies = deque(maxlen=LATENCY_WINDOW)
+        self.send_latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def send(self, chat_id, text, bulk=False, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._log_failure)
+        message = OutboxMessage(chat_id, text, kwargs, future, bulk)
+        chat_id = int(chat_id)
+        if chat_id in self.busy:
+            self.busy[chat_id].append(message)
+        elif chat_id in self.ready:
+            self.ready[chat_id].append(message)
+        elif chat_id in self.bulk_ready:
+            self.bulk_ready[chat_id].append(message)
+            if not bulk:
+                self.ready[chat_id] = self.bulk_ready.pop(chat_id)
+        else:
+            self._set_ready(chat_id, deque([message]))
+        self.depth += 1
+        self.metrics['enqueued'] += 1
+        self.idle.clear()
+        self.wakeup.set()
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(f"Message delivery failed: {future.exception()}")
+
+    async def join(self):
+        await self.idle.wait()
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            delay = self._dispatch()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    # Запускает отправку всего, что разрешают лимиты; возвращает, через сколько секунд проверить снова
+    # (None — ждать нового сообщения или завершения отправки)
+    def _dispatch(self):
+        now = time.monotonic()
+        next_check = None
+        for ready in (self.ready, self.bulk_ready):
+            for chat_id in list(ready):
+                if len(self.sending) >= self.batch_size:
+                    return next_check
+                wait = self.global_bucket.wait_time(now)
+                if wait > 0:
+                    return wait if next_check is None else min(next_check, wait)
+                queue = ready[chat_id]
+                while queue and queue[0].future.cancelled():
+                    queue.popleft()
+                    self.metrics['cancelled'] += 1
+                    self._done()
+                if not queue:
+                    del ready[chat_id]
+                    continue
+                bucket = self.chat_buckets.get(chat_id)
+                if bucket is None:
+                    bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+                wait = bucket.wait_time(now)
+                if wait > 0:
+                    next_check = wait if next_check is None else min(next_check, wait)
+                    continue
+                bucket.consume()
+                self.global_bucket.consume()
+                del ready[chat_id]
+                self.busy[chat_id] = queue
+                self.sending.add(asyncio.create_task(self._deliver(chat_id, queue.popleft())))
+        if len(self.chat_buckets) > 10000:
+            self._drop_idle_buckets(now)
+        return next_check
+
+    def _set_ready(self, chat_id, queue):
+        if any(not message.bulk for message in queue):
+            self.ready[chat_id] = queue
+        else:
+            self.bulk_ready[chat_id] = queue
+
+    def _drop_idle_buckets(self, now):
+        for chat_id in [chat_id for chat_id, bucket in self.chat_buckets.items()
+                        if chat_id not in self.ready and chat_id not in self.bulk_ready
+                        and chat_id not in self.busy and bucket.is_full(now)]:
+            del self.chat_buckets[chat_id]
+
+    async def _deliver(self, chat_id, message):
+        message.attempts += 1
+        started = time.monotonic()
+        retry_at = None
+        try:
+            result = await self.bot.send_message(chat_id, message.text, **message.kwargs)
+        except TelegramRetryAfter as e:
+            self.metrics['rate_limited'] += 1
+            retry_at = time.monotonic() + e.retry_after
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if message.attempts <= self.max_retries:
+                retry_at = time.monotonic() + 2 ** message.attempts
+            else:
+                self._finish(message, error=e)
+        except Exception as e:
+            self._finish(message, error=e)
+        else:
+            self.send_latencies.append(time.monotonic() - started)
+            self._finish(message, result=result)
+
+        queue = self.busy.pop(chat_id)
+        if retry_at is not None:
+            self.metrics['retried'] += 1
+            queue.appendleft(message)
+            self.chat_buckets[chat_id].block(time.monotonic(), retry_at)
+        if queue:
+            self._set_ready(chat_id, queue)
+        # Убираем задачу из sending до пробуждения планировщика, иначе он увидит заполненный батч и уснёт
+        self.sending.discard(asyncio.current_task())
+        self.wakeup.set()
+
+    def _finish(self, message, result=None, error=None):
+        if error is None:
+            self.metrics['sent'] += 1
+            self.delivery_latencies.append(time.monotonic() - message.enqueued_at)
+            if not message.future.done():
+                message.future.set_result(result)
+        else:
+            self.metrics['failed'] += 1
+            if not message.future.done():
+                message.future.set_exception(error)
+        self._done()
+
+    def _done(self):
+        self.depth -= 1
+        if self.depth == 0:
+            self.idle.set()
+
+    def stats(self):
+        result = dict(self.metrics)
+        result['queue_depth'] = self.depth
+        result['in_flight'] = len(self.sending)
+        for name, values in (('delivery', self.delivery_latencies), ('send', self.send_latencies)):
+            ordered = sorted(values)
+            result[f'{name}_p50'] = ordered[len(ordered) // 2] if ordered else 0.0
+            result[f'{name}_p99'] = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] if ordered else 0.0
+        return result
@@ -0,0 +1,87 @@
+import os
+import asyncio
+from database import Database, AsyncDatabase
+from cache import LRUCache
+
+# Кэш профилей пользователей бота: ФИО, регистрация и роль нужны почти каждому обработчику,
+# а меняются редко. Записи сбрасываются по TTL и по уведомлениям USER_CHANGED_CHANNEL
+# (регистрация, подтверждение мастера, правка пользователя в админ-панели).
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', '60'))
+# Сколько профилей держать в памяти; при переполнении вытесняются давно не использованные
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '100000'))
+
+
+class UserProfile:
+    __slots__ = ('full_name', 'registered', 'role')
+
+    def __init__(self, full_name, registered, role):
+        self.full_name = full_name
+        self.registered = registered
+        self.role = role
+
+
+class ProfileDatabase(Database):
+    # Профиль одним запросом; для пользователя, которого нет в users, — (None, False, 'client')
+    @staticmethod
+    def load_profile(user_id: int) -> UserProfile:
+        with ProfileDatabase() as cursor:
+            cursor.execute('''
+                SELECT u.full_name, COALESCE(u.registered, FALSE),
+                       CASE
+                           WHEN u.role = 'admin' THEN 'admin'
+                           WHEN EXISTS (SELECT 1 FROM masters WHERE user_id = q.id) THEN 'master'
+                           ELSE 'client'
+                       END
+                FROM (SELECT %s::bigint AS id) q
+                LEFT JOIN users u ON u.telegram_id = q.id
+            ''', (user_id,))
+            return UserProfile(*cursor.fetchone())
+
+
+# Используется только из цикла событий, как и TTLCache. adb — AsyncDatabase процесса (его пул потоков
+# рассчитан на пул соединений); профили загружаются через adb.run, класс Database у adb может быть любым
+class ProfileCache:
+    def __init__(self, adb=None, ttl=PROFILE_CACHE_TTL, maxsize=PROFILE_CACHE_SIZE):
+        self.adb = adb or AsyncDatabase(ProfileDatabase)
+        self.cache = LRUCache(ttl, maxsize)
+        # user_id → загрузка в процессе: одновременные промахи по одному пользователю ждут один запрос
+        self.loading = {}
+        self.coalesced = 0
+
+    async def get(self, user_id: int) -> UserProfile:
+        profile = self.cache.get(user_id)
+        if profile is not None:
+            return profile
+        task = self.loading.get(user_id)
+        if task is None:
+            # Поколение запоминается сейчас: задача начнёт выполняться позже, уже после возможной инвалидации
+            task = self.loading[user_id] = asyncio.ensure_future(self.load(user_id, self.cache.generation))
+            task.add_done_callback(lambda _: self.forget(user_id, task))
+        else:
+            self.coalesced += 1
+        # Отмена одного ожидающего не отменяет загрузку для остальных
+        return await asyncio.shield(task)
+
+    async def load(self, user_id, generation):
+        profile = await self.adb.run(ProfileDatabase.load_profile, user_id)
+        self.cache.set(user_id, profile, generation)
+        return profile
+
+    def forget(self, user_id, task):
+        if self.loading.get(user_id) is task:
+            del self.loading[user_id]
+
+    # Начатая до инвалидации загрузка может вернуть старый профиль: следующие запросы её не ждут
+    def invalidate(self, user_id):
+        self.cache.invalidate(int(user_id))
+        self.loading.pop(int(user_id), None)
+
+    def clear(self):
+        self.cache.clear()
+        self.loading.clear()
+
+    def stats(self):
+        result = self.cache.stats()
+        result['loading'] = len(self.loading)
+        result['coalesced'] = self.coalesced
+        return result
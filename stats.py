@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta, timezone
+from database import Database
+
+# Статистика бота и админ-панели. Счётчики поддерживают триггеры (migrations/0003_stats_counters.sql),
+# поэтому чтение — несколько десятков строк независимо от размера таблиц.
+
+# За сколько последних дней показывать заявки по дням
+STATS_DAYS = 7
+
+# Периоды графиков аналитики: название → (интервал, число интервалов)
+ANALYTICS_PERIODS = {
+    "48 часов": ('hour', 48),
+    "30 дней": ('day', 30),
+    "Год": ('day', 365),
+}
+BUCKET_LENGTHS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+
+
+class StatsDatabase(Database):
+    @staticmethod
+    def get_stats(days=STATS_DAYS):
+        with StatsDatabase() as cursor:
+            cursor.execute("SELECT name, SUM(value) FROM stats_counters GROUP BY name")
+            counters = {name: int(value) for name, value in cursor.fetchall()}
+            cursor.execute("""
+                SELECT day, SUM(created), SUM(completed)
+                FROM request_stats_daily
+                WHERE day > stats_day(CURRENT_TIMESTAMP) - %s
+                GROUP BY day
+                ORDER BY day DESC
+            """, (days,))
+            daily = [(day, int(created), int(completed)) for day, created, completed in cursor.fetchall()]
+        return Stats(counters, daily)
+
+    # Итоги за последние count интервалов (bucket — 'hour' или 'day') для графиков аналитики
+    @staticmethod
+    def get_analytics(bucket, count):
+        with StatsDatabase() as cursor:
+            cursor.execute("SELECT CURRENT_TIMESTAMP")
+            now = cursor.fetchone()[0]
+            start = Analytics.bucket_start(now, bucket) - BUCKET_LENGTHS[bucket] * (count - 1)
+            if bucket == 'hour':
+                cursor.execute("""
+                    SELECT hour, SUM(created), SUM(completed), SUM(completion_seconds), SUM(reports), SUM(busy_seconds)
+                    FROM request_stats_hourly WHERE hour >= %s
+                    GROUP BY hour
+                """, (start,))
+            else:
+                cursor.execute("""
+                    SELECT day, SUM(created), SUM(completed), SUM(completion_seconds), SUM(reports), SUM(busy_seconds)
+                    FROM request_stats_daily WHERE day >= stats_day(%s)
+                    GROUP BY day
+                """, (start,))
+            rows = cursor.fetchall()
+            # Заявки, которые сейчас в работе, в итоги ещё не попали: число взятых в работу по интервалам
+            # (взятые до начала графика — в первом интервале с моментом взятия start)
+            cursor.execute("""
+                SELECT date_bin(%(length)s, GREATEST(hour, %(start)s), %(start)s) AS bucket, SUM(started),
+                       SUM(CASE WHEN hour < %(start)s THEN started * extract(epoch FROM %(start)s) ELSE started_epoch END)
+                FROM requests_in_progress_hourly
+                GROUP BY bucket
+            """, {'length': BUCKET_LENGTHS[bucket], 'start': start})
+            in_progress = cursor.fetchall()
+        return Analytics(bucket, count, start, now, rows, in_progress)
+
+
+# Ряды для графиков аналитики: по одному значению на интервал, пустые интервалы заполнены нулями
+class Analytics:
+    __slots__ = ('bucket', 'buckets', 'created', 'completed', 'reports', 'avg_completion', 'utilization')
+
+    def __init__(self, bucket, count, start, now, rows, in_progress):
+        self.bucket = bucket
+        length = BUCKET_LENGTHS[bucket]
+        self.buckets = [start + length * i for i in range(count)]
+        index = {bucket_start: i for i, bucket_start in enumerate(self.buckets)}
+        self.created = [0] * count
+        self.completed = [0] * count
+        self.reports = [0] * count
+        # Среднее время выполнения заявок, завершённых в интервале, ч (None — завершённых нет)
+        self.avg_completion = [None] * count
+        busy = [0.0] * count
+        for key, created, completed, seconds, reports, busy_seconds in rows:
+            i = index.get(self.to_datetime(key))
+            if i is None:
+                continue
+            self.created[i] = int(created)
+            self.completed[i] = int(completed)
+            self.reports[i] = int(reports)
+            busy[i] = float(busy_seconds)
+            if completed:
+                self.avg_completion[i] = float(seconds) / int(completed) / 3600
+        # Открытые промежутки работы: заявка, взятая в работу в интервале i, занимает остаток интервала i
+        # и целиком все следующие до текущего
+        started = [0] * count
+        started_sum = [0.0] * count
+        for key, number, started_epoch in in_progress:
+            i = index.get(key)
+            if i is not None:
+                started[i] = int(number)
+                started_sum[i] = float(started_epoch)
+        running = 0
+        for i, bucket_start in enumerate(self.buckets):
+            end = min(bucket_start + length, now).timestamp()
+            busy[i] += running * (end - bucket_start.timestamp()) + started[i] * end - started_sum[i]
+            running += started[i]
+        # Загрузка: сколько заявок в среднем было в работе одновременно
+        elapsed = [(min(bucket_start + length, now) - bucket_start).total_seconds() for bucket_start in self.buckets]
+        self.utilization = [value / seconds if seconds > 0 else 0.0 for value, seconds in zip(busy, elapsed)]
+
+    @staticmethod
+    def bucket_start(moment, bucket):
+        moment = moment.astimezone(timezone.utc)
+        if bucket == 'hour':
+            return moment.replace(minute=0, second=0, microsecond=0)
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    @staticmethod
+    def to_datetime(key):
+        if isinstance(key, datetime):
+            return key.astimezone(timezone.utc)
+        return datetime(key.year, key.month, key.day, tzinfo=timezone.utc)
+
+
+class Stats:
+    __slots__ = ('counters', 'daily')
+
+    def __init__(self, counters, daily):
+        self.counters = counters
+        # [(день, создано, завершено)], новые сверху
+        self.daily = daily
+
+    @property
+    def total_users(self):
+        return self.counters.get('users', 0)
+
+    @property
+    def masters(self):
+        return self.counters.get('masters', 0)
+
+    # Средняя занятость мастера (заявок в работе)
+    @property
+    def avg_load(self):
+        return self.counters.get('busyness', 0) / self.masters if self.masters else 0.0
+
+    def requests(self, status):
+        return self.counters.get(f'requests_{status}', 0)
+
+    @property
+    def pending(self):
+        return self.requests('pending')
+
+    # Среднее время от создания до завершения заявки, с (None — завершённых с известным временем нет)
+    @property
+    def avg_completion(self):
+        completed = self.counters.get('completed_timed', 0)
+        return self.counters.get('completion_seconds', 0) / completed if completed else None
+
+
+def format_duration(seconds):
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours} ч {minutes} мин"
+    days, hours = divmod(hours, 24)
+    return f"{days} д {hours} ч"
+
+
+# Текст статистики для сообщения бота и вкладки админ-панели
+def format_stats(stats):
+    lines = [
+        "📈 Статистика:",
+        f"👥 Всего пользователей: {stats.total_users}",
+        f"👨‍🔧 Мастеров: {stats.masters}",
+        f"📦 Средняя загрузка мастеров: {stats.avg_load:.1f}",
+        "",
+        f"⏳ Ожидающих заявок: {stats.pending}",
+        f"🚗 В процессе: {stats.requests('in_progress')}",
+        f"✅ Завершено: {stats.requests('completed')}",
+    ]
+    if stats.avg_completion is not None:
+        lines.append(f"⏱ Среднее время выполнения: {format_duration(stats.avg_completion)}")
+    if stats.daily:
+        lines.append("")
+        lines.append("📅 Заявки по дням (создано / завершено):")
+        for day, created, completed in stats.daily:
+            lines.append(f"{day:%d.%m}: {created} / {completed}")
+    return "\n".join(lines)
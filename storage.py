@@ -0,0 +1,171 @@
+import os
+import copy
+import uuid
+import asyncio
+import logging
+import psycopg2
+from psycopg2.extras import Json, execute_values
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from database import Database, AsyncDatabase, NotificationListener
+from cache import TTLCache
+
+# Как часто накопленные изменения состояний записываются в БД, с.
+# Несколько вызовов set_state/update_data в одном обработчике превращаются в одну запись.
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '0.1'))
+# Сколько живёт копия состояния в памяти процесса (изменения из других процессов приходят через NOTIFY)
+FSM_CACHE_TTL = float(os.getenv('FSM_CACHE_TTL', '300'))
+# Брошенный диалог (состояние не менялось дольше этого времени) считается завершённым и удаляется
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', str(24 * 3600)))
+FSM_CLEANUP_INTERVAL = 600
+
+# Канал, в который пишется "<процесс> <ключ>" при изменении состояния
+FSM_CHANGED_CHANNEL = 'fsm_changed'
+
+
+class FSMDatabase(Database):
+    # Состояния, изменённые позже чем ttl секунд назад: {ключ: (state, data)}
+    @staticmethod
+    def load_states(keys, ttl):
+        with FSMDatabase() as cursor:
+            cursor.execute("""
+                SELECT key, state, data FROM fsm_states
+                WHERE key = ANY(%s) AND updated_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+            """, (list(keys), ttl))
+            return {key: (state, data) for key, state, data in cursor.fetchall()}
+
+    # Записывает пачку изменений одной транзакцией: пустые состояния удаляются, остальные — upsert
+    @staticmethod
+    def save_states(changes, instance_id):
+        deleted = [key for key, (state, data) in changes.items() if state is None and not data]
+        updated = [(key, state, Json(data)) for key, (state, data) in changes.items() if state is not None or data]
+        with FSMDatabase() as cursor:
+            if deleted:
+                cursor.execute("DELETE FROM fsm_states WHERE key = ANY(%s)", (deleted,))
+            if updated:
+                execute_values(cursor, """
+                    INSERT INTO fsm_states (key, state, data) VALUES %s
+                    ON CONFLICT (key) DO UPDATE
+                    SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+                """, updated)
+            cursor.execute(
+                "SELECT pg_notify(%s, %s || ' ' || key) FROM unnest(%s::text[]) AS key",
+                (FSM_CHANGED_CHANNEL, instance_id, list(changes))
+            )
+
+    @staticmethod
+    def delete_expired_states(ttl):
+        with FSMDatabase() as cursor:
+            cursor.execute(
+                "DELETE FROM fsm_states WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                (ttl,)
+            )
+            return cursor.rowcount
+
+
+# Хранилище FSM aiogram в таблице fsm_states, общее для всех процессов бота.
+# Чтение — из кэша процесса, при промахе — из БД. Запись — отложенная: изменения копятся в dirty
+# и раз в FSM_FLUSH_INTERVAL пишутся одной транзакцией, после чего другие процессы получают
+# NOTIFY и сбрасывают свою копию. При падении процесса теряются изменения последних FSM_FLUSH_INTERVAL с.
+# Пример: storage = PostgresStorage(); dp = Dispatcher(storage=storage); asyncio.create_task(storage.run())
+class PostgresStorage(BaseStorage):
+    def __init__(self, key_builder=None, flush_interval=FSM_FLUSH_INTERVAL, cache_ttl=FSM_CACHE_TTL,
+                 state_ttl=FSM_STATE_TTL):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.flush_interval = flush_interval
+        self.state_ttl = state_ttl
+        self.instance_id = uuid.uuid4().hex
+        self.adb = AsyncDatabase(FSMDatabase, max_workers=2)
+        self.cache = TTLCache(cache_ttl)
+        # Изменения, ещё не записанные в БД: {ключ: (state, data)}; flushing — записываемые сейчас
+        self.dirty = {}
+        self.flushing = {}
+        self.listener = NotificationListener({FSM_CHANGED_CHANNEL: self.on_changed}, on_connect=self.cache.clear)
+
+    def on_changed(self, payload):
+        instance_id, key = payload.split(' ', 1)
+        if instance_id != self.instance_id:
+            self.cache.invalidate(key)
+
+    async def run(self):
+        tasks = [
+            asyncio.create_task(self.listener.run()),
+            asyncio.create_task(self.flush_loop()),
+            asyncio.create_task(self.cleanup_loop()),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        changes = self.flushing = self.dirty
+        self.dirty = {}
+        try:
+            await self.adb.save_states(changes, self.instance_id)
+        except psycopg2.Error as e:
+            logging.error(f"Database error: {e}")
+            # Возвращаем изменения в буфер, если их не перезаписали новые
+            for key, value in changes.items():
+                self.dirty.setdefault(key, value)
+            return
+        finally:
+            self.flushing = {}
+        for key, value in changes.items():
+            if key not in self.dirty:
+                self.cache.set(key, value)
+
+    async def cleanup_loop(self):
+        while True:
+            try:
+                deleted = await self.adb.delete_expired_states(self.state_ttl)
+                if deleted:
+                    logging.info(f"Deleted {deleted} abandoned FSM states")
+            except psycopg2.Error as e:
+                logging.error(f"Database error: {e}")
+            await asyncio.sleep(FSM_CLEANUP_INTERVAL)
+
+    def _pending(self, key):
+        return self.dirty.get(key) or self.flushing.get(key)
+
+    async def _load(self, key):
+        value = self._pending(key) or self.cache.get(key)
+        if value is None:
+            generation = self.cache.generation
+            value = (await self.adb.load_states([key], self.state_ttl)).get(key, (None, {}))
+            # Пока шёл запрос, этот же процесс мог изменить состояние
+            pending = self._pending(key)
+            if pending:
+                return pending
+            self.cache.set(key, value, generation)
+        return value
+
+    async def set_state(self, key, state=None):
+        key = self.key_builder.build(key)
+        _, data = await self._load(key)
+        self.dirty[key] = (state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key):
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key, data):
+        key = self.key_builder.build(key)
+        state, _ = await self._load(key)
+        self.dirty[key] = (state, copy.deepcopy(dict(data)))
+
+    async def get_data(self, key):
+        _, data = await self._load(self.key_builder.build(key))
+        return copy.deepcopy(data)
+
+    async def close(self):
+        await self.flush()
+        self.adb.shutdown()
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Для тестов, которым нужна PostgreSQL. Тесты заполняют и очищают таблицы, поэтому работают только
+# с отдельной базой TEST_DB_NAME (остальные параметры DB_*, как у бота); без неё, если она совпадает
+# с базой бота или недоступна, тест пропускается. Схема приводится к последней миграции, как при запуске бота
+@pytest.fixture(scope='session')
+def database():
+    import psycopg2
+    from database import DB_CONFIG, close_pool
+    name = os.getenv('TEST_DB_NAME')
+    if not name:
+        pytest.skip("TEST_DB_NAME is not set")
+    if name == DB_CONFIG['dbname']:
+        pytest.skip(f"TEST_DB_NAME must differ from the bot database {name}")
+    DB_CONFIG['dbname'] = name
+    close_pool()
+    try:
+        psycopg2.connect(connect_timeout=3, **DB_CONFIG).close()
+    except psycopg2.Error as e:
+        pytest.skip(f"PostgreSQL is not available: {e}")
+    from migrations import migrate
+    migrate()
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+pytest.importorskip('PySide6')
+
+from PySide6.QtCore import QCoreApplication
+
+from admin_panel import LazyTableModel, LoaderSignals, QueryTask
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+
+def make_model(keys, has_more=False):
+    model = LazyTableModel(["ID", "Имя"], page_loader=lambda after_key: None)
+    model.set_rows([(key, f"row {key}") for key in keys], has_more)
+    return model
+
+
+def test_apply_patch_updates_inserts_and_removes_rows():
+    model = make_model([1, 3, 5])
+    changed = []
+    model.dataChanged.connect(lambda top_left, bottom_right: changed.append(top_left.row()))
+    model.apply_patch([3, 4, 5], [(3, "updated"), (4, "new")])
+    assert model.keys == [1, 3, 4]
+    assert model.rows == [(1, "row 1"), (3, "updated"), (4, "new")]
+    assert changed == [1]
+
+
+def test_apply_patch_skips_rows_after_the_loaded_page():
+    model = make_model([1, 2, 3], has_more=True)
+    model.apply_patch([2, 10], [(2, "updated"), (10, "later")])
+    assert model.keys == [1, 2, 3]
+    assert model.row_at(1) == (2, "updated")
+
+
+def test_apply_patch_appends_when_everything_is_loaded():
+    model = make_model([1, 2, 3])
+    model.apply_patch([10], [(10, "last")])
+    assert model.keys == [1, 2, 3, 10]
+
+
+def test_fetch_more_requests_page_after_last_key():
+    requested = []
+    model = LazyTableModel(["ID"], page_loader=requested.append)
+    model.set_rows([(1,), (2,)], has_more=True)
+    model.fetchMore()
+    assert requested == [2]
+    assert not model.canFetchMore()
+    model.append_rows([(3,)], has_more=False)
+    assert model.keys == [1, 2, 3]
+    assert not model.canFetchMore()
+
+
+def test_query_task_reports_unexpected_errors_as_failed():
+    signals = LoaderSignals()
+    failed, finished = [], []
+    signals.failed.connect(lambda job, mode: failed.append((job, mode)))
+    signals.finished.connect(lambda *args: finished.append(args))
+
+    def fetch():
+        raise KeyError('column')
+
+    QueryTask('users', 'reload', fetch, None, signals).run()
+    assert failed == [('users', 'reload')]
+    assert finished == []
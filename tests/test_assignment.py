@@ -0,0 +1,25 @@
+from assignment import plan_assignments
+
+
+def test_requests_go_to_least_busy_master_first():
+    masters = [(10, 2), (20, 0), (30, 1)]
+    assert plan_assignments([1, 2, 3], masters, max_busyness=3) == [(1, 20), (2, 20), (3, 30)]
+
+
+def test_masters_at_max_busyness_get_nothing_more():
+    masters = [(10, 0), (20, 1)]
+    assignments = plan_assignments([1, 2, 3, 4], masters, max_busyness=2)
+    assert assignments == [(1, 10), (2, 10), (3, 20)]
+
+
+def test_no_masters_means_no_assignments():
+    assert plan_assignments([1, 2], [], max_busyness=3) == []
+
+
+def test_load_stays_balanced():
+    masters = [(master_id, 0) for master_id in range(5)]
+    assignments = plan_assignments(list(range(10)), masters, max_busyness=3)
+    load = {}
+    for _, master_id in assignments:
+        load[master_id] = load.get(master_id, 0) + 1
+    assert sorted(load.values()) == [2, 2, 2, 2, 2]
@@ -0,0 +1,82 @@
+import asyncio
+
+import psycopg2
+
+from broadcast import Broadcaster, BroadcastState
+
+
+# AsyncDatabase с BroadcastDatabase: получатели из списка, вызовы записываются в calls
+class FakeBroadcastDatabase:
+    def __init__(self, users, fail_after=None):
+        self.users = users
+        self.fail_after = fail_after
+        self.calls = []
+
+    async def get_recipients(self, after_id, limit):
+        if self.fail_after is not None and after_id >= self.fail_after:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        return [user_id for user_id in self.users if user_id > after_id][:limit]
+
+    def __getattr__(self, name):
+        async def call(*args):
+            self.calls.append((name, *args))
+        return call
+
+    def called(self, name):
+        return [call for call in self.calls if call[0] == name]
+
+
+# Outbox, в котором сообщения остаются в очереди, пока тест не отправит их сам
+class FakeOutbox:
+    def __init__(self):
+        self.queued = {}
+
+    def send(self, chat_id, text, bulk=False):
+        future = asyncio.get_running_loop().create_future()
+        self.queued[chat_id] = future
+        return future
+
+    def deliver(self, *chat_ids):
+        for chat_id in chat_ids:
+            self.queued[chat_id].set_result(None)
+
+
+def make_state(last_user_id=0):
+    return BroadcastState((1, None, 'Новость', 4, last_user_id, 0, 0))
+
+
+def test_heartbeat_is_refreshed_while_batch_is_sending():
+    async def main():
+        adb, outbox = FakeBroadcastDatabase([1, 2, 3, 4]), FakeOutbox()
+        broadcaster = Broadcaster(outbox, adb=adb, batch_size=2, heartbeat_interval=0.01)
+        task = asyncio.create_task(broadcaster.run(make_state()))
+        await asyncio.sleep(0.1)
+        # Ни одна пачка не отправлена, контрольная точка не сохранялась, но владение продлевается
+        assert not adb.called('save_progress')
+        assert len(adb.called('touch_broadcast')) >= 3
+        outbox.deliver(1, 2, 3, 4)
+        await asyncio.wait_for(task, 1)
+        touched = len(adb.called('touch_broadcast'))
+        await asyncio.sleep(0.05)
+        assert len(adb.called('touch_broadcast')) == touched
+        assert adb.called('finish_broadcast') == [('finish_broadcast', 1, 'completed')]
+    asyncio.run(main())
+
+
+def test_database_error_saves_progress_and_releases_broadcast():
+    async def main():
+        adb, outbox = FakeBroadcastDatabase([1, 2, 3, 4, 5], fail_after=4), FakeOutbox()
+        state = make_state()
+        broadcaster = Broadcaster(outbox, adb=adb, batch_size=2, heartbeat_interval=0.01)
+        task = asyncio.create_task(broadcaster.run(state))
+        await asyncio.sleep(0)
+        # Первая пачка отправлена целиком, из второй — одно сообщение; чтение третьей падает
+        outbox.deliver(1, 2, 3)
+        await asyncio.wait_for(task, 1)
+        # Отправленное попало в контрольную точку, неотправленное снято с очереди
+        assert outbox.queued[4].cancelled()
+        assert (state.last_user_id, state.sent) == (3, 3)
+        assert adb.called('save_progress') == [('save_progress', 1, 2, 2, 0), ('save_progress', 1, 3, 3, 0)]
+        assert adb.called('release_broadcast') == [('release_broadcast', 1)]
+        assert not adb.called('finish_broadcast')
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+import asyncio
+
+import cache
+from cache import LRUCache, TTLCache
+from profiles import ProfileCache, UserProfile
+
+
+# Часы, которыми управляет тест, вместо time.monotonic
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def use_clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    return clock
+
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    clock = use_clock(monkeypatch)
+    ttl_cache = TTLCache(ttl=10)
+    ttl_cache.set('a', 1)
+    clock.now = 9.9
+    assert ttl_cache.get('a') == 1
+    clock.now = 10
+    assert ttl_cache.get('a') is None
+    assert ttl_cache.stats()['hits'] == 1
+    assert ttl_cache.stats()['misses'] == 1
+
+
+def test_value_loaded_before_invalidation_is_not_stored():
+    ttl_cache = TTLCache(ttl=10)
+    generation = ttl_cache.generation
+    ttl_cache.invalidate('a')
+    ttl_cache.set('a', 'stale', generation)
+    assert ttl_cache.get('a') is None
+    ttl_cache.set('a', 'fresh', ttl_cache.generation)
+    assert ttl_cache.get('a') == 'fresh'
+
+
+def test_clear_drops_entries_and_bumps_generation():
+    ttl_cache = TTLCache(ttl=10)
+    ttl_cache.set('a', 1)
+    generation = ttl_cache.generation
+    ttl_cache.clear()
+    assert ttl_cache.get('a') is None
+    assert ttl_cache.generation != generation
+
+
+def test_purge_removes_expired_entries(monkeypatch):
+    clock = use_clock(monkeypatch)
+    ttl_cache = TTLCache(ttl=1)
+    for i in range(cache.PURGE_EVERY - 1):
+        ttl_cache.set(i, i)
+    clock.now = 2
+    ttl_cache.set('last', 1)
+    assert list(ttl_cache.data) == ['last']
+
+
+def test_lru_cache_evicts_least_recently_used():
+    lru = LRUCache(ttl=10, maxsize=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert lru.get('a') == 1
+    assert lru.get('c') == 3
+    assert lru.stats()['evictions'] == 1
+
+
+def test_lru_cache_keeps_generation_guard():
+    lru = LRUCache(ttl=10, maxsize=2)
+    generation = lru.generation
+    lru.invalidate('a')
+    lru.set('a', 'stale', generation)
+    assert lru.get('a') is None
+
+
+# AsyncDatabase, который отвечает без БД и считает загрузки; release задерживает ответ
+class FakeAsyncDatabase:
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def run(self, func, user_id):
+        self.calls += 1
+        call = self.calls
+        await self.release.wait()
+        return UserProfile(f"User {user_id} #{call}", True, 'client')
+
+
+def test_profile_cache_loads_once_for_concurrent_misses():
+    async def main():
+        adb = FakeAsyncDatabase()
+        profiles = ProfileCache(adb, ttl=10, maxsize=10)
+        results = await asyncio.gather(*(profiles.get(1) for _ in range(10)))
+        return adb, profiles, results
+
+    adb, profiles, results = asyncio.run(main())
+    assert adb.calls == 1
+    assert all(profile is results[0] for profile in results)
+    assert profiles.stats()['coalesced'] == 9
+    assert profiles.loading == {}
+
+
+def test_profile_cache_does_not_reuse_load_started_before_invalidation():
+    async def main():
+        adb = FakeAsyncDatabase()
+        adb.release.clear()
+        profiles = ProfileCache(adb, ttl=10, maxsize=10)
+        before = asyncio.ensure_future(profiles.get(1))
+        await asyncio.sleep(0)
+        profiles.invalidate(1)
+        after = asyncio.ensure_future(profiles.get(1))
+        await asyncio.sleep(0)
+        adb.release.set()
+        return adb, profiles, await before, await after
+
+    adb, profiles, before, after = asyncio.run(main())
+    assert adb.calls == 2
+    assert before.full_name == "User 1 #1"
+    assert after.full_name == "User 1 #2"
+    assert profiles.cache.get(1) is after
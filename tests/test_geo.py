@@ -0,0 +1,50 @@
+import math
+
+import pytest
+
+from geo import Geocoder, project, street_key, unproject
+
+CENTER = (55.7558, 37.6173)
+
+
+@pytest.mark.parametrize('text', ["ул. Ленина, д. 5", "Ленина улица 5", "  ЛЕНИНА  "])
+def test_street_key_ignores_street_type_and_house_number(text):
+    assert street_key(text) == "ленина"
+
+
+def test_street_key_keeps_compound_names_and_normalizes_yo():
+    assert street_key("проспект Мира-Королёва") == "мира-королева"
+
+
+def test_project_round_trip():
+    x, y = project(55.8, 37.7, CENTER)
+    assert unproject(x, y, CENTER) == pytest.approx((55.8, 37.7))
+    # Один градус широты — около 111 км
+    assert project(CENTER[0] + 1, CENTER[1], CENTER) == pytest.approx((0, 111.195))
+
+
+def test_locate_finds_street_in_any_part_of_address():
+    geocoder = Geocoder({street_key("Тверская"): (55.76, 37.61)}, hash_fallback=False)
+    assert geocoder.locate("г. Москва, ул. Тверская, 7") == (55.76, 37.61)
+    assert geocoder.locate("ул. Неизвестная, 1") is None
+
+
+@pytest.mark.parametrize("address", [None, "", "   "])
+def test_locate_returns_none_for_empty_address(address):
+    assert Geocoder({}, hash_fallback=True).locate(address) is None
+
+
+def test_hash_fallback_is_deterministic_and_inside_city_radius():
+    geocoder = Geocoder({}, hash_fallback=True, center=CENTER, radius_km=20)
+    point = geocoder.locate("ул. Неизвестная, 1")
+    assert point == geocoder.locate("  ул.  Неизвестная,   1 ")
+    assert point != geocoder.locate("ул. Неизвестная, 2")
+    x, y = project(*point, CENTER)
+    assert math.hypot(x, y) <= 20
+
+
+def test_from_file_skips_comments(tmp_path):
+    path = tmp_path / "streets.csv"
+    path.write_text("# улица;широта;долгота\nул. Тверская;55.76;37.61\n", encoding='utf-8')
+    geocoder = Geocoder.from_file(path, hash_fallback=False)
+    assert geocoder.streets == {"тверская": (55.76, 37.61)}
@@ -0,0 +1,20 @@
+import pytest
+
+import benchmark
+from database import Database
+
+
+# 100 тыс. заявок достаточно, чтобы планировщик выбирал те же индексы, что и на большой базе
+@pytest.fixture(scope='module')
+def seeded(database):
+    benchmark.seed_requests(100000, users=20000)
+    yield
+    benchmark.cleanup_seed()
+
+
+def test_hot_queries_use_expected_indexes(seeded):
+    with Database() as cursor:
+        results = benchmark.check_hot_query_indexes(cursor)
+    wrong = [f"{name}: expected {index}, got {', '.join(sorted(used)) or plan['Node Type']}"
+             for name, index, used, plan in results if index not in used]
+    assert not wrong, "\n".join(wrong)
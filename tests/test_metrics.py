@@ -0,0 +1,57 @@
+import pytest
+
+from metrics import BUCKETS, Histogram, Metrics, query_label
+
+
+def test_query_label_hides_literals_and_collapses_values_lists():
+    query = "INSERT INTO users (telegram_id, full_name) VALUES (1, 'a'), (2, 'b''c')"
+    assert query_label(query) == "INSERT INTO users (telegram_id, full_name) VALUES (...)"
+
+
+def test_query_label_normalizes_whitespace_and_keeps_placeholders():
+    query = """
+        SELECT id FROM requests
+        WHERE master_id = %s   AND status != 'completed'
+        LIMIT 20
+    """
+    assert query_label(query) == "SELECT id FROM requests WHERE master_id = %s AND status != ? LIMIT ?"
+
+
+def test_query_label_is_truncated():
+    assert len(query_label("SELECT " + "x, " * 200 + "y")) == 120
+
+
+def test_quantile_interpolates_inside_bucket():
+    histogram = Histogram()
+    for _ in range(10):
+        histogram.observe(0.003)  # интервал (0.0025, 0.005]
+    assert histogram.quantile(0.5) == pytest.approx(0.0025 + 0.0025 * 0.5)
+    assert histogram.count == 10
+    assert histogram.sum == pytest.approx(0.03)
+
+
+def test_quantile_picks_bucket_by_rank():
+    histogram = Histogram()
+    for value in [0.0001] * 98 + [2.0] * 2:
+        histogram.observe(value)
+    assert histogram.quantile(0.5) <= BUCKETS[0]
+    assert 1.0 < histogram.quantile(0.99) <= 2.5
+
+
+def test_quantile_of_values_above_last_bucket_and_of_empty_histogram():
+    histogram = Histogram()
+    assert histogram.quantile(0.99) == 0.0
+    histogram.observe(100)
+    assert histogram.quantile(0.99) == BUCKETS[-1]
+
+
+def test_expose_writes_cumulative_buckets_and_counters():
+    registry = Metrics()
+    registry.observe('bot_handler_seconds', 0.002, handler='start')
+    registry.observe('bot_handler_seconds', 0.02, handler='start')
+    registry.inc('db_rows_total', 3, query='SELECT "x"')
+    text = registry.expose()
+    assert 'bot_handler_seconds_bucket{handler="start",le="0.0025"} 1' in text
+    assert 'bot_handler_seconds_bucket{handler="start",le="+Inf"} 2' in text
+    assert 'bot_handler_seconds_count{handler="start"} 2' in text
+    assert 'db_rows_total{query="SELECT \\"x\\""} 3' in text
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from outbox import Outbox, TokenBucket
+
+
+# Bot, который записывает отправленные сообщения; errors — исключения для первых попыток по тексту
+class FakeBot:
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        pending = self.errors.get(text)
+        if pending:
+            raise pending.pop(0)
+        self.sent.append((chat_id, text))
+        return len(self.sent)
+
+
+def retry_after(seconds):
+    return TelegramRetryAfter(method=SendMessage(chat_id=1, text=''), message='Too Many Requests', retry_after=seconds)
+
+
+def network_error():
+    return TelegramNetworkError(method=SendMessage(chat_id=1, text=''), message='connection reset')
+
+
+# Запускает Outbox, выполняет body(outbox) и ждёт, пока очередь опустеет
+def run_outbox(bot, body, **kwargs):
+    async def main():
+        kwargs.setdefault('global_rate', 1000)
+        kwargs.setdefault('chat_rate', 1000)
+        outbox = Outbox(bot, **kwargs)
+        task = asyncio.create_task(outbox.run())
+        try:
+            result = await body(outbox)
+            await asyncio.wait_for(outbox.join(), 5)
+            return outbox, result
+        finally:
+            task.cancel()
+    return asyncio.run(main())
+
+
+def test_token_bucket_refills_at_rate_up_to_capacity():
+    bucket = TokenBucket(rate=2, capacity=3, now=0)
+    for _ in range(3):
+        assert bucket.wait_time(0) == 0
+        bucket.consume()
+    assert bucket.wait_time(0) == pytest.approx(0.5)
+    assert bucket.wait_time(0.5) == 0
+    assert bucket.is_full(100)
+    assert bucket.tokens == 3
+
+
+def test_token_bucket_block_delays_until_retry_after():
+    bucket = TokenBucket(rate=1, capacity=3, now=0)
+    bucket.block(0, 5)
+    assert bucket.wait_time(0) == pytest.approx(5)
+    assert bucket.wait_time(5) == 0
+
+
+def test_messages_to_one_chat_keep_order():
+    bot = FakeBot()
+
+    async def body(outbox):
+        for i in range(5):
+            outbox.send(1, f"a{i}")
+            outbox.send(2, f"b{i}")
+        return None
+
+    outbox, _ = run_outbox(bot, body)
+    assert [text for chat, text in bot.sent if chat == 1] == [f"a{i}" for i in range(5)]
+    assert [text for chat, text in bot.sent if chat == 2] == [f"b{i}" for i in range(5)]
+    assert outbox.stats()['sent'] == 10
+
+
+def test_bulk_messages_wait_for_regular_ones():
+    bot = FakeBot()
+
+    async def body(outbox):
+        outbox.send(1, "bulk 1", bulk=True)
+        outbox.send(2, "bulk 2", bulk=True)
+        outbox.send(3, "regular")
+
+    run_outbox(bot, body)
+    assert bot.sent[0] == (3, "regular")
+
+
+def test_rate_limited_message_is_retried_before_the_next_one():
+    bot = FakeBot({"first": [retry_after(0)]})
+
+    async def body(outbox):
+        return [outbox.send(1, "first"), outbox.send(1, "second")]
+
+    outbox, futures = run_outbox(bot, body)
+    assert bot.sent == [(1, "first"), (1, "second")]
+    assert [future.result() for future in futures] == [1, 2]
+    assert outbox.metrics['rate_limited'] == 1
+    assert outbox.metrics['retried'] == 1
+
+
+def test_network_error_backs_off_exponentially():
+    bot = FakeBot({"text": [network_error()]})
+
+    async def main():
+        outbox = Outbox(bot, global_rate=1000, chat_rate=1000)
+        outbox.send(1, "text")
+        outbox._dispatch()
+        await asyncio.gather(*outbox.sending)
+        return outbox
+
+    outbox = asyncio.run(main())
+    assert bot.sent == []
+    # Первая неудача — повтор через 2 ** 1 секунды, сообщение снова в голове очереди чата
+    assert outbox.chat_buckets[1].wait_time(outbox.chat_buckets[1].updated) == pytest.approx(2, abs=0.1)
+    assert [message.text for message in outbox.ready[1]] == ["text"]
+    assert outbox.metrics['retried'] == 1
+
+
+def test_network_error_after_max_retries_fails_the_future():
+    bot = FakeBot({"text": [network_error()]})
+
+    async def body(outbox):
+        return outbox.send(1, "text")
+
+    outbox, future = run_outbox(bot, body, max_retries=0)
+    assert isinstance(future.exception(), TelegramNetworkError)
+    assert outbox.metrics['failed'] == 1
+
+
+def test_cancelled_message_is_skipped():
+    bot = FakeBot()
+
+    async def body(outbox):
+        outbox.send(1, "kept", bulk=True)
+        outbox.send(2, "dropped", bulk=True).cancel()
+
+    outbox, _ = run_outbox(bot, body)
+    assert bot.sent == [(1, "kept")]
+    assert outbox.metrics['cancelled'] == 1
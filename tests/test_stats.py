@@ -0,0 +1,51 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from stats import Analytics
+
+START = datetime(2024, 3, 10, 0, 0, tzinfo=timezone.utc)
+HOUR = timedelta(hours=1)
+
+
+def test_bucket_start_truncates_in_utc():
+    moment = datetime(2024, 3, 10, 5, 30, 15, tzinfo=timezone(timedelta(hours=3)))
+    assert Analytics.bucket_start(moment, 'hour') == datetime(2024, 3, 10, 2, 0, tzinfo=timezone.utc)
+    assert Analytics.bucket_start(moment, 'day') == datetime(2024, 3, 10, 0, 0, tzinfo=timezone.utc)
+
+
+def test_rollup_rows_fill_their_buckets_and_missing_buckets_are_zero():
+    rows = [
+        # hour, created, completed, completion_seconds, reports, busy_seconds
+        (START + HOUR, 4, 2, 2 * 5400, 1, 0),
+        (START - HOUR, 100, 100, 100, 100, 0),  # до начала графика — не попадает
+    ]
+    analytics = Analytics('hour', 3, START, START + 3 * HOUR, rows, [])
+    assert analytics.buckets == [START, START + HOUR, START + 2 * HOUR]
+    assert analytics.created == [0, 4, 0]
+    assert analytics.completed == [0, 2, 0]
+    assert analytics.reports == [0, 1, 0]
+    assert analytics.avg_completion == [None, 1.5, None]
+
+
+def test_daily_rows_keyed_by_date():
+    rows = [(date(2024, 3, 11), 7, 0, 0, 0, 0)]
+    analytics = Analytics('day', 2, START, START + timedelta(days=2), rows, [])
+    assert analytics.created == [0, 7]
+
+
+def test_utilization_counts_requests_still_in_progress():
+    now = START + 2.5 * HOUR
+    # Одна заявка взята в работу в начале графика, другая — в середине второго часа
+    in_progress = [
+        (START, 1, START.timestamp()),
+        (START + HOUR, 1, (START + 1.5 * HOUR).timestamp()),
+    ]
+    analytics = Analytics('hour', 3, START, now, [], in_progress)
+    assert analytics.utilization == pytest.approx([1.0, 1.5, 2.0])
+
+
+def test_utilization_adds_finished_busy_time():
+    rows = [(START, 1, 1, 1800, 0, 1800)]
+    analytics = Analytics('hour', 1, START, START + HOUR, rows, [])
+    assert analytics.utilization == pytest.approx([0.5])
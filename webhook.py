@@ -0,0 +1,209 @@
+import os
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from collections import OrderedDict
+import psycopg2
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import setup_application
+from database import Database, AsyncDatabase
+import metrics
+
+# Приём обновлений через webhook вместо long polling.
+# Запуск: python webhook.py --workers 4 (или переменные WEBHOOK_*), регистрация webhook в Telegram —
+# при заданном WEBHOOK_URL. Несколько процессов слушают один порт (SO_REUSEPORT), ядро распределяет
+# между ними соединения; состояния диалогов общие (PostgresStorage), повторы обновлений отсекаются по update_id.
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '1'))
+# Сколько обновлений процесс обрабатывает одновременно; сверх этого отвечает 503, и Telegram повторит позже
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv('WEBHOOK_MAX_IN_FLIGHT', '100'))
+# Сколько последних update_id процесс помнит сам, не обращаясь к БД
+DEDUP_CACHE_SIZE = 10000
+# Telegram повторяет недоставленные обновления не дольше суток
+PROCESSED_UPDATES_TTL = 24 * 3600
+PROCESSED_UPDATES_CLEANUP_INTERVAL = 3600
+
+
+class WebhookDatabase(Database):
+    # True, если обновление получено впервые (среди всех процессов)
+    @staticmethod
+    def claim_update(update_id):
+        with WebhookDatabase() as cursor:
+            cursor.execute("""
+                INSERT INTO processed_updates (update_id) VALUES (%s)
+                ON CONFLICT (update_id) DO NOTHING
+                RETURNING update_id
+            """, (update_id,))
+            return cursor.fetchone() is not None
+
+    @staticmethod
+    def delete_old_updates(ttl):
+        with WebhookDatabase() as cursor:
+            cursor.execute(
+                "DELETE FROM processed_updates WHERE received_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                (ttl,)
+            )
+            return cursor.rowcount
+
+
+# Обработчик POST от Telegram: проверяет секрет, отбрасывает повторы, сразу отвечает 200
+# и обрабатывает обновление в фоне, не больше max_in_flight одновременно.
+class WebhookHandler:
+    def __init__(self, dispatcher, bot, secret=WEBHOOK_SECRET, max_in_flight=WEBHOOK_MAX_IN_FLIGHT,
+                 adb=None, dedup_cache_size=DEDUP_CACHE_SIZE):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret = secret
+        self.max_in_flight = max_in_flight
+        self.adb = adb or AsyncDatabase(WebhookDatabase, max_workers=4)
+        self.dedup_cache_size = dedup_cache_size
+        self.recent = OrderedDict()
+        self.in_flight = 0
+        self.tasks = set()
+        self.metrics = {'received': 0, 'processed': 0, 'duplicates': 0, 'rejected': 0, 'errors': 0}
+
+    def remember(self, update_id):
+        self.recent[update_id] = None
+        if len(self.recent) > self.dedup_cache_size:
+            self.recent.popitem(last=False)
+
+    async def handle(self, request):
+        if self.secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret:
+            return web.Response(status=401)
+        update = await request.json()
+        update_id = update.get('update_id')
+        self.metrics['received'] += 1
+        if update_id in self.recent:
+            self.metrics['duplicates'] += 1
+            return web.Response()
+        if self.in_flight >= self.max_in_flight:
+            self.metrics['rejected'] += 1
+            return web.Response(status=503, headers={'Retry-After': '1'})
+
+        self.in_flight += 1
+        try:
+            is_new = await self.adb.claim_update(update_id)
+        except psycopg2.Error as e:
+            # Без БД повтор не отличить от нового обновления: лучше обработать дважды, чем потерять
+            logging.error(f"Database error: {e}")
+            is_new = True
+        if not is_new:
+            self.in_flight -= 1
+            self.metrics['duplicates'] += 1
+            self.remember(update_id)
+            return web.Response()
+        self.remember(update_id)
+        task = asyncio.create_task(self.process(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.Response()
+
+    async def process(self, update):
+        try:
+            await self.dispatcher.feed_raw_update(self.bot, update)
+            self.metrics['processed'] += 1
+        except Exception as e:
+            self.metrics['errors'] += 1
+            logging.error(f"Update {update.get('update_id')} processing error: {e}")
+        finally:
+            self.in_flight -= 1
+
+    async def cleanup_loop(self):
+        while True:
+            try:
+                deleted = await self.adb.delete_old_updates(PROCESSED_UPDATES_TTL)
+                if deleted:
+                    logging.info(f"Deleted {deleted} old processed updates")
+            except psycopg2.Error as e:
+                logging.error(f"Database error: {e}")
+            await asyncio.sleep(PROCESSED_UPDATES_CLEANUP_INTERVAL)
+
+    # Дожидается обновлений, принятых до остановки (Telegram их уже не повторит)
+    async def drain(self, timeout=30):
+        if self.tasks:
+            await asyncio.wait(list(self.tasks), timeout=timeout)
+        self.adb.shutdown()
+
+    def stats(self):
+        result = dict(self.metrics)
+        result['in_flight'] = self.in_flight
+        return result
+
+
+# Приложение aiohttp одного процесса; primary — процесс, который регистрирует webhook и чистит processed_updates
+def make_app(dispatcher, bot, path=WEBHOOK_PATH, primary=True, **handler_kwargs):
+    app = web.Application()
+    handler = WebhookHandler(dispatcher, bot, **handler_kwargs)
+    app['webhook_handler'] = handler
+    app.router.add_post(path, handler.handle)
+    # Метрики этого процесса (при нескольких процессах запрос попадает в любой из них, как и обновления;
+    # для сбора со всех — METRICS_PORT, см. run_worker)
+    metrics.add_routes(app)
+    metrics.metrics.add_collector('webhook', handler.stats)
+
+    async def on_startup(app):
+        if primary:
+            app['cleanup_task'] = asyncio.create_task(handler.cleanup_loop())
+            if WEBHOOK_URL:
+                await bot.set_webhook(
+                    WEBHOOK_URL.rstrip('/') + path,
+                    secret_token=handler.secret,
+                    max_connections=WEBHOOK_MAX_IN_FLIGHT,
+                    allowed_updates=dispatcher.resolve_used_update_types(),
+                )
+
+    async def on_shutdown(app):
+        if 'cleanup_task' in app:
+            app['cleanup_task'].cancel()
+        await handler.drain()
+
+    app.on_startup.append(on_startup)
+    # Сначала дожидаемся обработки принятых обновлений, затем останавливаем бота (dp.shutdown)
+    app.on_shutdown.append(on_shutdown)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+def run_worker(index, args):
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [worker {index}] %(levelname)s %(message)s")
+    # Процесс index отдаёт метрики на порту METRICS_PORT + index
+    if metrics.METRICS_PORT:
+        metrics.METRICS_PORT += index
+    # Бот импортируется в каждом процессе отдельно: свой цикл событий, пул соединений и очередь Outbox
+    from main import dp, bot
+    app = make_app(dp, bot, path=args.path, primary=index == 0)
+    web.run_app(app, host=args.host, port=args.port, reuse_port=args.workers > 1, print=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бот в режиме webhook")
+    parser.add_argument("--host", default=WEBHOOK_HOST)
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    parser.add_argument("--path", default=WEBHOOK_PATH)
+    parser.add_argument("--workers", type=int, default=WEBHOOK_WORKERS)
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        run_worker(0, args)
+        return
+    # Лимит Telegram на бота общий: делим его между процессами (outbox читает TG_GLOBAL_RATE при импорте)
+    os.environ['TG_GLOBAL_RATE'] = str(float(os.getenv('TG_GLOBAL_RATE', '30')) / args.workers)
+    workers = [multiprocessing.Process(target=run_worker, args=(index, args)) for index in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join(60)
+
+
+if __name__ == '__main__':
+    main()